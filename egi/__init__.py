@@ -1,14 +1,100 @@
 
 
-"""     
-    Python interface to interact with EGI Netstation     
+"""
+    Python interface to interact with EGI Netstation
 
-    simple.py is a wrapper for a single-threaded version,     
-    threaded.py is a, eh, threaded version,     
-    may be there would also be a "multiprocessed" one.     
+    simple.py is a wrapper for a single-threaded version,
+    threaded.py is a, eh, threaded version,
+    multiprocessed.py runs the sender in a separate process.
 
-    Some examples will either follow or live in some separate 
-    test files here .     
+    Some examples will either follow or live in some separate
+    test files here .
 
-"""     
+    'import egi' by itself loads nothing : the modules are imported
+    on the first access ( egi.simple, egi.threaded, egi.fake ... ) , and
 
+        ns_module = egi.backend()
+
+    picks the back-end named by the EGI_BACKEND environment variable
+    ( 'simple' if it is not set ) . egi.import_times() tells how long
+    the first load of every module has taken .
+
+"""
+
+import sys, os, time, types
+
+BACKENDS = ( 'simple', 'threaded', 'threaded_alt', 'multiprocessed', 'fake' )
+
+# what else is loaded on the first access
+_MODULES = BACKENDS + ( 'psychopy', 'coalesce', 'recorder', 'faults', 'decoder', 'trace', 'log',
+                        'queues', 'timeline', 'clock', 'socket_wrapper', 'fwhelper', 'eventlog', 'align',
+                        'harness' )
+
+ENV_BACKEND = 'EGI_BACKEND'
+DEFAULT_BACKEND = 'simple'
+
+# module name -> seconds ( the first load, with whatever it has pulled in that was not loaded yet )
+_import_times = {}
+
+
+def _load( name ) :
+    """ import the module of the package ( once ) and keep the time it took """
+
+    full_name = __name__ + '.' + name
+
+    module = sys.modules.get( full_name )
+    if module is not None :
+        return module
+
+    t_start = time.time()
+
+    __import__( full_name )
+
+    _import_times[ name ] = time.time() - t_start
+
+    return sys.modules[ full_name ]
+
+
+def backend( name = None ) :
+    """ the back-end module by its name , or by the EGI_BACKEND environment variable , or 'simple' """
+
+    if name is None :
+        name = os.environ.get( ENV_BACKEND ) or DEFAULT_BACKEND
+
+    if name not in BACKENDS :
+        raise ImportError( "no egi back-end '%s' ( there are : %s )" % ( name, ', '.join( BACKENDS ) ) )
+
+    return _load( name )
+
+
+def import_times() :
+    """ { module name : seconds } for the modules loaded through the package so far """
+
+    return dict( _import_times )
+
+
+# -----------------------------------------------------------------------------
+
+class _LazyPackage( types.ModuleType ) :
+    """ the package module that imports its modules on the first attribute access """
+
+    def __getattr__( self, name ) :
+
+        if name in _MODULES :
+            return _load( name )
+
+        raise AttributeError( "'module' object has no attribute '%s'" % ( name, ) )
+
+    def __dir__( self ) :
+
+        return sorted( set( self.__dict__.keys() ) | set( _MODULES ) )
+
+
+# take the place of this module ( the import system sets the submodules as attributes of sys.modules[ 'egi' ] )
+_package = _LazyPackage( __name__, __doc__ )
+_package.__dict__.update( sys.modules[ __name__ ].__dict__ )
+
+# keep the original alive : Python 2 clears the globals of a deleted module ( the functions above use them )
+_package._original = sys.modules[ __name__ ]
+
+sys.modules[ __name__ ] = _package
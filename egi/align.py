@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    Offline alignment of an event log ( eventlog.py ) to the Netstation timebase -- to correct
+    the event times after the session instead of trusting every sync() to be perfect .
+
+    Netstation places an event by its wire timestamp relative to the last 'T' it has got :
+    at the moment 'T' arrives it "is" T ms , so every event of that sync segment is placed
+    as late as the 'T' message was in transit ( about half the round trip , Cristian's estimate ) ;
+    and if the clock that stamps the events ( the wall clock for ms_localtime() ) runs at
+    a different rate than the monotonic one ( NTP slewing ) , the error grows within the segment .
+
+    For every sync segment the wire time is fitted as a line of the local monotonic time the stamp
+    was taken at ( 't_stamp_ns' of the event log -- not the write , which comes later by the time
+    the packing and the socket take ; least squares over the events of the segment and its two syncs ) :
+
+        wire - T  =  offset + ( 1 + drift ) * ( t_stamp - t_sync )          ( ms )
+
+    every event is then put on the Netstation timebase ( in wire ms ) :
+
+        aligned  =  T + ( the local time the wire stamp stands for - t_sync ) - rtt / 2
+
+    and 'correction' = aligned - wire is what to add to the time Netstation has recorded .
+    The residuals of the fit show how far each stamp is from the line ( the events stamped
+    ahead of sending , say by schedule_event() , stand out there ) .
+
+    The Netstation clock is taken to run at the rate of the local monotonic clock , and the two
+    directions of the link to take the same time -- the correction is good to the asymmetry
+    of the round trip ( see 'latency_ms' ) .
+
+    The drift is that of the stamping clock against the monotonic one : the timeline stamps
+    ( ms_now() ) are the monotonic clock itself , so it is zero for them by construction and only
+    the stamps by another clock ( ms_localtime() passed as 'timestamp' ) show one . The drift that
+    matters for the recording -- of the Netstation clock -- is only measured against the server clock
+    ( the times Netstation has recorded ) , it can not be seen in the local log .
+
+        log = ns.event_log()
+        result = egi.align.align_event_log( log )
+        print result.correction_ms.mean(), result.rms_ms
+
+    Needs numpy ; everything is vectorized ( a million events in about 0.1 s ) .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+from collections import namedtuple
+
+import numpy
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+# per event : 'segment' ( the index of the sync before the event , -1 before the first one ) ,
+#             'aligned_ms', 'correction_ms', 'residual_ms' ;
+# per segment : 'offset_ms', 'drift' ( a fraction : 1e-6 is 1 ppm ) , 'latency_ms' ( rtt / 2 ) ,
+#               'rms_ms' ( of the residuals ) , 'n' ( the points of the fit , the syncs included )
+Alignment = namedtuple( 'Alignment', 'segment aligned_ms correction_ms residual_ms offset_ms drift latency_ms rms_ms n' )
+
+# a wire value dropping by more than this is a wrap ( see timeline.py ) , not a point of the fit
+_WRAP_MS = 500000000
+
+# the drift is fitted only for the segments whose points spread over ( the equivalent of ) this time :
+# the wire values are whole ms , over a shorter span their rounding is all the slope would show
+MIN_SPAN_MS = 1000.0
+
+
+def align( sync_t_ns, sync_rtt_ns, sync_wire_ms, event_t_ns, event_wire_ms ) :
+    """
+        fit and map ( see above ) ; the syncs are ( the local send time in ns , the round trip in ns ,
+        the 'T' value ) , the events -- ( the local time of the stamp in ns , the wire timestamp ) ; any sequences
+        or numpy arrays , the syncs in the order sent .
+    """
+
+    st = numpy.asarray( sync_t_ns, dtype = numpy.float64 )
+    rtt = numpy.asarray( sync_rtt_ns, dtype = numpy.float64 )
+    sw = numpy.asarray( sync_wire_ms, dtype = numpy.float64 )
+
+    et = numpy.asarray( event_t_ns, dtype = numpy.float64 )
+    ew = numpy.asarray( event_wire_ms, dtype = numpy.float64 )
+
+    n_syncs = len( st )
+
+    if n_syncs == 0 :
+        raise Error( "no syncs to align the events to" )
+
+    if len( rtt ) != n_syncs or len( sw ) != n_syncs or len( et ) != len( ew ) :
+        raise Error( "the columns of the syncs ( or of the events ) differ in length" )
+
+    if n_syncs > 1 and numpy.any( numpy.diff( st ) < 0 ) :
+        raise Error( "the syncs are not in the order of sending" )
+
+    # the segment of every event ; the events before the first sync go with the first segment
+    segment = numpy.searchsorted( st, et, side = 'right' ) - 1
+    seg = numpy.maximum( segment, 0 )
+
+    # ms since the sync of the segment : x -- by the monotonic clock , y -- by the wire
+    x = ( et - st[ seg ] ) * 1e-6
+    y = ew - sw[ seg ]
+
+    # the closing sync of every segment is a point of its fit too ( unless the wire has wrapped )
+    cx = ( st[ 1: ] - st[ :-1 ] ) * 1e-6
+    cy = sw[ 1: ] - sw[ :-1 ]
+    closing = cy > -_WRAP_MS
+
+    cseg = numpy.arange( n_syncs - 1 )[ closing ]
+    cx = cx[ closing ]
+    cy = cy[ closing ]
+
+    # the least squares per segment , from the sums ; the opening sync is the point ( 0, 0 )
+    def sums( weights_events, weights_closing ) :
+        return numpy.bincount( seg, weights_events, n_syncs ) + numpy.bincount( cseg, weights_closing, n_syncs )
+
+    n = numpy.bincount( seg, minlength = n_syncs ) + numpy.bincount( cseg, minlength = n_syncs ) + 1.0
+    sx = sums( x, cx )
+    sy = sums( y, cy )
+    sxx = sums( x * x, cx * cx )
+    sxy = sums( x * y, cx * cy )
+
+    det = n * sxx - sx * sx
+
+    # det / n^2 is the variance of x ; for the points spread evenly over a span L it is L^2 / 12
+    fitted = det > ( n * MIN_SPAN_MS ) ** 2 / 12.0
+    slope = numpy.ones( n_syncs )
+    slope[ fitted ] = ( n[ fitted ] * sxy[ fitted ] - sx[ fitted ] * sy[ fitted ] ) / det[ fitted ]
+
+    offset = ( sy - slope * sx ) / n
+
+    residual = y - ( offset[ seg ] + slope[ seg ] * x )
+
+    # the rms over the events and the closing syncs ( the opening one adds its own residual )
+    ss = numpy.bincount( seg, residual * residual, n_syncs )
+    ss += numpy.bincount( cseg, ( cy - ( offset[ cseg ] + slope[ cseg ] * cx ) ) ** 2, n_syncs )
+    ss += offset * offset
+    rms = numpy.sqrt( ss / n )
+
+    # the moment the wire stamp stands for ( by the monotonic clock , ms since the sync )
+    x_stamp = ( y - offset[ seg ] ) / slope[ seg ]
+
+    latency = rtt * 0.5e-6
+
+    aligned = sw[ seg ] + x_stamp - latency[ seg ]
+
+    return Alignment( segment = segment, aligned_ms = aligned, correction_ms = aligned - ew, residual_ms = residual,
+                      offset_ms = offset, drift = slope - 1.0, latency_ms = latency, rms_ms = rms, n = n.astype( numpy.int64 ) )
+
+
+def align_event_log( log ) :
+    """ align() the events and the syncs of an eventlog.EventLog """
+
+    events = log.arrays()
+    syncs = log.sync_arrays()
+
+    n = len( log )
+
+    return align( numpy.frombuffer( syncs[ 't_send_ns' ], dtype = numpy.float64 ),
+                  numpy.frombuffer( syncs[ 'rtt_ns' ], dtype = numpy.float64 ),
+                  numpy.frombuffer( syncs[ 'wire_ms' ], dtype = numpy.uint32 ),
+                  numpy.frombuffer( events[ 't_stamp_ns' ], dtype = numpy.float64, count = n ),
+                  numpy.frombuffer( events[ 'wire_ms' ], dtype = numpy.uint32, count = n ) )
+
+
+def align_npz( path ) :
+    """ align() the events and the syncs of an event log exported to .npz """
+
+    data = numpy.load( path )
+
+    events = data[ 'events' ]
+    syncs = data[ 'syncs' ]
+
+    # the logs exported before the stamp times were kept have only the send times
+    t_stamp = 't_stamp_ns' if 't_stamp_ns' in events.dtype.names else 't_local_ns'
+
+    return align( syncs[ 't_send_ns' ], syncs[ 'rtt_ns' ], syncs[ 'wire_ms' ], events[ t_stamp ], events[ 'wire_ms' ] )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
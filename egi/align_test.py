@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" align.py ( needs numpy ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+try :
+    import numpy
+    import align
+except ImportError :
+    numpy = None
+
+from eventlog import EventLog
+
+
+# two syncs 10 s apart , 2 ms round trips ; the events every 100 ms in between
+SYNC_T_NS = [ 0.0, 10e9 ]
+SYNC_RTT_NS = [ 2e6, 2e6 ]
+EVENT_T_NS = [  i * 100e6  for i in xrange( 1, 100 )  ]
+
+
+@unittest.skipIf( numpy is None, "numpy is not installed" )
+class AlignTest( unittest.TestCase ) :
+
+    def test_exact_stamps( self ) :
+
+        wire = [  1000 + t * 1e-6  for t in EVENT_T_NS  ]
+
+        result = align.align( SYNC_T_NS, SYNC_RTT_NS, [ 1000, 11000 ], EVENT_T_NS, wire )
+
+        self.assertEqual( list( result.segment ), [ 0 ] * len( wire ) )
+        self.assertTrue( numpy.allclose( result.residual_ms, 0.0 ) )
+        self.assertTrue( numpy.allclose( result.drift, 0.0 ) )
+
+        # half the round trip in transit
+        self.assertTrue( numpy.allclose( result.correction_ms, -1.0 ) )
+        self.assertEqual( result.n[0], len( wire ) + 2 )
+
+    def test_drift( self ) :
+
+        rate = 1 + 100e-6 # the stamping clock runs 100 ppm fast
+
+        wire = [  1000 + t * 1e-6 * rate  for t in EVENT_T_NS  ]
+
+        result = align.align( SYNC_T_NS, [ 0.0, 0.0 ], [ 1000, 1000 + 10000 * rate ], EVENT_T_NS, wire )
+
+        self.assertAlmostEqual( result.drift[0], 100e-6, places = 9 )
+        self.assertTrue( numpy.allclose( result.aligned_ms, [  1000 + t * 1e-6  for t in EVENT_T_NS  ] ) )
+
+    def test_wrap_not_fitted( self ) :
+
+        # the wire has been rebased at the second sync : its closing point is left out
+        wire = [  1000000000 + t * 1e-6  for t in EVENT_T_NS  ]
+
+        result = align.align( SYNC_T_NS, SYNC_RTT_NS, [ 1000000000, 5 ], EVENT_T_NS, wire )
+
+        self.assertEqual( result.n[0], len( wire ) + 1 )
+        self.assertTrue( numpy.allclose( result.residual_ms, 0.0 ) )
+
+    def test_segments( self ) :
+
+        result = align.align( [ 1e9, 2e9 ], [ 0.0, 0.0 ], [ 1000, 2000 ], [ 0.5e9, 1.5e9, 2.5e9 ], [ 500, 1500, 2500 ] )
+
+        self.assertEqual( list( result.segment ), [ -1, 0, 1 ] )
+
+    def test_errors( self ) :
+
+        self.assertRaises( align.Error, align.align, [], [], [], [ 0.0 ], [ 0 ] )
+        self.assertRaises( align.Error, align.align, [ 0.0 ], [ 0.0, 0.0 ], [ 0 ], [], [] )
+        self.assertRaises( align.Error, align.align, [ 1.0, 0.0 ], [ 0.0, 0.0 ], [ 0, 0 ], [], [] )
+
+    def test_event_log( self ) :
+
+        log = EventLog()
+
+        for t_ns, wire_ms in zip( SYNC_T_NS, [ 1000, 11000 ] ) :
+            log.add_sync( t_ns, 2e6, wire_ms )
+
+        for t_ns in EVENT_T_NS :
+            log.append( 'stim', t_ns, 1000 + int( t_ns * 1e-6 ) )
+
+        result = align.align_event_log( log )
+
+        self.assertTrue( numpy.allclose( result.correction_ms, -1.0 ) )
+
+    def test_event_log_written_late( self ) :
+
+        log = EventLog()
+
+        for t_ns, wire_ms in zip( SYNC_T_NS, [ 1000, 11000 ] ) :
+            log.add_sync( t_ns, 2e6, wire_ms )
+
+        # every write 0.8 ms after the stamp : the fit goes by the stamp
+        for t_ns in EVENT_T_NS :
+            log.append( 'stim', t_ns + 0.8e6, 1000 + int( t_ns * 1e-6 ), t_stamp_ns = t_ns )
+
+        result = align.align_event_log( log )
+
+        self.assertTrue( numpy.allclose( result.correction_ms, -1.0 ) )
+        self.assertTrue( numpy.allclose( result.drift, 0.0 ) )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A monotonic clock with nanosecond units for the timing diagnostics
+    ( captures, traces, latency measurements ) .
+
+    time.time() may jump when the system clock is adjusted, and Python 2
+    has no time.monotonic() -- so we use whatever the platform offers .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import sys, time
+
+# -----------------------------------------------------------------------------
+
+def _make_ns_monotonic() :
+    """ pick the best monotonic clock available """
+
+    if hasattr( time, 'monotonic_ns' ) : # Python 3.7+
+        return time.monotonic_ns
+
+    if hasattr( time, 'perf_counter' ) : # Python 3.3+
+
+        perf_counter = time.perf_counter
+        return lambda : int( perf_counter() * 1000000000 )
+
+    if sys.platform == 'win32' : # QueryPerformanceCounter() behind the scenes
+
+        clock = time.clock
+        return lambda : int( clock() * 1000000000 )
+
+    # POSIX : clock_gettime( CLOCK_MONOTONIC ) through ctypes
+    try :
+
+        import ctypes, ctypes.util
+
+        class _timespec( ctypes.Structure ) :
+            _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+
+        libname = ctypes.util.find_library( 'rt' ) or ctypes.util.find_library( 'c' )
+        clock_gettime = ctypes.CDLL( libname ).clock_gettime
+        clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER( _timespec ) ]
+
+        CLOCK_MONOTONIC = 6 if sys.platform == 'darwin' else 1
+
+        if clock_gettime( CLOCK_MONOTONIC, ctypes.byref( _timespec() ) ) != 0 :
+            raise OSError( "clock_gettime() failed" )
+
+        byref = ctypes.byref
+
+        def ns_monotonic() :
+            # a new structure for every call : ctypes releases the GIL, so it cannot be shared between threads
+            ts = _timespec()
+            clock_gettime( CLOCK_MONOTONIC, byref( ts ) )
+            return ts.tv_sec * 1000000000 + ts.tv_nsec
+
+        return ns_monotonic
+
+    except ( ImportError, OSError, AttributeError, TypeError ) :
+
+        # the last resort
+        return lambda : int( time.time() * 1000000000 )
+
+
+# a monotonic time in nanoseconds ( the origin is arbitrary )
+ns_monotonic = _make_ns_monotonic()
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,31 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" clock.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import time
+
+from clock import ns_monotonic
+
+
+class MonotonicTest( unittest.TestCase ) :
+
+    def test_never_goes_back( self ) :
+
+        times = [  ns_monotonic()  for i in xrange( 10000 )  ]
+
+        self.assertEqual( times, sorted( times ) )
+
+    def test_nanoseconds( self ) :
+
+        t_start = ns_monotonic()
+        time.sleep( 0.05 )
+        elapsed = ns_monotonic() - t_start
+
+        self.assertTrue( 40e6 < elapsed < 1e9, elapsed )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A coalescing / decimating stage to put in front of the send_event() method
+    of any of the Netstation objects ( simple, threaded, multiprocessed, fake ) .
+
+    Every event costs a round trip and counts against the per-session event limit,
+    so for the per-frame markers ( a photodiode patch at 144 Hz, gaze-contingent
+    updates and such ) it is better to send one summary event per burst :
+
+        ns = egi.Netstation()
+        ...
+        stage = EventCoalescer( ns, window_ms = 100, keys = [ 'gaze' ] )
+
+        # every frame :
+        stage.send_event( 'gaze', table = { 'xpos' : x, 'ypos' : y } )
+        stage.poll()
+
+        # at the end of a block :
+        stage.flush()
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception and the timestamps
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+ms_localtime = internal.ms_localtime
+
+# -----------------------------------------------------------------------------
+
+#
+# the table keys of a summary event ( the fields of the events may not use them )
+#
+
+COUNT_KEY = 'cnt_'
+FIRST_KEY = 'tfst'
+LAST_KEY = 'tlst'
+
+_RESERVED_KEYS = frozenset( ( COUNT_KEY, FIRST_KEY, LAST_KEY ) )
+
+# a numeric field 'xpos' becomes 'xpo<' ( the minimum ) and 'xpo>' ( the maximum ) in a summary event
+MIN_MARK = '<'
+MAX_MARK = '>'
+
+
+def _is_numeric( value ) :
+    """ booleans are integers for Python, but not for us """
+
+    return isinstance( value, ( int, long, float ) ) and not isinstance( value, bool )
+
+
+def _range_keys( k ) :
+    """ the keys of the minimum and the maximum of the numeric field 'k' """
+
+    stem = internal.make_fit( str( k ) )[:3]
+
+    return stem + MIN_MARK, stem + MAX_MARK
+
+
+# -----------------------------------------------------------------------------
+
+class _Burst :
+    """ the accumulated state of the events with the same key inside one window """
+
+    def __init__( self, key, timestamp, label, description, table, pad ) :
+
+        self.key = key
+        self.label = label
+        self.description = description
+        self.pad = pad
+
+        self.count = 1
+        self.first = timestamp
+        self.last = timestamp
+
+        self.table = table
+
+        # numeric field -> [ min, max ] ; other fields keep their last value
+        self.ranges = {}
+        self.others = {}
+
+        if table :
+            self._add_table( table )
+
+    def _add_table( self, table ) :
+
+        for k, v in table.iteritems() :
+
+            if internal.make_fit( str( k ) ) in _RESERVED_KEYS :
+                raise Error( "'%s': the key '%s' is taken by the summary event ( %s )" % ( self.key, k, ', '.join( sorted( _RESERVED_KEYS ) ) ) )
+
+            if _is_numeric( v ) :
+
+                r = self.ranges.get( k )
+                if r is None :
+                    self.ranges[k] = [ v, v ]
+                elif v < r[0] :
+                    r[0] = v
+                elif v > r[1] :
+                    r[1] = v
+
+            else :
+
+                self.others[k] = v
+
+    def add( self, timestamp, table ) :
+        """ account for one more event of the burst """
+
+        self.count += 1
+        self.last = timestamp
+
+        if table :
+            self._add_table( table )
+
+    def summary_table( self ) :
+        """
+            the table of the summary event : the count, the first and the last timestamps ,
+            the minimum and the maximum of every numeric field ( see _range_keys() ) ,
+            the last values of the other fields ;
+
+            raises an exception if two of these end up with the same key .
+        """
+
+        table = {}
+
+        def put( k, v, source ) :
+
+            fitted = internal.make_fit( str( k ) )
+            if fitted in owners :
+                raise Error( "'%s': the summary fields of '%s' and '%s' would both be sent as '%s'" % ( self.key, owners[ fitted ], source, fitted ) )
+
+            owners[ fitted ] = source
+            table[k] = v
+
+        owners = {}
+
+        put( COUNT_KEY, self.count, COUNT_KEY )
+        put( FIRST_KEY, self.first, FIRST_KEY )
+        put( LAST_KEY, self.last, LAST_KEY )
+
+        for k, v in self.others.iteritems() :
+            put( k, v, k )
+
+        for k, ( lo, hi ) in self.ranges.iteritems() :
+
+            k_min, k_max = _range_keys( k )
+
+            put( k_min, lo, k )
+            put( k_max, hi, k )
+
+        return table
+
+
+# -----------------------------------------------------------------------------
+
+class EventCoalescer :
+
+    """ wraps the send_event() method of a Netstation object , coalescing and decimating the events """
+
+    def __init__( self, netstation, window_ms = 50, keys = None, decimate = None ) :
+        """
+            -- 'netstation' -- the object to send the events through ;
+            -- 'window_ms' -- the events with the same key arriving within this many milliseconds
+                              from the first one are sent as one summary event ;
+            -- 'keys' -- the event keys to coalesce ( None means "all of them" ) ,
+                         the events with other keys are sent as is ;
+            -- 'decimate' -- a dictionary { key : n } , only every n-th event with the given key
+                             is passed on ( the rest are dropped before coalescing ) .
+
+            A burst of a single event is sent unchanged ; a bigger one becomes an event
+            timestamped with the first event time, with the label and description of the
+            first event and the table described in _Burst.summary_table() .
+        """
+
+        if window_ms < 0 :
+            raise Error( "the coalescing window should not be negative, not %s" % ( window_ms, ) )
+
+        self._netstation = netstation
+        self._window_ms = window_ms
+
+        # the clock of the connection if the back-end has one ( see simple.Netstation.ms_now() )
+        self._ms_now = getattr( netstation, 'ms_now', ms_localtime )
+
+        self._keys = None if keys is None else frozenset( keys )
+        self._decimate = dict( decimate or {} )
+
+        for key, n in self._decimate.iteritems() :
+            if n < 1 :
+                raise Error( "'%s': the decimation factor should be at least 1, not %s" % ( key, n ) )
+
+        self._bursts = {} # key -> _Burst
+
+        # key -> [ events in, events dropped by decimation, events sent ]
+        self._counters = {}
+
+    ## -----------------------------------------------------------
+
+    def _count( self, key ) :
+
+        counters = self._counters.get( key )
+        if counters is None :
+            counters = self._counters[ key ] = [ 0, 0, 0 ]
+
+        return counters
+
+    def _send( self, key, timestamp, label, description, table, pad ) :
+
+        self._count( key )[2] += 1
+
+        return self._netstation.send_event( key, timestamp, label, description, table, pad )
+
+    def _flush_burst( self, burst ) :
+
+        del self._bursts[ burst.key ]
+
+        if burst.count == 1 :
+            return self._send( burst.key, burst.first, burst.label, burst.description, burst.table, burst.pad )
+
+        return self._send( burst.key, burst.first, burst.label, burst.description, burst.summary_table(), burst.pad )
+
+    ## -----------------------------------------------------------
+
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+        """
+            the same arguments as for the send_event() of the Netstation objects ;
+
+            nb. the events are sent later than they arrive, so if 'timestamp' is None
+                it is taken at the moment of the call .
+        """
+
+        if timestamp is None :
+            timestamp = self._ms_now()
+
+        counters = self._count( key )
+        counters[0] += 1
+
+        n = self._decimate.get( key )
+        if n is not None and ( counters[0] - 1 ) % n != 0 :
+            counters[1] += 1
+            return None
+
+        if self._keys is not None and key not in self._keys :
+            return self._send( key, timestamp, label, description, table, pad )
+
+        burst = self._bursts.get( key )
+
+        if burst is not None :
+
+            # a negative delta : the timeline has been rebased since the burst began
+            if 0 <= timestamp - burst.first < self._window_ms :
+                burst.add( timestamp, table )
+                return None
+
+            # else the window is over
+            self._flush_burst( burst )
+
+        self._bursts[ key ] = _Burst( key, timestamp, label, description, table, pad )
+
+    def poll( self, now = None ) :
+        """
+            send the bursts whose window is over ; to be called regularly ( say, once per frame ) ,
+            otherwise the last burst of a key is sent only with the next event of the same key .
+        """
+
+        if not self._bursts :
+            return
+
+        if now is None :
+            now = self._ms_now()
+
+        for burst in self._bursts.values() :
+
+            delta = now - burst.first
+            if delta < 0 or delta >= self._window_ms :
+                self._flush_burst( burst )
+
+    def flush( self ) :
+        """ send all the pending bursts ( say, at the end of a block or before a rollover ) """
+
+        for burst in sorted( self._bursts.values(), key = lambda b : b.first ) :
+            self._flush_burst( burst )
+
+    ## -----------------------------------------------------------
+
+    def pending( self ) :
+        """ the number of the events waiting in the bursts """
+
+        return sum( burst.count for burst in self._bursts.itervalues() )
+
+    def stats( self ) :
+        """ returns { key : ( events in, events dropped by decimation, events sent ) } """
+
+        return dict(  ( key, tuple( c ) ) for key, c in self._counters.iteritems()  )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" coalesce.py with the fake back-end ( the recorder ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import coalesce
+from coalesce import EventCoalescer, COUNT_KEY, FIRST_KEY, LAST_KEY
+import fake
+from decoder import table_dict as _table
+
+
+class EventCoalescerTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        self.ns = fake.Netstation( recorder = True )
+        self.stage = EventCoalescer( self.ns, window_ms = 100, keys = [ 'gaze' ] )
+
+    def test_summary( self ) :
+
+        for i, x in enumerate( ( 3, 1, 2 ) ) :
+            self.stage.send_event( 'gaze', 1000 + i, table = { 'xpos' : x, 'eye_' : 'left' } )
+
+        self.stage.flush()
+
+        event, = self.ns.recorder().events( 'gaze' )
+        table = _table( event )
+
+        self.assertEqual( event.timestamp, 1000 )
+        self.assertEqual( table[ COUNT_KEY ], 3 )
+        self.assertEqual( table[ FIRST_KEY ], 1000 )
+        self.assertEqual( table[ LAST_KEY ], 1002 )
+        self.assertEqual( table[ 'xpo<' ], 1 )
+        self.assertEqual( table[ 'xpo>' ], 3 )
+        self.assertEqual( table[ 'eye_' ], 'left' )
+        self.assertFalse( 'xpos' in table )
+
+    def test_single_event_unchanged( self ) :
+
+        self.stage.send_event( 'gaze', 1000, table = { 'xpos' : 3 } )
+        self.stage.flush()
+
+        event, = self.ns.recorder().events( 'gaze' )
+        self.assertEqual( _table( event ), { 'xpos' : 3 } )
+
+    def test_reserved_key( self ) :
+
+        self.assertRaises( coalesce.Error, self.stage.send_event, 'gaze', 1000, table = { COUNT_KEY : 1 } )
+
+    def test_range_key_collision( self ) :
+
+        self.stage.send_event( 'gaze', 1000, table = { 'xpos' : 1, 'xpo<' : 'a' } )
+        self.stage.send_event( 'gaze', 1001, table = { 'xpos' : 2, 'xpo<' : 'b' } )
+
+        self.assertRaises( coalesce.Error, self.stage.flush )
+
+    def test_rebase_closes_the_burst( self ) :
+
+        self.stage.send_event( 'gaze', 1000 )
+        self.stage.send_event( 'gaze', 1010 )
+
+        # the timeline has been rebased : the time goes back
+        self.stage.send_event( 'gaze', 20 )
+
+        events = self.ns.recorder().events( 'gaze' )
+        self.assertEqual( len( events ), 1 )
+        self.assertEqual( _table( events[0] )[ COUNT_KEY ], 2 )
+
+        self.stage.poll( now = 10 )
+
+        self.assertEqual( self.stage.pending(), 0 )
+        self.assertEqual( len( self.ns.recorder().events( 'gaze' ) ), 2 )
+
+    def test_other_keys_as_is( self ) :
+
+        self.stage.send_event( 'stim', 1000 )
+        self.stage.send_event( 'stim', 1001 )
+
+        self.assertEqual( self.ns.recorder().count( 'stim' ), 2 )
+        self.assertEqual( self.stage.stats()[ 'stim' ], ( 2, 0, 2 ) )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
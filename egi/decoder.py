@@ -0,0 +1,277 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    An incremental decoder for the Netstation protocol streams --
+    -- the reverse of what simple._Format and simple._DataFormat do .
+
+    The decoder accepts the bytes in arbitrary chunks ( as they come from a socket
+    or a capture file ) and returns the complete messages found so far :
+
+        decoder = StreamDecoder()
+        for chunk in chunks :
+            for record in decoder.feed( chunk ) :
+                ...
+
+    The commands are returned as Command( code, args ) records ,
+    the 'D' events as Event( timestamp, duration, key, label, description, table ) ,
+    where 'table' is a list of ( key, type, value ) triples in the wire order
+    ( label, description and table are None for the "simple" events ) .
+
+    With server = True the decoder reads the other direction ( 'Z', 'F', 'I' replies ) .
+
+    The chunks are appended to a single bytearray , read at an offset : the fixed fields in place
+    ( struct.unpack_from() ) , the label, the description and the text values are buffer() objects
+    over it -- str() them where a string is needed ( table_dict() does it for the values ) .
+    The bytes already decoded are dropped once they make the most of the buffer
+    ( into a new bytearray : the old one stays as long as the records that point into it ) .
+    A message that does not add up raises Error .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the formats and the exception
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+import struct
+from collections import namedtuple
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+Command = namedtuple( 'Command', 'code args' )
+Event = namedtuple( 'Event', 'timestamp duration key label description table' )
+
+# the codes of the two directions ( ref. : p.193 of App.G: "Experimental Control Protocol" )
+CLIENT_CODES = 'QXBEATD'
+SERVER_CODES = 'ZFI'
+
+# 'D' + the length of the rest , then timestamp, duration and the key
+_EVENT_PREFIX = struct.Struct( '=cH' )
+_EVENT_HEADER = struct.Struct( '=LL4s' )
+_EVENT_HEADER_LENGTH = _EVENT_HEADER.size # what the length field counts besides label / description / table
+
+# the decoded bytes are dropped when there are at least this many and they are the most of the buffer
+COMPACT_BYTES = 65536
+
+_UINT8 = struct.Struct( '=B' )
+_KEY_ENTRY = struct.Struct( '=4s4sH' ) # key, DescType, the length of the data
+
+# Netstation type -> the unpacker of the value ( the rest, 'TEXT' included, are returned as strings )
+_VALUE_FORMATS = dict(  ( desctype, struct.Struct( fmt ) )
+                        for desctype, ( fmt, limits ) in internal.EventSchema._formats.iteritems()
+                        if fmt is not None  )
+
+
+# -----------------------------------------------------------------------------
+
+class StreamDecoder :
+    """ decodes a stream of messages fed in arbitrary chunks """
+
+    def __init__( self, server = False ) :
+
+        fmt = internal._Format()
+
+        codes = SERVER_CODES if server else CLIENT_CODES
+
+        # the byte of the code -> ( the code , the size of the arguments, their unpacker ) ; the size is None for the 'D' events
+        self._fixed = {}
+        for code in codes :
+            if fmt[ code ] is None :
+                self._fixed[ ord( code ) ] = ( code, None, None )
+            else :
+                unpacker = struct.Struct( fmt[ code ] )
+                self._fixed[ ord( code ) ] = ( code, unpacker.size, unpacker.unpack_from )
+
+        self._buf = bytearray()
+        self._pos = 0
+
+        self._n_records = 0
+        self._n_bytes = 0
+
+    ## -----------------------------------------------------------
+
+    def feed( self, data ) :
+        """ add the next chunk of the stream ; returns the list of the messages completed by it """
+
+        self._n_bytes += len( data )
+
+        # the records decoded before may point into the buffer : it only grows ( see _compact() )
+        buf = self._buf
+        buf += data
+
+        pos = self._pos
+        end = len( buf )
+
+        records = []
+
+        while pos < end :
+
+            try :
+                code, size, unpack_from = self._fixed[ buf[ pos ] ]
+            except KeyError :
+                raise Error( "unexpected command code %s at byte %d of the stream" % ( repr( chr( buf[ pos ] ) ), self._n_bytes - end + pos ) )
+
+            if size is not None :
+
+                if pos + 1 + size > end :
+                    break
+
+                records.append( Command( code, unpack_from( buf, pos + 1 ) ) )
+                pos += 1 + size
+
+            else :
+
+                if pos + _EVENT_PREFIX.size > end :
+                    break
+
+                length = _EVENT_PREFIX.unpack_from( buf, pos )[1]
+                total = _EVENT_PREFIX.size + length
+
+                if pos + total > end :
+                    break
+
+                records.append( self._decode_event( buf, pos + _EVENT_PREFIX.size, length ) )
+                pos += total
+
+        self._pos = pos
+        self._compact()
+
+        self._n_records += len( records )
+
+        return records
+
+    def _compact( self ) :
+        """ drop the decoded bytes if they make the most of the buffer : the tail goes to a new one """
+
+        pos = self._pos
+
+        if pos >= COMPACT_BYTES and pos * 2 >= len( self._buf ) :
+            self._buf = self._buf[ pos : ]
+            self._pos = 0
+
+    def _decode_event( self, buf, start, length ) :
+        """ decode the 'D' message body of the given length """
+
+        if length < _EVENT_HEADER_LENGTH :
+            raise Error( "the event is too short (%d bytes)" % ( length, ) )
+
+        timestamp, duration, key = _EVENT_HEADER.unpack_from( buf, start )
+
+        end = start + length
+        pos = start + _EVENT_HEADER_LENGTH
+
+        if pos == end : # a "simple" event
+            return Event( timestamp, duration, key, None, None, None )
+
+        def need( pos, size, what ) :
+            """ nothing may be read past the declared end ( into the next message ) """
+            if pos + size > end :
+                raise Error( "malformed event '%s': the %s runs %d bytes past its end" % ( key, what, pos + size - end ) )
+
+        # label and description are Pascal strings
+        need( pos, 1, 'label length' )
+        n = _UINT8.unpack_from( buf, pos )[0]
+        need( pos + 1, n, 'label' )
+        label = buffer( buf, pos + 1, n )
+        pos += 1 + n
+
+        need( pos, 1, 'description length' )
+        n = _UINT8.unpack_from( buf, pos )[0]
+        need( pos + 1, n, 'description' )
+        description = buffer( buf, pos + 1, n )
+        pos += 1 + n
+
+        need( pos, 1, 'number of the table keys' )
+        nkeys = _UINT8.unpack_from( buf, pos )[0]
+        pos += 1
+
+        table = []
+        for i in xrange( nkeys ) :
+
+            need( pos, _KEY_ENTRY.size, 'table entry %d' % ( i, ) )
+            k, desctype, size = _KEY_ENTRY.unpack_from( buf, pos )
+            pos += _KEY_ENTRY.size
+
+            need( pos, size, "value of '%s'" % ( k, ) )
+
+            unpacker = _VALUE_FORMATS.get( desctype )
+            if unpacker is not None and unpacker.size == size :
+                value = unpacker.unpack_from( buf, pos )[0]
+            else :
+                value = buffer( buf, pos, size )
+
+            table.append( ( k, desctype, value ) )
+            pos += size
+
+        if pos != end :
+            raise Error( "malformed event '%s': %d bytes declared, %d decoded" % ( key, length, length + pos - end ) )
+
+        return Event( timestamp, duration, key, label, description, table )
+
+    ## -----------------------------------------------------------
+
+    def pending( self ) :
+        """ the number of bytes of an incomplete message waiting for the next chunk """
+
+        return len( self._buf ) - self._pos
+
+    def stats( self ) :
+        """ returns ( the number of decoded messages , the number of bytes fed ) """
+
+        return self._n_records, self._n_bytes
+
+
+# -----------------------------------------------------------------------------
+
+def decode( data, server = False ) :
+    """ decode a complete stream at once ; raises an exception if it ends in the middle of a message """
+
+    decoder = StreamDecoder( server )
+    records = decoder.feed( data )
+
+    if decoder.pending() :
+        raise Error( "the stream ends in the middle of a message (%d bytes left)" % ( decoder.pending(), ) )
+
+    return records
+
+
+def table_dict( event ) :
+    """ the table of a decoded event as a { key : value } dictionary ( the text values as strings ) """
+
+    if event.table is None :
+        return {}
+
+    return dict(  ( k, str( value ) if isinstance( value, buffer ) else value ) for k, desctype, value in event.table  )
+
+
+def as_strings( event ) :
+    """ the event with the label, the description and the text values as strings ( say, to print it ) """
+
+    if event.table is None :
+        return event
+
+    table = [  ( k, desctype, str( value ) if isinstance( value, buffer ) else value ) for k, desctype, value in event.table  ]
+
+    return event._replace( label = str( event.label ), description = str( event.description ), table = table )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" decoder.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import simple
+import decoder
+
+
+def _event( key = 'stim', timestamp = 1000, **kwargs ) :
+
+    return simple._DataFormat().pack( key, timestamp, **kwargs )
+
+
+class DecoderTest( unittest.TestCase ) :
+
+    def test_round_trip_in_chunks( self ) :
+
+        message = _event( label = 'target', description = 'block 1', table = { 'cond' : 'congruent', 'trl#' : 7, 'rt__' : 0.5 } )
+        stream = message * 3
+
+        d = decoder.StreamDecoder()
+
+        records = []
+        for i in xrange( 0, len( stream ), 5 ) :
+            records += d.feed( stream[ i : i + 5 ] )
+
+        self.assertEqual( len( records ), 3 )
+        self.assertEqual( d.pending(), 0 )
+
+        event = records[0]
+        self.assertEqual( ( event.key, event.timestamp, str( event.label ), str( event.description ) ), ( 'stim', 1000, 'target', 'block 1' ) )
+        self.assertEqual( decoder.table_dict( event ), { 'cond' : 'congruent', 'trl#' : 7, 'rt__' : 0.5 } )
+
+        self.assertEqual( decoder.as_strings( event ).label, 'target' )
+
+    def test_no_copies( self ) :
+
+        message = _event( label = 'target', table = { 'cond' : 'congruent' } )
+
+        d = decoder.StreamDecoder()
+        event, = d.feed( message[ : 10 ] ) + d.feed( message[ 10 : ] )
+
+        # views into the buffer of the decoder , not the strings sliced out of it
+        self.assertTrue( isinstance( event.label, buffer ) )
+        self.assertTrue( isinstance( event.table[0][2], buffer ) )
+        self.assertEqual( str( event.label ), 'target' )
+
+    def test_compacted( self ) :
+
+        message = _event( label = 'target' )
+        n = decoder.COMPACT_BYTES // len( message ) + 10
+
+        d = decoder.StreamDecoder()
+
+        records = []
+        for i in xrange( n ) :
+            records += d.feed( message[ : 7 ] )
+            records += d.feed( message[ 7 : ] )
+
+        # the decoded bytes have been dropped , the records decoded before still read right
+        self.assertTrue( len( d._buf ) < decoder.COMPACT_BYTES )
+        self.assertEqual( len( records ), n )
+        self.assertEqual( set(  str( event.label ) for event in records  ), set( [ 'target' ] ) )
+
+    def test_replies( self ) :
+
+        records = decoder.decode( 'ZI\x01Z', server = True )
+        self.assertEqual( [ r.code for r in records ], [ 'Z', 'I', 'Z' ] )
+
+    def test_truncated_event( self ) :
+
+        message = _event( label = 'target' )
+
+        # the declared length cuts the description off
+        prefix = decoder._EVENT_PREFIX
+        length = prefix.unpack_from( message )[1] - 2
+        broken = prefix.pack( 'D', length ) + message[ prefix.size : prefix.size + length ]
+
+        self.assertRaises( decoder.Error, decoder.decode, broken )
+
+    def test_bad_label_length_stays_within_the_message( self ) :
+
+        message = _event( label = 'target' )
+        offset = decoder._EVENT_PREFIX.size + decoder._EVENT_HEADER_LENGTH
+
+        # the label claims more than the message holds : the next message is not to be read into
+        broken = message[ : offset ] + chr( 200 ) + message[ offset + 1 : ]
+
+        self.assertRaises( decoder.Error, decoder.decode, broken + _event( label = 'x' * 250 ) )
+
+    def test_bad_table_entry( self ) :
+
+        message = _event( table = { 'trl#' : 7 } )
+
+        # the value size of the last entry is too big
+        broken = message[ : -6 ] + '\xff\xff' + message[ -4 : ]
+
+        self.assertRaises( decoder.Error, decoder.decode, broken )
+
+    def test_unexpected_code( self ) :
+
+        self.assertRaises( decoder.Error, decoder.decode, '?' )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
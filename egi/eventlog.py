@@ -0,0 +1,416 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A compact local copy of every event sent -- for the analysis next to the EEG recording :
+    the key, the local send time ( clock.ns_monotonic() ) , the moment the timestamp was taken ,
+    the timestamp written on the wire ,
+    the reply latency , the label and the table values ; and every sync() ( the local send time ,
+    the round trip and the 'T' value ) -- see align.py for putting the events on the Netstation timebase .
+
+        ns.enable_event_log( export_path = 'session_events.tsv' )
+        ...
+        log = ns.event_log()
+        log.export( 'session_events.npz' )
+
+    Every event is one row in the typed arrays ( about 40 bytes plus 8 per table column ) ,
+    the keys, the labels and the text values are interned in a single string table ;
+    a list of dictionaries would take hundreds of bytes per event .
+
+    The table columns are created as the keys appear : the numbers ( and bools ) are kept as doubles
+    ( NaN where the event has no such key ) , the strings as indexes in the string table ( -1 : none ) .
+
+    The export goes by the extension : '.csv', '.tsv' ( written in chunks of rows ) or '.npz'
+    ( needs numpy : the 'events' and 'syncs' structured arrays, the 'strings' and a 'table.<key>' array per column ) .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+from array import array
+import csv
+import sys
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+NAN = float( 'nan' )
+
+# the reply status of an event
+PENDING, FAILED, ACKED = -1, 0, 1
+
+EXPORT_CHUNK = 4096 # rows
+
+# the fixed columns ( the table columns follow )
+COLUMNS = ( 'key', 't_local_ns', 't_stamp_ns', 'wire_ms', 'ack_ms', 'status', 'label' )
+
+
+class _Strings :
+
+    """ an interning table : string -> its index """
+
+    def __init__( self ) :
+
+        self._index = {}
+        self.values = []
+
+    def index( self, s ) :
+
+        i = self._index.get( s )
+
+        if i is None :
+            i = self._index[ s ] = len( self.values )
+            self.values.append( s )
+
+        return i
+
+
+class _Column :
+
+    """ a table column , filled up to the last event that had the key ( see EventLog.column() ) """
+
+    def __init__( self, name, b_text ) :
+
+        self.name = name
+        self.b_text = b_text
+
+        if b_text :
+            self.data = array( 'i' )
+            self._fill = array( 'i', [ -1 ] )
+        else :
+            self.data = array( 'd' )
+            self._fill = array( 'd', [ NAN ] )
+
+        self.n_mismatched = 0 # the text values that could not be put in a numeric column
+
+    def set( self, row, value, strings ) :
+
+        data = self.data
+
+        gap = row - len( data )
+        if gap > 0 :
+            data.extend( self._fill * gap )
+
+        if self.b_text :
+
+            if not isinstance( value, basestring ) :
+                value = str( value )
+
+            data.append( strings.index( value ) )
+
+        else :
+
+            try :
+                data.append( float( value ) )
+            except ( TypeError, ValueError ) :
+                data.append( NAN )
+                self.n_mismatched += 1
+
+    def filled( self, n ) :
+        """ the data for 'n' events ( padded with the 'missing' values ) """
+
+        gap = n - len( self.data )
+        if gap > 0 :
+            self.data.extend( self._fill * gap )
+
+        return self.data
+
+
+# -----------------------------------------------------------------------------
+
+class EventLog :
+
+    """ the events sent , one row each , in the typed arrays """
+
+    def __init__( self, export_path = None ) :
+        """ 'export_path' -- where export() writes by default ( and export_if_needed() writes to ) """
+
+        self._key = array( 'i' )
+        self._t_ns = array( 'd' ) # exact for a few months of the monotonic clock
+        self._t_stamp = array( 'd' )
+        self._wire = array( 'I' )
+        self._ack = array( 'f' ) # ms , NaN until the reply
+        self._status = array( 'b' )
+        self._label = array( 'i' )
+
+        # the syncs
+        self._sync_t_ns = array( 'd' )
+        self._sync_rtt_ns = array( 'd' )
+        self._sync_wire = array( 'I' )
+
+        self._strings = _Strings()
+
+        self._columns = {}
+        self._column_order = []
+
+        self._export_path = export_path
+        self._n_exported = 0
+
+    ## -----------------------------------------------------------
+
+    def append( self, key, t_ns, wire_ms, label = None, table = None, schema = None, t_stamp_ns = None ) :
+        """
+            add an event sent at 't_ns' , its wire timestamp taken at 't_stamp_ns' ( 't_ns' if not known ) ;
+            returns its index ( for acked() )
+        """
+
+        row = len( self._key )
+        strings = self._strings
+
+        self._key.append( strings.index( key ) )
+        self._t_ns.append( t_ns )
+        self._t_stamp.append( t_ns if t_stamp_ns is None else t_stamp_ns )
+        self._wire.append( wire_ms )
+        self._ack.append( NAN )
+        self._status.append( PENDING )
+        self._label.append( strings.index( label or '' ) )
+
+        if table :
+
+            if schema is not None and not isinstance( table, dict ) :
+                items = zip( schema.keys(), table )
+            else :
+                items = table.iteritems()
+
+            columns = self._columns
+            for name, value in items :
+
+                column = columns.get( name )
+                if column is None :
+                    column = self._add_column( name, value )
+
+                column.set( row, value, strings )
+
+        return row
+
+    def _add_column( self, name, value ) :
+        """ the first value decides : the strings go to a text column, the rest to a numeric one """
+
+        column = self._columns[ name ] = _Column( name, isinstance( value, basestring ) )
+        self._column_order.append( name )
+
+        return column
+
+    def acked( self, index, t_ns, result ) :
+        """ the reply for the event 'index' was read at 't_ns' ; 'result' is True for success """
+
+        self._ack[ index ] = ( t_ns - self._t_ns[ index ] ) * 1e-6
+        self._status[ index ] = ACKED if result else FAILED
+
+    def add_sync( self, t_ns, rtt_ns, wire_ms ) :
+        """ the 'T' value 'wire_ms' was sent at 't_ns' , its reply has come 'rtt_ns' later """
+
+        self._sync_t_ns.append( t_ns )
+        self._sync_rtt_ns.append( rtt_ns )
+        self._sync_wire.append( wire_ms )
+
+    ## -----------------------------------------------------------
+
+    def __len__( self ) :
+
+        return len( self._key )
+
+    def arrays( self ) :
+        """ the fixed columns as they are kept ( array.array , no copies -- numpy.frombuffer() takes them ) """
+
+        return { 'key' : self._key, 't_local_ns' : self._t_ns, 't_stamp_ns' : self._t_stamp, 'wire_ms' : self._wire,
+                 'ack_ms' : self._ack, 'status' : self._status, 'label' : self._label }
+
+    def sync_arrays( self ) :
+        """ { 't_send_ns', 'rtt_ns', 'wire_ms' } of the syncs , as they are kept """
+
+        return { 't_send_ns' : self._sync_t_ns, 'rtt_ns' : self._sync_rtt_ns, 'wire_ms' : self._sync_wire }
+
+    def strings( self ) :
+        """ the interned keys, labels and text values ( the text columns hold the indexes in this list ) """
+
+        return list( self._strings.values )
+
+    def column_names( self ) :
+        """ the fixed columns and then the table keys , in the order they have appeared """
+
+        return list( COLUMNS ) + [ str( name ) for name in self._column_order ]
+
+    def column( self, name ) :
+        """ the values of a table column for all the events ( None where the event had no such key ) """
+
+        column = self._columns[ name ]
+        data = column.filled( len( self ) )
+
+        if column.b_text :
+            values = self._strings.values
+            return [  values[i] if i >= 0 else None  for i in data  ]
+
+        return [  None if x != x else x  for x in data  ]
+
+    def rows( self, start = 0, stop = None ) :
+        """ the events as tuples in the order of column_names() ; the missing values are None """
+
+        n = len( self )
+        if stop is None or stop > n :
+            stop = n
+
+        values = self._strings.values
+        columns = [  self._columns[ name ]  for name in self._column_order  ]
+        data = [  column.filled( n )  for column in columns  ]
+
+        for i in xrange( start, stop ) :
+
+            ack = self._ack[ i ]
+
+            row = [ values[ self._key[i] ], int( self._t_ns[i] ), int( self._t_stamp[i] ), self._wire[i],
+                    None if ack != ack else round( ack, 4 ), self._status[i], values[ self._label[i] ] ]
+
+            for column, d in zip( columns, data ) :
+
+                x = d[i]
+                if column.b_text :
+                    row.append( values[x] if x >= 0 else None )
+                else :
+                    row.append( None if x != x else x )
+
+            yield tuple( row )
+
+    def stats( self ) :
+        """ { 'events', 'columns', 'strings', 'bytes' -- the arrays and the string table , 'mismatched' } """
+
+        arrays = [ self._key, self._t_ns, self._t_stamp, self._wire, self._ack, self._status, self._label ]
+        arrays += [  column.data  for column in self._columns.itervalues()  ]
+
+        n_bytes = sum(  a.buffer_info()[1] * a.itemsize  for a in arrays  )
+        n_bytes += sum(  sys.getsizeof( s )  for s in self._strings.values  )
+
+        return { 'events' : len( self ), 'columns' : len( self._columns ), 'strings' : len( self._strings.values ),
+                 'bytes' : n_bytes, 'mismatched' : sum(  c.n_mismatched  for c in self._columns.itervalues()  ) }
+
+    ## -----------------------------------------------------------
+
+    def export( self, path = None ) :
+        """ write the log to '.csv', '.tsv' or '.npz' ( by the extension ) ; returns the number of events """
+
+        if path is None :
+            path = self._export_path
+
+        if path is None :
+            raise Error( "no path to export the event log to" )
+
+        lowered = path.lower()
+
+        if lowered.endswith( '.npz' ) :
+            n = self.export_npz( path )
+        elif lowered.endswith( '.tsv' ) :
+            n = self.export_text( path, '\t' )
+        elif lowered.endswith( '.csv' ) :
+            n = self.export_text( path, ',' )
+        else :
+            raise Error( "'%s': the event log is exported to .csv, .tsv or .npz" % ( path, ) )
+
+        self._n_exported = n
+
+        return n
+
+    def export_if_needed( self ) :
+        """ export() to the 'export_path' if it was given and there is something new """
+
+        if self._export_path is None or self._n_exported == len( self ) :
+            return None
+
+        return self.export()
+
+    def export_text( self, path, delimiter = ',', chunk = EXPORT_CHUNK ) :
+        """ write a header line and a line per event , 'chunk' rows at a time """
+
+        n = len( self )
+
+        with open( path, 'wb' ) as f :
+
+            writer = csv.writer( f, delimiter = delimiter, lineterminator = '\n' )
+            writer.writerow( self.column_names() )
+
+            for start in xrange( 0, n, chunk ) :
+                writer.writerows(  map( _encode_row, self.rows( start, start + chunk ) )  )
+
+        return n
+
+    def export_npz( self, path ) :
+        """ write the columns as numpy arrays ( the text columns as the indexes in 'strings' ) """
+
+        try :
+            import numpy
+        except ImportError :
+            raise Error( "numpy is needed for the .npz export ( .csv and .tsv do without it )" )
+
+        n = len( self )
+
+        fields = [ ( 'key', self._key, numpy.int32 ), ( 't_local_ns', self._t_ns, numpy.float64 ), ( 't_stamp_ns', self._t_stamp, numpy.float64 ),
+                   ( 'wire_ms', self._wire, numpy.uint32 ), ( 'ack_ms', self._ack, numpy.float32 ),
+                   ( 'status', self._status, numpy.int8 ), ( 'label', self._label, numpy.int32 ) ]
+
+        events = numpy.empty( n, dtype = [  ( name, dtype )  for name, a, dtype in fields  ] )
+        for name, a, dtype in fields :
+            events[ name ] = numpy.frombuffer( a, dtype = dtype, count = n )
+
+        strings = [  s.encode( 'utf-8' ) if isinstance( s, unicode ) else s  for s in self._strings.values  ]
+
+        syncs = numpy.empty( len( self._sync_t_ns ), dtype = [ ( 't_send_ns', numpy.float64 ), ( 'rtt_ns', numpy.float64 ), ( 'wire_ms', numpy.uint32 ) ] )
+        syncs[ 't_send_ns' ] = numpy.frombuffer( self._sync_t_ns, dtype = numpy.float64 )
+        syncs[ 'rtt_ns' ] = numpy.frombuffer( self._sync_rtt_ns, dtype = numpy.float64 )
+        syncs[ 'wire_ms' ] = numpy.frombuffer( self._sync_wire, dtype = numpy.uint32 )
+
+        arrays = { 'events' : events, 'syncs' : syncs,
+                   'strings' : numpy.array( strings, dtype = str ),
+                   'text_columns' : numpy.array( [  str( c.name )  for c in self._columns.itervalues() if c.b_text  ], dtype = str ) }
+
+        for name in self._column_order :
+
+            column = self._columns[ name ]
+            dtype = numpy.int32 if column.b_text else numpy.float64
+
+            arrays[ 'table.' + str( name ) ] = numpy.frombuffer( column.filled( n ), dtype = dtype, count = n )
+
+        numpy.savez( path, **arrays )
+
+        return n
+
+
+def _encode_field( x ) :
+
+    if x is None :
+        return ''
+
+    if isinstance( x, float ) and x.is_integer() : # the integers and the bools of the numeric columns
+        return int( x )
+
+    if isinstance( x, unicode ) : # the csv module of Python 2 takes no unicode
+        return x.encode( 'utf-8' )
+
+    return x
+
+
+def _encode_row( row ) :
+    """ None is written as an empty field, 3.0 as 3 """
+
+    return map( _encode_field, row )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
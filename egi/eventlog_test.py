@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" eventlog.py ( and simple.Netstation with it , against the local stand-in ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import tempfile
+import shutil
+import os
+import csv
+
+import eventlog
+from eventlog import EventLog, PENDING, FAILED, ACKED
+from harness import StandIn
+import simple
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+
+def _filled() :
+
+    log = EventLog()
+
+    # a new column a time : the columns keep the order they appear in
+    log.append( 'stim', 1000000.0, 10, 'target', { 'trl#' : 1 } )
+    log.append( 'resp', 2000000.0, 11, None, { 'cond' : 'congruent' } )
+    log.append( 'stim', 3000000.0, 12, None, { 'trl#' : 2, 'corr' : True } )
+
+    log.acked( 0, 1500000.0, True )
+    log.acked( 2, 3250000.0, False )
+
+    return log
+
+
+class EventLogTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        self.path = tempfile.mkdtemp()
+
+    def tearDown( self ) :
+
+        shutil.rmtree( self.path )
+
+    def test_columns( self ) :
+
+        log = _filled()
+
+        self.assertEqual( len( log ), 3 )
+        self.assertEqual( log.column_names(), list( eventlog.COLUMNS ) + [ 'trl#', 'cond', 'corr' ] )
+
+        self.assertEqual( log.column( 'trl#' ), [ 1.0, None, 2.0 ] )
+        self.assertEqual( log.column( 'cond' ), [ None, 'congruent', None ] )
+        self.assertEqual( log.column( 'corr' ), [ None, None, 1.0 ] )
+
+        self.assertEqual( list( log.arrays()[ 'status' ] ), [ ACKED, PENDING, FAILED ] )
+
+    def test_rows( self ) :
+
+        rows = list( _filled().rows() )
+
+        self.assertEqual( rows[0], ( 'stim', 1000000, 1000000, 10, 0.5, ACKED, 'target', 1.0, None, None ) )
+        self.assertEqual( rows[1], ( 'resp', 2000000, 2000000, 11, None, PENDING, '', None, 'congruent', None ) )
+
+    def test_stamp_time( self ) :
+
+        log = EventLog()
+        log.append( 'stim', 2000000.0, 10, t_stamp_ns = 1500000.0 )
+
+        self.assertEqual( list( log.arrays()[ 't_stamp_ns' ] ), [ 1500000.0 ] )
+        self.assertEqual( list( log.arrays()[ 't_local_ns' ] ), [ 2000000.0 ] )
+
+    def test_mismatched( self ) :
+
+        log = EventLog()
+        log.append( 'stim', 0.0, 0, table = { 'rt__' : 0.5 } )
+        log.append( 'stim', 0.0, 0, table = { 'rt__' : 'late' } )
+
+        self.assertEqual( log.column( 'rt__' ), [ 0.5, None ] )
+        self.assertEqual( log.stats()[ 'mismatched' ], 1 )
+
+    def test_export_csv( self ) :
+
+        path = os.path.join( self.path, 'events.csv' )
+
+        log = _filled()
+        self.assertEqual( log.export_text( path, chunk = 2 ), 3 )
+
+        with open( path, 'rb' ) as f :
+            lines = list( csv.reader( f ) )
+
+        self.assertEqual( lines[0], log.column_names() )
+        self.assertEqual( lines[1], [ 'stim', '1000000', '1000000', '10', '0.5', '1', 'target', '1', '', '' ] )
+        self.assertEqual( len( lines ), 4 )
+
+    def test_export_by_extension( self ) :
+
+        log = EventLog( export_path = os.path.join( self.path, 'events.txt' ) )
+        log.append( 'stim', 0.0, 0 )
+
+        self.assertRaises( eventlog.Error, log.export_if_needed )
+        self.assertRaises( eventlog.Error, EventLog().export )
+
+    @unittest.skipIf( numpy is None, "numpy is not installed" )
+    def test_export_npz( self ) :
+
+        path = os.path.join( self.path, 'events.npz' )
+
+        log = _filled()
+        log.add_sync( 500000.0, 200000.0, 9 )
+        log.export( path )
+
+        data = numpy.load( path )
+        strings = list( data[ 'strings' ] )
+
+        self.assertEqual(  [ strings[i] for i in data[ 'events' ][ 'key' ] ], [ 'stim', 'resp', 'stim' ]  )
+        self.assertEqual( list( data[ 'syncs' ][ 'wire_ms' ] ), [ 9 ] )
+        self.assertEqual( list( data[ 'table.trl#' ][ [ 0, 2 ] ] ), [ 1.0, 2.0 ] )
+        self.assertEqual( list( data[ 'text_columns' ] ), [ 'cond' ] )
+
+
+class NetstationTest( unittest.TestCase ) :
+
+    def test_events_logged_and_acked( self ) :
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+        ns.sync()
+        ns.enable_event_log()
+
+        ns.send_event( 'stim', table = { 'trl#' : 1 } )
+        ns.send_event( 'stim', table = { 'trl#' : 2 }, b_wait = False )
+        ns.poll_acks( seconds_timeout = 1.0 )
+
+        log = ns.event_log()
+
+        ns.EndSession()
+        ns.disconnect()
+
+        arrivals = stand_in.arrivals()
+
+        self.assertEqual( len( log ), 2 )
+        self.assertEqual( list( log.arrays()[ 'status' ] ), [ ACKED, ACKED ] )
+        self.assertEqual( list( log.arrays()[ 'wire_ms' ] ), [  timestamp for ns_arrival, key, timestamp, index in arrivals  ] )
+        self.assertEqual( log.column( 'trl#' ), [ 1.0, 2.0 ] )
+
+        # stamped before the write
+        columns = log.arrays()
+        for t_stamp, t_local in zip( columns[ 't_stamp_ns' ], columns[ 't_local_ns' ] ) :
+            self.assertTrue( t_stamp < t_local )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -3,7 +3,13 @@
 
 """     
 
-    A fake implementation of the "egi.netstation" component  (only prints  some info to the standard output, but does not try to communicate with Netstation ).     
+    A fake implementation of the "egi.netstation" component  (only prints  some info ( through the "egi.fake" logger, see log.py ), but does not try to communicate with Netstation ).     
+
+    With Netstation( recorder = True ) ( or a recorder.Recorder object ) nothing is printed :
+    the calls are encoded and kept in memory instead ( see recorder.py ) .
+
+    With Netstation( link = faults.LinkModel( ... ) ) the replies are not instant any more :
+    they are delayed, may be 'F' errors, and the connection may drop ( see faults.py ) .
     
 """     
 
@@ -11,8 +17,18 @@
 # -----------------------------------------------------------------------------
 
 import simple as internal # for the fake object we need only the exception and the timestamps          
+import decoder # to print the pre-packed events
+from recorder import Recorder
+from faults import LinkModel, DISCONNECT
+from timeline import Timeline
+from clock import ns_monotonic
 # from socket_wrapper import Socket     
 import sys
+import time
+import socket, errno
+from collections import deque
+import logging
+import log # the diagnostic output
 
 #
 # "forward" these names to be used from outside     
@@ -21,6 +37,14 @@ import sys
 Error = internal.Eggog     
 ms_localtime = internal.ms_localtime     
 
+_log = log.get_logger( 'fake' )
+
+
+def _s_monotonic() :
+    """ the monotonic clock in seconds : the imitated replies are timed by it """
+
+    return ns_monotonic() * 1e-9
+
 
 # -----------------------------------------------------------------------------
 
@@ -30,11 +54,19 @@ ms_localtime = internal.ms_localtime
 
 def Print(*args, **kwargs) :
 	
-	""" Print() function -- exchange typing two brackets for (not) typing the prefix  """     
+	""" Print() function -- exchange typing two brackets for (not) typing the prefix ; goes to the "egi.fake" logger ( to stdout if there is no logging set up )  """     
+
+	# never a print() : the caller does not wait for the terminal ( see log.default_output() )
+	log.default_output( 'fake' )
+
+	if not _log.isEnabledFor( logging.INFO ) : return
+
+	lines = [ "|Netstation [fake]: " ]
+	for arg in args: lines.append( " \%s" % arg )
+	for k, v in kwargs.iteritems() : lines.append( "  |%s=%s" % (k,v) )
 
-	print "|Netstation [fake]: "
-	for arg in args: print " \%s" % arg
-	for k, v in kwargs.iteritems() : print "  |%s=%s" % (k,v)
+	# the dry run output is what the fake is for : never rate limited
+	_log.info( "\n".join( lines ), extra = { 'egi_unlimited' : True } )
 	
 		
 
@@ -50,9 +82,83 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
-    def __init__( self ) :
+    def __init__( self, recorder = None, link = None ) :
+        """
+            'recorder' -- True or a recorder.Recorder to record the calls instead of printing them ;
+            'link' -- a faults.LinkModel to imitate the reply delays and the failures ( None : instant replies ) .
+        """
+
+        if recorder is True :
+            recorder = Recorder()
+
+        self._recorder = recorder
+
+        if recorder is None :
+            Print( '__init__()' )     
+
+        self._event_budget = internal._EventBudget()
+
+        self._link = link
+        self._b_disconnected = False
+
+        # ( the arrival time , True / False ) of the replies not read yet ( b_wait = False )
+        self._pending = deque()
+        self._t_last_reply = 0.0
 
-        Print( '__init__()' )     
+        self._timeline = Timeline()
+
+    def recorder( self ) :
+        """ the Recorder with the session so far ( None if printing ) """
+
+        return self._recorder
+
+    def ms_now( self ) :
+        """ the current time in ms, as simple.Netstation would send it """
+
+        return self._timeline.ms()
+
+    def timeline( self ) :
+        """ the timeline.Timeline object of the imitated connection """
+
+        return self._timeline
+
+    ## -----------------------------------------------------------
+
+    def _reply( self, b_wait = True ) :
+        """
+            imitate the reply to a message as the link model says : wait for it ( or leave it pending ) ,
+            raise the error for an 'F' and socket.error for a dropped connection -- as simple.Netstation does
+        """
+
+        link = self._link
+        if link is None :
+            return True if b_wait else None # as simple.Netstation : no result until the reply is read
+
+        if self._b_disconnected :
+            raise socket.error( errno.EPIPE, "the connection is closed" )
+
+        delay_s, code = link.reply()
+
+        if code is DISCONNECT :
+            self._b_disconnected = True
+            raise socket.error( errno.ECONNRESET, "the connection was closed by the other side" )
+
+        # the replies come in the order of the messages
+        t_reply = max( _s_monotonic() + delay_s, self._t_last_reply )
+        self._t_last_reply = t_reply
+
+        if not b_wait :
+            self._pending.append( ( t_reply, code == 'Z' ) )
+            return None
+
+        delay_s = t_reply - _s_monotonic()
+        if delay_s > 0 :
+            time.sleep( delay_s )
+
+        if code == 'F' :
+            raise Error( "server returned an error ( imitated by the link model )" )
+
+        return True
 
     ## -----------------------------------------------------------
 
@@ -82,7 +188,8 @@ class Netstation :
             pass     
 
         # return None
-        Print( 'process_responces()' )
+        if self._recorder is None :
+            Print( 'process_responces()' )
 
         ## change the return value depending on the resp_handler() return result ?
         ## ( e.g. break the loop on True ? )
@@ -94,39 +201,100 @@ class Netstation :
     def initialize( self, str_address, port_no ) :
         """ open the socket /and/ start the 'Mr. Postman' thread """     
 
-        Print( 'initialize( %s, %s )' % (str_address, port_no)  )     
+        if self._recorder is None :
+            Print( 'initialize( %s, %s )' % (str_address, port_no)  )     
+
+        self._b_disconnected = False
+        self._pending.clear()
+        self._timeline.reset()
         
 
     def finalize( self, seconds_timeout = 2 ) :
         """ send the thread the 'Done' message and wait until it finishes """
 
+        if self._recorder is not None :
+            self._recorder.export_if_needed()
+            return
+
         Print( 'finalize( timeout: %s seconds )' % (seconds_timeout, )  )     
 
-        # debug
-        print " egi: stopping ... "
+        _log.info( "egi: stopping ..." )
 
         ## self._disconnect()     
 
-    def connect(self, str_address, port_no):
-        """Wrap the initalize function for simple vs. threaded dummy mode."""
+    def connect(self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT):
+        """Wrap the initalize function for simple vs. threaded dummy mode ( the timeout is not imitated )."""
         self.initialize(str_address, port_no)
 
+    def start( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT, b_record = True ) :
+        """ imitates connecting and the pipelined session start """
+
+        self.initialize( str_address, port_no )
+
+        return self.start_session( b_record )
+
+    def start_session( self, b_record = True ) :
+        """ imitates BeginSession, sync and StartRecording sent as one write """
+
+        if self._recorder is None :
+            Print( 'start_session( b_record = %s )' % ( b_record, ) )
+        else :
+            self._record_session( b_record )
+
+        # pipelined : one round trip for all of them
+        t_start = _s_monotonic()
+        self._reply()
+
+        self._event_budget.reset()
+
+        total = _s_monotonic() - t_start
+
+        return { 'send' : 0.0, 'Q' : total, 'A' : total, 'T' : total, 'B' : total, 'total' : total }
+
     def disconnect(self, seconds_timeout=2):
         """Wrap the initalize function for simple vs. threaded dummy mode."""
         self.finalize(seconds_timeout)
 
     ## -----------------------------------------------------------     
 
+    def _record_session( self, b_record, b_end = False ) :
+        """ the messages of the pipelined session start ( and of the rollover ) """
+
+        recorder = self._recorder
+
+        if b_end :
+            recorder.command( 'X' )
+
+        recorder.command( 'Q' )
+        recorder.command( 'A' )
+        recorder.command( 'T', self._timeline.sync_ms() )
+        self._timeline.synced()
+
+        if b_record :
+            recorder.command( 'B' )
+
     def BeginSession( self ) :     
         """ say 'hi!' to the server """     
 
-        Print( 'BeginSession()' )
+        if self._recorder is None :
+            Print( 'BeginSession()' )
+        else :
+            self._recorder.command( 'Q' )
+
+        self._reply()
+
+        self._event_budget.reset()
         
 
     def EndSession( self ):
         """ say 'bye' to the server """
 
-        Print( 'EndSession()' )
+        if self._recorder is None :
+            Print( 'EndSession()' )
+        else :
+            self._recorder.command( 'X' )
+
+        self._reply()
         
         
     ## -----------------------------------------------------------
@@ -134,7 +302,12 @@ class Netstation :
     def StartRecording( self ):
         """ start recording to the selected ( externally ) file """
 
-        Print( 'StartRecording()' )     
+        if self._recorder is None :
+            Print( 'StartRecording()' )     
+        else :
+            self._recorder.command( 'B' )
+
+        self._reply()
 
 
     def StopRecording( self ):
@@ -143,7 +316,12 @@ class Netstation :
             if the session is not closed yet .     
         """     
 
-        Print( 'StopRecording()' )     
+        if self._recorder is None :
+            Print( 'StopRecording()' )     
+        else :
+            self._recorder.command( 'E' )
+
+        self._reply()
 
     ## -----------------------------------------------------------
 
@@ -179,13 +357,73 @@ class Netstation :
 
         # TODO/todo : change the code so that we'll wait for the result in the calling thread     
 
-        Print(   'sync( %s = %s)' %  ('timestamp' , timestamp )   )     
-    
+        if self._recorder is None :
+            Print(   'sync( %s = %s)' %  ('timestamp' , timestamp )   )
+
+            # the base moves with the sync all the same
+            self._timeline.sync_ms()
+
+        else :
+
+            if timestamp is None :
+                timestamp = self._timeline.sync_ms()
+
+            self._recorder.command( 'A' )
+            self._recorder.command( 'T', timestamp )
+
+        self._timeline.synced()
+
+        # 'A' and 'T' are pipelined
+        self._reply()
+
+    ## -----------------------------------------------------------
+
+    def set_event_budget( self, budget = internal.DEFAULT_EVENT_BUDGET, warn_at = ( 0.75, 0.9 ), on_exhausted = 'warn' ) :
+        """ configure the per-session event accounting ( see simple.Netstation.set_event_budget() ) """
+
+        if self._recorder is None :
+            Print( 'set_event_budget()', budget = budget, warn_at = warn_at, on_exhausted = on_exhausted )
+
+        self._event_budget = internal._EventBudget( budget, warn_at, on_exhausted )
+
+    def events_sent( self ) :
+        """ the number of events sent since the session has started """
+
+        return self._event_budget.used()
+
+    def events_left( self ) :
+        """ the number of events left in the session budget """
+
+        return self._event_budget.left()
+
+    def rollover( self, b_record = True ) :
+        """ imitates closing the current session and opening a new one """
+
+        if self._recorder is None :
+            Print( 'rollover( b_record = %s )' % ( b_record, ) )
+        else :
+            self._record_session( b_record, b_end = True )
+
+        t_start = _s_monotonic()
+        self._reply()
+
+        self._event_budget.reset()
+
+        return _s_monotonic() - t_start
+
+    def rollover_if_needed( self, fraction = 0.9, b_record = True ) :
+        """ rollover() if at least the given fraction of the session budget is used """
+
+        if self._event_budget.fraction() < fraction :
+            return None
+
+        return self.rollover( b_record )
+
     ## -----------------------------------------------------------
 
     # send_event, send_simple_event
 
-    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :     
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False, schema = None, b_wait = True ) :     
         """
             Send an event ; note that before sending any events a sync() has to be called
             to make the sent events effective .     
@@ -202,8 +440,11 @@ class Netstation :
             -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
                           not more than 256 in total ;
                           there are no special conditions on the values,
-                          but the size of every value entry in bytes should not exceed 2 ^ 16 .     
-                          
+                          but the size of every value entry in bytes should not exceed 2 ^ 16 .
+            -- 'schema' -- an optional EventSchema the 'table' follows ( then the table can also be
+                           a sequence of the values in the order of the schema ) .
+            -- 'b_wait' -- if False, do not wait for the reply ( see simple.Netstation.poll_acks() ) .
+
             Note A: due to peculiarity of the implementation, our particular version of NetStation
                     was not able to record more than 2^15 events per session .
                     
@@ -212,25 +453,135 @@ class Netstation :
         """     
         
         if timestamp is None:
-            timestamp = ms_localtime()
+            timestamp = self._timeline.ms()
+
+        if self._recorder is not None :
+
+            # the real encoder catches whatever simple.Netstation would raise
+            self._recorder.event( key, timestamp, label, description, table, pad, schema )
+            self._event_budget.spend()
+
+            return self._reply( b_wait )
+
         kwargs = {                             \
                    'key'         : key         ,
                    'timestamp'   : timestamp   ,
                    'label'       : label       ,
                    'description' : description ,
                    'table'       : table       ,
-                   'pad'         : pad         \
+                   'pad'         : pad         ,
+                   'schema'      : schema      \
                 }     
 
+        # catch the schema mismatches in the dry runs as well
+        if schema is not None :
+            schema.pack( table )
+
+        self._event_budget.spend()
+
         Print( 'send_event() : ', **kwargs )
+
+        return self._reply( b_wait )
         
     
     ## -----------------------------------------------------------
 
-    def send_timestamped_event(self, key, label=None, description=None, table=None, pad=False):
+    def send_timestamped_event(self, key, label=None, description=None, table=None, pad=False, schema=None, b_wait=True):
         """Wraps send_event() with included timestamp"""
-        timestamp = ms_localtime()
-        self.send_event(key, timestamp, label, description, table, pad)
+        timestamp = self._timeline.ms()
+        return self.send_event(key, timestamp, label, description, table, pad, schema, b_wait)
+
+    def send_encoded( self, message, b_wait = True ) :
+        """ imitates sending an event packed in advance ( the message is decoded and printed ) """
+
+        if self._recorder is not None :
+
+            self._recorder.record( str( message ) )
+            self._event_budget.spend()
+
+            return self._reply( b_wait )
+
+        for record in decoder.decode( str( message ) ) :
+
+            self._event_budget.spend()
+
+            if isinstance( record, decoder.Event ) :
+                record = decoder.as_strings( record )
+
+            Print( 'send_encoded() : ', **record._asdict() )
+
+        return self._reply( b_wait )
+
+    def schedule_event( self, key, at, label = None, description = None, table = None, pad = False, schema = None, lead_ms = 20 ) :
+        """ imitates scheduling an event ( see threaded.Netstation.schedule_event() ) -- it is "sent" at once """
+
+        if self._recorder is not None :
+
+            self._recorder.event( key, at, label, description, table, pad, schema )
+            self._event_budget.spend()
+
+            # the sender thread reads the reply
+            self._reply( b_wait = False )
+
+            return
+
+        if schema is not None :
+            schema.pack( table )
+
+        self._event_budget.spend()
+
+        Print( 'schedule_event() : ', key = key, at = at, label = label, description = description, table = table, lead_ms = lead_ms )
+
+        self._reply( b_wait = False )
+
+    def cancel_scheduled( self ) :
+        """ nothing is ever left scheduled """
+
+        return 0
+
+    def scheduled_pending( self ) :
+        """ nothing is ever left scheduled """
+
+        return 0
+
+    def dispatch_errors( self ) :
+        """ nothing is really dispatched """
+
+        return []
+
+    ## -----------------------------------------------------------
+
+    def pending_acks( self ) :
+        """ the number of the replies not read yet ( with no link model nothing is ever pending ) """
+
+        return len( self._pending )
+
+    def poll_acks( self, seconds_timeout = 0 ) :
+        """ imitates reading the replies for the messages sent with b_wait = False ( see simple.Netstation.poll_acks() ) """
+
+        pending = self._pending
+        if not pending :
+            return []
+
+        delay_s = min( pending[0][0] - _s_monotonic(), seconds_timeout )
+        if delay_s > 0 :
+            time.sleep( delay_s )
+
+        t_now = _s_monotonic()
+
+        results = []
+        while pending and pending[0][0] <= t_now :
+            results.append( pending.popleft()[1] )
+
+        return results
+
+    def link_stats( self ) :
+        """ what the link model has done so far ( see faults.LinkModel.stats() ) """
+
+        if self._link is None :
+            return {}
+
+        return self._link.stats()
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" fake.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import socket
+
+import fake
+from faults import LinkModel
+
+
+class ConnectTest( unittest.TestCase ) :
+
+    def test_same_signature_as_simple( self ) :
+
+        ns = fake.Netstation( recorder = True )
+        ns.connect( '127.0.0.1', 55513, seconds_timeout = 1.0 )
+
+        ns.BeginSession()
+        ns.send_event( 'stim' )
+
+        self.assertEqual( ns.recorder().count( 'stim' ), 1 )
+
+
+    def test_no_wait_returns_none( self ) :
+
+        ns = fake.Netstation( recorder = True )
+        ns.connect( '127.0.0.1', 55513 )
+
+        self.assertEqual( ns.send_event( 'stim' ), True )
+        self.assertEqual( ns.send_event( 'stim', b_wait = False ), None )
+
+
+class LinkTest( unittest.TestCase ) :
+
+    def test_replies_in_order( self ) :
+
+        ns = fake.Netstation( recorder = True, link = LinkModel( seed = 1, rtt_ms = ( 'fixed', 20 ) ) )
+        ns.connect( '127.0.0.1', 55513 )
+
+        for i in xrange( 3 ) :
+            ns.send_event( 'stim', b_wait = False )
+
+        self.assertEqual( ns.pending_acks(), 3 )
+        self.assertEqual( ns.poll_acks(), [] )
+        self.assertEqual( ns.poll_acks( seconds_timeout = 1.0 ), [ True, True, True ] )
+        self.assertEqual( ns.pending_acks(), 0 )
+
+    def test_disconnect( self ) :
+
+        ns = fake.Netstation( recorder = True, link = LinkModel( seed = 1, rtt_ms = ( 'fixed', 0 ), disconnect_after = 2 ) )
+        ns.connect( '127.0.0.1', 55513 )
+
+        ns.send_event( 'stim' )
+        self.assertRaises( socket.error, ns.send_event, 'stim' )
+        self.assertRaises( socket.error, ns.send_event, 'stim' )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A model of the link to a real acquisition PC for the fake back-end :
+    the reply delays ( a distribution plus jitter ) , periodic stalls ,
+    the 'F' error replies and the disconnects -- all driven by a seeded RNG
+    and the link's own clock ( every message moves it on by 'message_interval_ms' ) ,
+    so that a failing dry run can be repeated .
+
+        link = LinkModel( seed = 1, rtt_ms = ( 'uniform', 2, 20 ), error_rate = 0.001 )
+        ns = egi.fake.Netstation( link = link )
+
+    The delay distributions ( 'rtt_ms' ) :
+
+        ( 'fixed', ms )
+        ( 'uniform', low, high )
+        ( 'normal', mean, sigma )        -- clipped at zero
+        ( 'lognormal', median, sigma )   -- sigma of the logarithm
+        ( 'exponential', mean )
+        a callable( rng ) returning ms
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+import random
+import math
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+# what the link does with a message : the reply is 'Z' ( success ) , 'F' ( an error ) or DISCONNECT
+DISCONNECT = None
+
+
+def _make_distribution( rtt_ms ) :
+    """ returns a function( rng ) drawing the delay in ms """
+
+    if callable( rtt_ms ) :
+        return rtt_ms
+
+    name, args = rtt_ms[0], tuple( rtt_ms[1:] )
+
+    if name == 'fixed' :
+        value, = args
+        return lambda rng : value
+
+    if name == 'uniform' :
+        low, high = args
+        return lambda rng : rng.uniform( low, high )
+
+    if name == 'normal' :
+        mean, sigma = args
+        return lambda rng : max( 0.0, rng.gauss( mean, sigma ) )
+
+    if name == 'lognormal' :
+        median, sigma = args
+        mu = math.log( median )
+        return lambda rng : rng.lognormvariate( mu, sigma )
+
+    if name == 'exponential' :
+        mean, = args
+        return lambda rng : rng.expovariate( 1.0 / mean )
+
+    raise Error( "unknown delay distribution '%s'" % ( name, ) )
+
+
+# -----------------------------------------------------------------------------
+
+class LinkModel :
+
+    """ decides when and how every message is answered """
+
+    def __init__( self, seed = None, rtt_ms = ( 'uniform', 2, 20 ), jitter_ms = 0,
+                        stall_period_s = None, stall_ms = 0, message_interval_ms = 10,
+                        error_rate = 0.0, error_at = (), disconnect_rate = 0.0, disconnect_after = None ) :
+        """
+            'rtt_ms' -- the distribution of the reply delay ( see above ) ;
+            'jitter_ms' -- plus a uniform +/- jitter ;
+            'stall_period_s', 'stall_ms' -- every 'stall_period_s' seconds the link stalls for 'stall_ms'
+                                            ( the replies due within a stall come at its end ) ;
+            'message_interval_ms' -- how far every message moves the link clock the stalls are timed by
+                                     ( not the wall clock : the same seed gives the same stalls ) ;
+            'error_rate' -- the probability of an 'F' reply ;
+            'error_at' -- the messages ( counting from 1 at reset() ) answered with an 'F' anyway ;
+            'disconnect_rate' -- the probability of the connection being dropped at a message ;
+            'disconnect_after' -- drop the connection at this message ( counting from reset() ) .
+        """
+
+        self._seed = seed
+        self._draw = _make_distribution( rtt_ms )
+        self._jitter_ms = jitter_ms
+
+        self._stall_period_s = stall_period_s
+        self._stall_s = stall_ms * 0.001
+        self._message_interval_s = message_interval_ms * 0.001
+
+        self._error_rate = error_rate
+        self._error_at = frozenset( error_at )
+        self._disconnect_rate = disconnect_rate
+        self._disconnect_after = disconnect_after
+
+        self.reset()
+
+    def reset( self ) :
+        """ restart the RNG ( from the same seed ) , the link clock and the message count """
+
+        self._rng = random.Random( self._seed )
+
+        self._n_messages = 0
+        self._n_errors = 0
+        self._n_disconnects = 0
+        self._n_stalled = 0
+
+    ## -----------------------------------------------------------
+
+    def reply( self ) :
+        """ for the next message : ( the reply delay in seconds , 'Z' / 'F' / DISCONNECT ) """
+
+        rng = self._rng
+
+        self._n_messages += 1
+
+        if self._n_messages == self._disconnect_after or rng.random() < self._disconnect_rate :
+            self._n_disconnects += 1
+            return ( 0.0, DISCONNECT )
+
+        delay_s = self._draw( rng ) * 0.001
+
+        if self._jitter_ms :
+            delay_s = max(  0.0, delay_s + rng.uniform( -self._jitter_ms, self._jitter_ms ) * 0.001  )
+
+        if self._stall_period_s :
+
+            # where the reply would arrive within the stall period , by the link clock
+            t_link = ( self._n_messages - 1 ) * self._message_interval_s
+            phase = ( t_link + delay_s ) % self._stall_period_s
+
+            if phase < self._stall_s :
+                delay_s += self._stall_s - phase
+                self._n_stalled += 1
+
+        code = 'Z'
+        if rng.random() < self._error_rate or self._n_messages in self._error_at :
+            code = 'F'
+            self._n_errors += 1
+
+        return ( delay_s, code )
+
+    def stats( self ) :
+        """ { 'messages', 'errors', 'disconnects', 'stalled' : count } since reset() """
+
+        return { 'messages' : self._n_messages, 'errors' : self._n_errors,
+                 'disconnects' : self._n_disconnects, 'stalled' : self._n_stalled }
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" faults.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import time
+
+import faults
+from faults import LinkModel, DISCONNECT
+
+
+def _replies( link, n ) :
+
+    return [  link.reply()  for i in xrange( n )  ]
+
+
+class LinkModelTest( unittest.TestCase ) :
+
+    def test_seeded_runs_repeat( self ) :
+
+        kwargs = dict( seed = 7, rtt_ms = ( 'lognormal', 5, 0.5 ), jitter_ms = 1,
+                       stall_period_s = 0.1, stall_ms = 20, error_rate = 0.05 )
+
+        link = LinkModel( **kwargs )
+        first = _replies( link, 200 )
+
+        # the stalls follow the link clock , not the wall clock
+        time.sleep( 0.03 )
+
+        second = _replies( LinkModel( **kwargs ), 200 )
+
+        self.assertEqual( first, second )
+        self.assertTrue( link.stats()[ 'stalled' ] > 0 )
+
+        link.reset()
+        self.assertEqual( _replies( link, 200 ), first )
+
+    def test_stalls_by_the_link_clock( self ) :
+
+        # a message every 10 ms , a stall of 30 ms every 100 ms
+        link = LinkModel( seed = 1, rtt_ms = ( 'fixed', 0 ), stall_period_s = 0.1, stall_ms = 30 )
+
+        delays = [  delay_s  for delay_s, code in _replies( link, 10 )  ]
+
+        self.assertEqual( link.stats()[ 'stalled' ], 3 )
+        self.assertAlmostEqual( delays[0], 0.03 )
+        self.assertAlmostEqual( delays[2], 0.01 )
+        self.assertEqual( delays[3:], [ 0.0 ] * 7 )
+
+    def test_disconnect_after( self ) :
+
+        link = LinkModel( seed = 1, disconnect_after = 3 )
+
+        codes = [  code  for delay_s, code in _replies( link, 3 )  ]
+
+        self.assertEqual( codes, [ 'Z', 'Z', DISCONNECT ] )
+        self.assertEqual( link.stats()[ 'disconnects' ], 1 )
+
+    def test_unknown_distribution( self ) :
+
+        self.assertRaises( faults.Error, LinkModel, rtt_ms = ( 'pareto', 1 ) )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -42,6 +42,9 @@ class FunctionWrappingHelper :
         # nb: for py 2.5 , 'method.func_code.co_varnames' is 'method.im_func.func_code.co_varnames' (!)     
         if type( fn ) is types.MethodType : fn = fn.im_func     
 
+        # a decorated one ( see simple._command() ) : the signature is that of the function inside
+        fn = getattr( fn, '__wrapped__', fn )
+
         args, varargs, keywords, defaults = inspect.getargspec( fn )
         self._args = args     
         self._varargs = varargs     
@@ -0,0 +1,435 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A timing validation harness : drives a back-end at a given rate against a local TCP stand-in
+    for Netstation ( no hardware needed ) and reports , for every back-end , how precise the markers are .
+
+    For every event it keeps :
+
+        -- the intended moment ( the harness waits for it , sleeping and then spinning ) ;
+        -- the timestamp written in the 'D' header ( as decoded by the stand-in ) ;
+        -- the moment the write of the message has returned ( the event log , see eventlog.py ) ;
+        -- the moment it arrived at the stand-in ;
+        -- the moment its reply was read ( the event log again ) .
+
+    Every event carries its number in the table ( INDEX_KEY ) : the arrivals and the event log rows
+    are matched to the intended moments by it , not by the order . The back-ends that keep no event log
+    in this process ( multiprocessed ) have no write / ack times -- the report lists them as 'missing' .
+
+        reports = egi.harness.compare( [ 'simple', 'threaded' ], rate_hz = 500, n_events = 5000, payload = 'table' )
+        print egi.harness.format_reports( reports )
+
+    or from the shell ( the back-ends to compare , all of them by default ) :
+
+        python egi/harness.py simple threaded
+
+    The stand-in runs in its own process ( so it does not compete with the client for the GIL ) ;
+    the monotonic clock is system-wide, so its arrival times compare with the client ones directly .
+    A faults.LinkModel can give it the reply delays and the 'F' replies ( its disconnects are not imitated here ) .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception
+import decoder
+from clock import ns_monotonic
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+from collections import namedtuple
+import multiprocessing
+import socket, select
+import heapq
+import time
+import sys
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+BACKENDS = ( 'simple', 'threaded', 'threaded_alt', 'multiprocessed' )
+
+KEY = 'hrns'
+
+# the table key of the event number ( added to every payload )
+INDEX_KEY = 'hix#'
+
+# an 'F' and its four bytes of the error code
+ERROR_REPLY = 'F\x00\x00\x00\x01'
+
+# the shapes of the events : event number -> send_event() keyword arguments ( INDEX_KEY is added to the table )
+PAYLOADS = \
+{ 'bare' : lambda i : {} ,
+  'label' : lambda i : { 'label' : 'trial', 'description' : 'block %d' % ( i // 100, ) } ,
+  'table' : lambda i : { 'label' : 'trial', 'table' : { 'trl#' : i, 'cond' : ( 'congruent', 'incongruent' )[ i % 2 ], 'corr' : True, 'rt__' : 0.5 } } ,
+  'large' : lambda i : { 'label' : 'x' * 200, 'description' : 'y' * 200, 'table' : dict(  ( 'k%03d' % k, i + k )  for k in xrange( 64 )  ) } ,
+}
+
+PERCENTILES = ( 50, 90, 99, 99.9 )
+
+DEFAULT_SPIN_MS = 2
+
+# one per event ; the times in ns of the monotonic clock ( None where unknown ) ,
+# 'intended_wire_ms' is the intended moment on the timeline of the connection
+Sample = namedtuple( 'Sample', 'intended_ns intended_wire_ms wire_ms write_ns arrival_ns ack_ns' )
+
+# one per event at the stand-in : 'index' is the INDEX_KEY value of its table ( None if it has none )
+Arrival = namedtuple( 'Arrival', 'ns key timestamp index' )
+
+# the measures of a report
+MEASURES = ( 'lateness', 'jitter', 'stamp', 'write', 'ack' )
+
+# -----------------------------------------------------------------------------
+
+def _stand_in( results, link ) :
+    """
+        the stand-in process : answers the way Netstation does ( 'I' to 'Q', 'Z' to the rest , in order ;
+        'F' where the link model says so ) ,
+        notes when every event arrives ; puts the port , then the list of Arrival records in 'results'
+    """
+
+    listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    listener.bind( ( '127.0.0.1', 0 ) )
+    listener.listen( 1 )
+
+    results.put( listener.getsockname()[1] )
+
+    conn, address = listener.accept()
+    conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+    stream = decoder.StreamDecoder()
+
+    arrivals = []
+    replies = [] # a heap of ( ns due, seqno, reply )
+    ns_last_due = 0
+
+    while True :
+
+        timeout = None
+        if replies :
+            timeout = max( 0.0, ( replies[0][0] - ns_monotonic() ) * 1e-9 )
+
+        readable, writable, failed = select.select( [ conn ], [], [], timeout )
+
+        if readable :
+
+            try :
+                data = conn.recv( 65536 )
+            except socket.error : # reset : the client is gone as well
+                data = ''
+
+            ns = ns_monotonic()
+
+            if not data :
+                break
+
+            for record in stream.feed( data ) :
+
+                if isinstance( record, decoder.Event ) :
+                    index = decoder.table_dict( record ).get( INDEX_KEY )
+                    arrivals.append( Arrival( ns, record.key, record.timestamp, index ) )
+                    reply = 'Z'
+                elif record.code == 'Q' :
+                    reply = 'I\x01'
+                else :
+                    reply = 'Z'
+
+                ns_due = ns
+                if link is not None :
+
+                    delay_s, code = link.reply()
+                    ns_due += int( delay_s * 1e9 )
+
+                    if code == 'F' :
+                        reply = ERROR_REPLY
+
+                # the replies keep the order of the messages
+                ns_last_due = max( ns_due, ns_last_due )
+                heapq.heappush( replies, ( ns_last_due, len( arrivals ), reply ) )
+
+        now = ns_monotonic()
+
+        due = []
+        while replies and replies[0][0] <= now :
+            due.append( heapq.heappop( replies )[2] )
+
+        if due :
+            conn.sendall( ''.join( due ) )
+
+    conn.close()
+    listener.close()
+
+    results.put( arrivals )
+
+
+class StandIn :
+
+    """ the stand-in process for one connection """
+
+    def __init__( self, link = None ) :
+
+        self._results = multiprocessing.Queue()
+
+        self._process = multiprocessing.Process( target = _stand_in, name = "Netstation stand-in", args = ( self._results, link ) )
+        self._process.daemon = True
+        self._process.start()
+
+        self.port = self._results.get( True, 10 )
+
+    def arrivals( self, seconds_timeout = 10 ) :
+        """ the Arrival records of the events , once the client has disconnected """
+
+        arrivals = self._results.get( True, seconds_timeout )
+        self._process.join( seconds_timeout )
+
+        return arrivals
+
+
+# -----------------------------------------------------------------------------
+
+def _open( name, port ) :
+    """ a connected Netstation object of the back-end , the session begun and synced """
+
+    if name not in BACKENDS :
+        raise Error( "no back-end '%s' to time ( there are : %s )" % ( name, ', '.join( BACKENDS ) ) )
+
+    module = __import__( name, globals() )
+
+    ns = module.Netstation()
+
+    if name == 'simple' :
+        error = ns.connect( '127.0.0.1', port )
+    else :
+        error = ns.initialize( '127.0.0.1', port )
+
+    if error is not None :
+        raise error
+
+    ns.BeginSession()
+    ns.sync()
+
+    if hasattr( ns, 'event_log' ) :
+        ns.enable_event_log()
+
+    return ns
+
+
+def _close( ns ) :
+
+    ns.EndSession()
+
+    finalize = getattr( ns, 'finalize', None )
+    if finalize is not None :
+        finalize( 0.5 )
+    else :
+        ns.disconnect()
+
+
+def _wait_until( ns_due, ns_spin ) :
+    """ sleep , then spin the last 'ns_spin' """
+
+    ns_left = ns_due - ns_monotonic()
+    if ns_left > ns_spin :
+        time.sleep( ( ns_left - ns_spin ) * 1e-9 )
+
+    while ns_monotonic() < ns_due :
+        pass
+
+
+def run( backend, rate_hz = 100, n_events = 1000, payload = 'table', link = None, spin_ms = DEFAULT_SPIN_MS ) :
+    """
+        send 'n_events' events at 'rate_hz' through the back-end ( by name ) to a fresh stand-in ;
+        'payload' is one of PAYLOADS ( or a function : event number -> send_event() keyword arguments ,
+        the table a dictionary if any ) ; 'link' -- a faults.LinkModel for the reply delays .
+
+        returns the report ( see report() ) , the list of the samples is in it as 'samples' ;
+        raises Error if an event is missing ( at the stand-in or in the event log ) .
+    """
+
+    make_kwargs = PAYLOADS[ payload ] if payload in PAYLOADS else payload
+
+    # every event gets its number to be matched by
+    events = []
+    for i in xrange( n_events ) :
+
+        kwargs = make_kwargs( i )
+
+        table = kwargs.get( 'table' )
+        if table is not None and not isinstance( table, dict ) :
+            raise Error( "the harness adds '%s' to the table : the payload tables are to be dictionaries" % ( INDEX_KEY, ) )
+
+        kwargs[ 'table' ] = dict( table or {}, **{ INDEX_KEY : i } )
+        events.append( kwargs )
+
+    stand_in = StandIn( link )
+
+    ns = _open( backend, stand_in.port )
+    timeline = ns.timeline()
+
+    period_ns = int( 1e9 / rate_hz )
+    ns_spin = int( spin_ms * 1e6 )
+
+    intended = []
+
+    # the start is a bit later : let the session commands go first
+    ns_start = ns_monotonic() + 50000000
+
+    for i, kwargs in enumerate( events ) :
+
+        ns_due = ns_start + i * period_ns
+        _wait_until( ns_due, ns_spin )
+
+        ns.send_event( KEY, **kwargs )
+
+        intended.append( ns_due )
+
+    _close( ns )
+
+    # after the close : the 'postman' has logged everything by then
+    event_log = ns.event_log() if hasattr( ns, 'event_log' ) else None
+
+    arrivals = stand_in.arrivals()
+    arrived = _by_index( backend, 'arrived at the stand-in', n_events, [  a.index for a in arrivals  ] )
+
+    writes = acks = [ None ] * n_events
+
+    if event_log is not None :
+
+        columns = event_log.arrays()
+        indexes = event_log.column( INDEX_KEY ) if INDEX_KEY in event_log.column_names() else []
+        logged = _by_index( backend, 'in the event log', n_events, indexes )
+
+        writes = [  int( columns[ 't_local_ns' ][ row ] )  for row in logged  ]
+        acks = [  int( columns[ 't_local_ns' ][ row ] + columns[ 'ack_ms' ][ row ] * 1e6 ) if columns[ 'ack_ms' ][ row ] == columns[ 'ack_ms' ][ row ] else None
+                  for row in logged  ]
+
+    samples = []
+    for i in xrange( n_events ) :
+
+        arrival = arrivals[ arrived[i] ]
+        samples.append( Sample( intended[i], timeline.ms( intended[i] ), arrival.timestamp, writes[i], arrival.ns, acks[i] ) )
+
+    return report( samples, backend = backend, rate_hz = rate_hz, payload = payload if payload in PAYLOADS else 'custom' )
+
+
+def _by_index( backend, where, n_events, indexes ) :
+    """ the position of every event number in 'indexes' ; raises Error unless each is there once """
+
+    positions = [ None ] * n_events
+    n_found = 0
+
+    for position, index in enumerate( indexes ) :
+
+        if index is None or not 0 <= index < n_events or positions[ int( index ) ] is not None :
+            raise Error( "%s : an unexpected event ( number %s ) %s" % ( backend, index, where ) )
+
+        positions[ int( index ) ] = position
+        n_found += 1
+
+    if n_found != n_events :
+        raise Error( "%s : %d events sent, %d %s ( the first missing : %d )" % ( backend, n_events, n_found, where, positions.index( None ) ) )
+
+    return positions
+
+
+def compare( backends = BACKENDS, **kwargs ) :
+    """ run() every back-end with the same arguments ; returns the list of the reports """
+
+    return [  run( backend, **kwargs )  for backend in backends  ]
+
+
+# -----------------------------------------------------------------------------
+
+def percentiles( values, points = PERCENTILES ) :
+    """ { point : value } ( the nearest rank ) plus 'max' and 'mean' ; None for no values """
+
+    values = sorted(  v for v in values if v is not None  )
+    n = len( values )
+
+    if not n :
+        return None
+
+    result = dict(  ( p, values[ min( n - 1, int( p * 0.01 * n ) ) ] )  for p in points  )
+    result[ 'max' ] = values[-1]
+    result[ 'mean' ] = sum( values ) / float( n )
+
+    return result
+
+
+def report( samples, **info ) :
+    """
+        the statistics of the samples , all in ms :
+
+        -- 'lateness' -- the arrival at the stand-in after the intended moment ;
+        -- 'jitter' -- how much every interval between the arrivals differs from the intended one ( absolute ) ;
+        -- 'stamp' -- the wire timestamp minus the intended moment ( on the timeline, whole ms ) ;
+        -- 'write' -- the write of the message has returned , after the intended moment ;
+        -- 'ack' -- the reply was read , after the write ;
+        -- 'missing' -- the list of the measures with no samples at all ( None in the report ) .
+    """
+
+    def ms( a, b ) :
+        if a is None or b is None :
+            return None
+        return ( a - b ) * 1e-6
+
+    lateness = [  ms( s.arrival_ns, s.intended_ns )  for s in samples  ]
+
+    jitter = [  abs(  ms( s.arrival_ns, p.arrival_ns ) - ms( s.intended_ns, p.intended_ns )  )
+                for p, s in zip( samples, samples[1:] )  ]
+
+    result = dict( info )
+    result.update( n_events = len( samples ),
+                   lateness = percentiles( lateness ),
+                   jitter = percentiles( jitter ),
+                   stamp = percentiles(  s.wire_ms - s.intended_wire_ms  for s in samples  ),
+                   write = percentiles(  ms( s.write_ns, s.intended_ns )  for s in samples  ),
+                   ack = percentiles(  ms( s.ack_ns, s.write_ns )  for s in samples  ),
+                   samples = samples )
+
+    result[ 'missing' ] = [  measure for measure in MEASURES if result[ measure ] is None  ]
+
+    return result
+
+
+def format_reports( reports ) :
+    """ a text table : a line per back-end and measure """
+
+    columns = [  'p%g' % ( p, )  for p in PERCENTILES  ] + [ 'max', 'mean' ]
+
+    lines = [ "%-14s %-8s %6s %-9s" % ( 'back-end', 'payload', 'Hz', 'ms' ) + ''.join(  "%9s" % ( c, )  for c in columns  ) ]
+
+    for r in reports :
+        for measure in MEASURES :
+
+            head = "%-14s %-8s %6g %-9s" % ( r[ 'backend' ], r[ 'payload' ], r[ 'rate_hz' ], measure )
+
+            stats = r[ measure ]
+            if stats is None :
+                lines.append(  head + ''.join(  "%9s" % ( 'n/a', )  for c in columns  )  )
+                continue
+
+            values = [ stats[p] for p in PERCENTILES ] + [ stats[ 'max' ], stats[ 'mean' ] ]
+            lines.append(  head + ''.join(  "%9.3f" % ( v, )  for v in values  )  )
+
+    return '\n'.join( lines )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+
+    print format_reports( compare( sys.argv[1:] or BACKENDS, rate_hz = 200, n_events = 1000 ) )
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" harness.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import harness
+from faults import LinkModel
+
+
+class StatisticsTest( unittest.TestCase ) :
+
+    def test_percentiles( self ) :
+
+        stats = harness.percentiles( [ None ] + range( 100, 0, -1 ), points = ( 50, 99 ) )
+
+        self.assertEqual( stats[ 50 ], 51 )
+        self.assertEqual( stats[ 99 ], 100 )
+        self.assertEqual( stats[ 'max' ], 100 )
+        self.assertEqual( stats[ 'mean' ], 50.5 )
+
+        self.assertEqual( harness.percentiles( [ None ] ), None )
+
+    def test_report( self ) :
+
+        ms = 1000000
+        samples = [  harness.Sample( i * 10 * ms, i * 10, i * 10, None, i * 10 * ms + ( i % 2 ) * ms, None )  for i in xrange( 4 )  ]
+
+        report = harness.report( samples, backend = 'test', rate_hz = 100, payload = 'bare' )
+
+        self.assertEqual( report[ 'lateness' ][ 'max' ], 1.0 )
+        self.assertEqual( report[ 'jitter' ][ 'mean' ], 1.0 )
+        self.assertEqual( report[ 'stamp' ][ 'max' ], 0 )
+        self.assertEqual( report[ 'write' ], None )
+        self.assertEqual( report[ 'missing' ], [ 'write', 'ack' ] )
+
+        lines = harness.format_reports( [ report ] ).splitlines()
+        self.assertEqual(  [ line.split()[3] for line in lines[1:] ], list( harness.MEASURES )  )
+        self.assertEqual(  [ 'n/a' in line for line in lines[1:] ], [ False, False, False, True, True ]  )
+
+    def test_by_index( self ) :
+
+        self.assertEqual( harness._by_index( 'test', 'here', 3, [ 2, 0, 1 ] ), [ 1, 2, 0 ] )
+
+        self.assertRaises( harness.Error, harness._by_index, 'test', 'here', 3, [ 2, 0 ] )
+        self.assertRaises( harness.Error, harness._by_index, 'test', 'here', 3, [ 2, 0, 0 ] )
+        self.assertRaises( harness.Error, harness._by_index, 'test', 'here', 3, [ 2, 0, None ] )
+
+
+class RunTest( unittest.TestCase ) :
+
+    def test_simple( self ) :
+
+        report = harness.run( 'simple', rate_hz = 200, n_events = 20, payload = 'table' )
+
+        self.assertEqual( report[ 'n_events' ], 20 )
+        self.assertTrue( report[ 'ack' ] is not None )
+        self.assertTrue( report[ 'lateness' ][ 'max' ] < 1000 )
+        self.assertEqual( report[ 'missing' ], [] )
+
+    def test_matched_by_index( self ) :
+
+        report = harness.run( 'threaded', rate_hz = 200, n_events = 10, payload = 'bare' )
+
+        self.assertEqual( report[ 'missing' ], [] )
+        self.assertEqual(  [ s.wire_ms >= s.intended_wire_ms for s in report[ 'samples' ] ], [ True ] * 10  )
+        self.assertEqual(  sorted( report[ 'samples' ] ), report[ 'samples' ]  )
+
+    def test_no_event_log( self ) :
+
+        report = harness.run( 'multiprocessed', rate_hz = 200, n_events = 5, payload = 'bare' )
+
+        self.assertEqual( report[ 'missing' ], [ 'write', 'ack' ] )
+
+    def test_table_not_a_dictionary( self ) :
+
+        payload = lambda i : dict( table = [ ( 'n', i ) ] )
+
+        self.assertRaises( harness.Error, harness.run, 'simple', n_events = 2, payload = payload )
+
+    def test_reply_delays( self ) :
+
+        report = harness.run( 'simple', rate_hz = 100, n_events = 5, payload = 'bare', link = LinkModel( seed = 1, rtt_ms = ( 'fixed', 20 ) ) )
+
+        self.assertTrue( report[ 'ack' ][ 'mean' ] >= 15, report[ 'ack' ] )
+
+    def test_unknown_backend( self ) :
+
+        self.assertRaises( harness.Error, harness._open, 'nosuch', 0 )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,364 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    The diagnostic output of the package -- through the standard 'logging', but never
+    blocking the caller on the terminal : the records are put in a queue and written
+    by a background thread ( a Windows console or the PsychoPy Coder output may take
+    milliseconds per line ) .
+
+    Every call site is rate limited ( 'rate' records per second with bursts up to 'burst' ) ,
+    the suppressed records are counted and mentioned with the next one let through
+    ( the records with the 'egi_unlimited' attribute -- the egi.fake output -- are never suppressed ) .
+
+        import egi.log
+        egi.log.configure( level = logging.DEBUG, rate = 100 )
+        ...
+        egi.log.shutdown() # flush what is left in the queue
+
+    The loggers are "egi.<module>" . As any library, the package only puts a NullHandler on
+    the "egi" logger : without configure() the records go wherever the application's logging
+    set-up sends them , and nothing is started . configure() writes INFO and above to stderr
+    and stops the propagation ( configure( handler = None, propagate = True ) hands the records
+    to the application handlers instead -- still through the queue ) ; shutdown() undoes it .
+
+    The one exception is the output that is the point of a module ( the dry run of egi.fake ) :
+    with no logging set up at all it goes to stdout -- through a queue of its own as well ,
+    started on the first record ( see default_output() ; configure() and shutdown() remove it ) .
+
+    In a forked process ( the multiprocessed 'postman' ) there is no writer thread :
+    there the records are written directly .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import logging
+import sys, os
+import atexit
+
+from threading import Thread, Lock
+from Queue import Queue, Full
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+ROOT = 'egi'
+
+DEFAULT_RATE = 10 # records per second per call site
+DEFAULT_BURST = 20
+DEFAULT_CAPACITY = 4096
+
+_FORMAT = "%(asctime)s %(name)s %(levelname)s: %(message)s"
+
+
+def get_logger( name ) :
+    """ the logger of a module of the package ( 'simple' -> "egi.simple" ) """
+
+    return logging.getLogger( ROOT + '.' + name )
+
+
+# -----------------------------------------------------------------------------
+
+class _RateLimit( logging.Filter ) :
+
+    """ a token bucket per call site ; the site is ( file, line ) or the 'egi_site' record attribute """
+
+    def __init__( self, rate = DEFAULT_RATE, burst = DEFAULT_BURST ) :
+
+        logging.Filter.__init__( self )
+
+        self._rate = float( rate )
+        self._burst = float( burst )
+
+        # site -> [ tokens, the last time , the number suppressed since the last record let through ]
+        self._sites = {}
+        self._lock = Lock()
+
+        self.suppressed = 0
+
+    def filter( self, record ) :
+
+        if not self._rate or getattr( record, 'egi_unlimited', False ) :
+            return True
+
+        site = getattr( record, 'egi_site', None ) or ( record.pathname, record.lineno )
+        now = record.created
+
+        with self._lock :
+
+            bucket = self._sites.get( site )
+            if bucket is None :
+                bucket = self._sites[ site ] = [ self._burst, now, 0 ]
+
+            tokens = min( self._burst, bucket[0] + ( now - bucket[1] ) * self._rate )
+            bucket[1] = now
+
+            if tokens < 1.0 :
+                bucket[0] = tokens
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+
+            bucket[0] = tokens - 1.0
+
+            n_suppressed = bucket[2]
+            bucket[2] = 0
+
+        if n_suppressed :
+            record.msg = "%s ( %d more suppressed )" % ( record.msg, n_suppressed )
+
+        return True
+
+
+# -----------------------------------------------------------------------------
+
+class _QueueHandler( logging.Handler ) :
+
+    """
+        puts the records in a queue ( never waiting : when it is full the record is dropped and counted ) ;
+        in a forked process ( no writer thread there ) hands them to the handlers directly
+    """
+
+    def __init__( self, queue, handlers ) :
+
+        logging.Handler.__init__( self )
+
+        self._queue = queue
+        self._handlers = handlers
+        self._pid = os.getpid()
+
+        self.dropped = 0
+
+    def emit( self, record ) :
+
+        if os.getpid() != self._pid :
+            _write( self._handlers, record )
+            return
+
+        try :
+
+            # format in the caller : the arguments may change before the listener gets to them
+            record.msg = record.getMessage()
+            record.args = None
+
+            if record.exc_info :
+                record.exc_text = logging.Formatter().formatException( record.exc_info )
+                record.exc_info = None
+
+            self._queue.put_nowait( record )
+
+        except Full :
+            self.dropped += 1
+
+        except Exception :
+            self.handleError( record )
+
+
+class _Listener( Thread ) :
+
+    """ hands the queued records to the real handlers """
+
+    def __init__( self, queue, handlers ) :
+
+        Thread.__init__( self )
+
+        self.setName( "egi log writer" )
+        self.setDaemon( True )
+
+        self._queue = queue
+        self._handlers = handlers
+
+    def run( self ) :
+
+        while True :
+
+            record = self._queue.get()
+            if record is None : # the end marker
+                break
+
+            _write( self._handlers, record )
+
+    def stop( self, seconds_timeout = 1 ) :
+
+        self._queue.put( None )
+        self.join( seconds_timeout )
+
+
+def _write( handlers, record ) :
+
+    for handler in handlers :
+        if record.levelno >= handler.level :
+            handler.handle( record )
+
+
+class _Stdout( logging.StreamHandler ) :
+    """ the plain messages to sys.stdout as it is at the moment of the write ( it may be redirected later ) """
+
+    def __init__( self ) :
+
+        logging.StreamHandler.__init__( self, sys.stdout )
+        self.setFormatter( logging.Formatter( "%(message)s" ) )
+
+    def emit( self, record ) :
+
+        self.stream = sys.stdout
+        logging.StreamHandler.emit( self, record )
+
+
+class _Propagate( logging.Handler ) :
+    """ passes the records on to the handlers of the root logger ( in the listener thread ) """
+
+    def emit( self, record ) :
+
+        _write( logging.getLogger().handlers, record )
+
+
+# -----------------------------------------------------------------------------
+
+_state = { 'listener' : None, 'handler' : None, 'limit' : None, 'default' : None }
+
+_default_lock = Lock()
+
+
+def configure( level = logging.INFO, handler = 'stderr', rate = DEFAULT_RATE, burst = DEFAULT_BURST,
+               capacity = DEFAULT_CAPACITY, propagate = False ) :
+    """
+        ( re- ) install the queue in front of 'handler' ( a logging.Handler , 'stderr' ,
+        or None to only propagate the records to the application loggers ) ;
+        'rate' = 0 turns the rate limiting off .
+    """
+
+    shutdown()
+
+    root = logging.getLogger( ROOT )
+    root.setLevel( level )
+
+    handlers = []
+    if handler == 'stderr' :
+        handler = logging.StreamHandler( sys.stderr )
+        handler.setFormatter( logging.Formatter( _FORMAT ) )
+
+    if handler is not None :
+        handlers.append( handler )
+
+    if propagate :
+        handlers.append( _Propagate() )
+
+    queue = Queue( capacity )
+
+    queue_handler = _QueueHandler( queue, handlers )
+    limit = _RateLimit( rate, burst )
+    queue_handler.addFilter( limit )
+
+    listener = _Listener( queue, handlers )
+    listener.start()
+
+    root.addHandler( queue_handler )
+    root.propagate = False # the application handlers get the records from the listener
+
+    _state.update( listener = listener, handler = queue_handler, limit = limit )
+
+
+def shutdown( seconds_timeout = 1 ) :
+    """ write out what is queued and remove the queue handler """
+
+    _remove_default( seconds_timeout )
+
+    listener = _state[ 'listener' ]
+    if listener is None :
+        return
+
+    root = logging.getLogger( ROOT )
+    root.removeHandler( _state[ 'handler' ] )
+    root.propagate = True
+
+    listener.stop( seconds_timeout )
+
+    _state.update( listener = None )
+
+
+def default_output( name, capacity = DEFAULT_CAPACITY ) :
+    """
+        the INFO records of "egi.<name>" to stdout through a queue , unless configure() has been called
+        or the application has set up the logging itself ( then the records go there , as usual ) ;
+        started once , on the first call -- the records are not rate limited
+    """
+
+    if _state[ 'default' ] is not None or is_configured() or logging.getLogger().handlers :
+        return
+
+    with _default_lock :
+
+        if _state[ 'default' ] is not None :
+            return
+
+        logger = get_logger( name )
+        logger.setLevel( logging.INFO )
+
+        handlers = [ _Stdout() ]
+        queue = Queue( capacity )
+
+        queue_handler = _QueueHandler( queue, handlers )
+
+        listener = _Listener( queue, handlers )
+        listener.start()
+
+        logger.addHandler( queue_handler )
+        logger.propagate = False
+
+        _state[ 'default' ] = ( logger, queue_handler, listener )
+
+
+def _remove_default( seconds_timeout ) :
+
+    with _default_lock :
+
+        default = _state[ 'default' ]
+        if default is None :
+            return
+
+        logger, queue_handler, listener = default
+
+        logger.removeHandler( queue_handler )
+        logger.propagate = True
+        logger.setLevel( logging.NOTSET )
+
+        listener.stop( seconds_timeout )
+
+        _state[ 'default' ] = None
+
+
+def is_configured() :
+    """ True between configure() and shutdown() """
+
+    return _state[ 'listener' ] is not None
+
+
+def stats() :
+    """ { 'suppressed' : by the rate limit , 'dropped' : the queue was full } """
+
+    if _state[ 'handler' ] is None :
+        return { 'suppressed' : 0, 'dropped' : 0 }
+
+    return { 'suppressed' : _state[ 'limit' ].suppressed, 'dropped' : _state[ 'handler' ].dropped }
+
+
+# a library : no output unless the application ( or configure() ) sets it up
+logging.getLogger( ROOT ).addHandler( logging.NullHandler() )
+
+# do not lose the last records at exit ( the writer thread is a daemon )
+atexit.register( shutdown )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" log.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import logging
+import threading
+import sys
+from StringIO import StringIO
+
+import log
+
+
+class _Collect( logging.Handler ) :
+
+    def __init__( self ) :
+
+        logging.Handler.__init__( self )
+        self.records = []
+
+    def emit( self, record ) :
+
+        self.records.append( record )
+
+
+def _record( msg = 'x', **extra ) :
+
+    record = logging.LogRecord( 'egi.test', logging.INFO, __file__, 1, msg, None, None )
+    record.__dict__.update( extra )
+    return record
+
+
+class LogTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        # the fake output of the other tests may have started the default one
+        log.shutdown()
+
+    def tearDown( self ) :
+
+        log.shutdown()
+
+    def test_nothing_started_on_import( self ) :
+
+        root = logging.getLogger( log.ROOT )
+
+        self.assertFalse( log.is_configured() )
+        self.assertTrue( root.propagate )
+        self.assertTrue( any(  isinstance( h, logging.NullHandler )  for h in root.handlers  ) )
+        self.assertFalse( any(  t.getName() == "egi log writer"  for t in threading.enumerate()  ) )
+
+    def test_shutdown_gives_the_records_back( self ) :
+
+        collect = _Collect()
+
+        log.configure( handler = collect )
+        self.assertFalse( logging.getLogger( log.ROOT ).propagate )
+
+        log.get_logger( 'test' ).info( "through the queue" )
+        log.shutdown()
+
+        self.assertEqual( [ r.getMessage() for r in collect.records ], [ "through the queue" ] )
+        self.assertTrue( logging.getLogger( log.ROOT ).propagate )
+
+    def test_rate_limit_exemption( self ) :
+
+        limit = log._RateLimit( rate = 1, burst = 1 )
+
+        self.assertEqual( sum(  limit.filter( _record() )  for i in xrange( 10 )  ), 1 )
+        self.assertEqual( sum(  limit.filter( _record( egi_unlimited = True ) )  for i in xrange( 10 )  ), 10 )
+
+    def test_forked_process_writes_directly( self ) :
+
+        collect = _Collect()
+        handler = log._QueueHandler( log.Queue( 1 ), [ collect ] )
+
+        handler._pid = -1 # as if forked
+        handler.emit( _record( 'in the child' ) )
+
+        self.assertEqual( len( collect.records ), 1 )
+
+    def test_fake_prints_without_logging( self ) :
+
+        import fake
+
+        writes = []
+
+        class _Output( StringIO ) :
+            def write( self, s ) :
+                writes.append( threading.current_thread() )
+                StringIO.write( self, s )
+
+        stdout = sys.stdout
+        sys.stdout = _Output()
+        try :
+            fake.Print( 'BeginSession()' )
+            log.shutdown() # the queue is written out
+            output = sys.stdout.getvalue()
+        finally :
+            sys.stdout = stdout
+
+        self.assertTrue( 'BeginSession()' in output )
+
+        # not in the caller
+        self.assertTrue( writes )
+        self.assertFalse( threading.current_thread() in writes )
+
+    def test_configure_replaces_the_default( self ) :
+
+        import fake
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try :
+            fake.Print( 'BeginSession()' )
+            self.assertTrue( log._state[ 'default' ] is not None )
+
+            collect = _Collect()
+            log.configure( handler = collect )
+            self.assertTrue( log._state[ 'default' ] is None )
+
+            fake.Print( 'EndSession()' )
+            log.shutdown()
+        finally :
+            sys.stdout = stdout
+
+        self.assertEqual( len( collect.records ), 1 )
+        self.assertTrue( 'EndSession()' in collect.records[0].getMessage() )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,568 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    A multiprocessed implementation of the "egi.netstation" component .
+
+    ( The socket, the message encoder and the acknowledgement handling all live
+      in a separate 'postman' process, so they do not compete for the GIL with
+      the experiment loop ; the calling side only copies the command arguments
+      into a fixed-size slot of a shared-memory ring buffer and wakes the
+      'postman' up -- no pickling per command . )
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # Netstation object, mostly
+from timeline import Timeline
+from clock import ns_monotonic
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+ms_localtime = internal.ms_localtime
+
+# -----------------------------------------------------------------------------
+
+import multiprocessing
+import ctypes # memmove() for the slots, c_char for the shared buffer
+import struct
+import marshal # the variable part of the arguments ( much cheaper than pickle )
+import cPickle # only to check that an exception can be sent back
+from Queue import Empty, Full
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+#
+# the commands the 'postman' process understands ; the index in the tuple is the code
+# written to the slot header , zero is reserved for the end marker
+#
+
+_OPS = ( None ,
+         'BeginSession' ,
+         'EndSession' ,
+         'StartRecording' ,
+         'StopRecording' ,
+         'sync' ,
+         'send_event' ,
+         'set_event_budget' ,
+         'rollover' ,
+         'rollover_if_needed' ,
+         'start_session' ,
+         'send_encoded' ,
+       )
+
+_OP_CODES = dict(  ( name, code ) for code, name in enumerate( _OPS ) if name is not None  )
+
+_OP_END = 0
+
+# slot header : the command code and the length of the marshalled arguments
+_SLOT_HEADER = struct.Struct( '=BH' )
+_MAX_PAYLOAD = 0xFFFF
+
+# how often ( s ) a caller waiting for a result checks that the 'postman' is still alive
+_ALIVE_CHECK_INTERVAL = 0.1
+
+# the results not read yet ( the later ones are dropped and counted , see Netstation.results_dropped() )
+DEFAULT_RESULTS = 1024
+
+
+# -----------------------------------------------------------------------------
+
+class _SharedRing :
+    """
+        a single-consumer ring buffer of fixed-size slots living in shared memory ;
+
+        the producer ( our experiment process ) and the consumer ( the 'postman' )
+        each own their own slot index, and two semaphores count the free and
+        the filled slots -- so a put() is a memcpy() and a semaphore release ;
+        the puts are serialized by a lock ( the threads of the experiment may share the ring ) .
+    """
+
+    def __init__( self, n_slots = 1024, slot_size = 1024 ) :
+
+        if slot_size <= _SLOT_HEADER.size :
+            raise Error( "the slot size should be bigger than %d bytes" % ( _SLOT_HEADER.size, ) )
+
+        if slot_size - _SLOT_HEADER.size > _MAX_PAYLOAD :
+            raise Error( "the slot size should not exceed %d bytes ( the slot header counts up to %d )" % ( _MAX_PAYLOAD + _SLOT_HEADER.size, _MAX_PAYLOAD ) )
+
+        self._n_slots = n_slots
+        self._slot_size = slot_size
+
+        self._buffer = multiprocessing.RawArray( ctypes.c_char, n_slots * slot_size )
+
+        self._free = multiprocessing.Semaphore( n_slots )
+        self._filled = multiprocessing.Semaphore( 0 )
+
+        # the head index and the slot it points to belong to one put() at a time
+        self._put_lock = multiprocessing.Lock()
+
+        # process-local indices : only the producer moves the head,
+        # only the consumer moves the tail
+        self._head = 0
+        self._tail = 0
+
+    def max_payload( self ) :
+        """ the largest number of argument bytes that fits a slot """
+
+        return self._slot_size - _SLOT_HEADER.size
+
+    def put( self, op, payload = '', seconds_timeout = None ) :
+        """ copy the command into the next free slot ; raises an exception if no slot is freed in time """
+
+        n = len( payload )
+        if n > self.max_payload() :
+            raise Error( "the command does not fit the slot (%d > %d bytes)" % ( n, self.max_payload() ) )
+
+        if seconds_timeout is None :
+            self._free.acquire()
+        elif not self._free.acquire( True, seconds_timeout ) :
+            raise Error( "the 'postman' process is not keeping up, the ring buffer is full" )
+
+        with self._put_lock :
+
+            offset = ( self._head % self._n_slots ) * self._slot_size
+            self._head += 1
+
+            _SLOT_HEADER.pack_into( self._buffer, offset, op, n )
+            if n > 0 :
+                ctypes.memmove( ctypes.addressof( self._buffer ) + offset + _SLOT_HEADER.size, payload, n )
+
+            # released under the lock : the slots are filled in the order of the head
+            self._filled.release()
+
+    def get( self ) :
+        """ wait for the next filled slot and return its ( op, payload ) contents """
+
+        self._filled.acquire()
+
+        offset = ( self._tail % self._n_slots ) * self._slot_size
+        self._tail += 1
+
+        op, n = _SLOT_HEADER.unpack_from( self._buffer, offset )
+        start = offset + _SLOT_HEADER.size
+        payload = self._buffer[ start : start + n ]
+
+        self._free.release()
+
+        return op, payload
+
+
+# -----------------------------------------------------------------------------
+
+def _shared_field( index, cast ) :
+    """ a Timeline attribute kept in the slot 'index' of its shared array """
+
+    def get( self ) :
+        return cast( self._shared[ index ] )
+
+    def put( self, value ) :
+        self._shared[ index ] = value
+
+    return property( get, put )
+
+
+class _SharedTimeline( Timeline ) :
+    """
+        a timeline.Timeline with the epoch and the flags in shared memory : the stamps taken here
+        and the resyncs ( and the rebases ) done by the 'postman' are in one base ;
+        a stamp here may be the one to set 'resync_due' , the 'postman' sends the sync before its next event .
+    """
+
+    def __init__( self ) :
+
+        # ns_epoch, wire_epoch, resync_due, stale, n_rebases
+        self._shared = multiprocessing.RawArray( ctypes.c_longlong, 5 )
+
+        # the epoch is two values : read and written as one
+        self._epoch_lock = multiprocessing.Lock()
+
+        Timeline.__init__( self )
+
+        # the rebases are done by either process
+        self._lock = multiprocessing.Lock()
+
+    def _get_epoch( self ) :
+
+        with self._epoch_lock :
+            return ( self._shared[0], self._shared[1] )
+
+    def _set_epoch( self, epoch ) :
+
+        with self._epoch_lock :
+            self._shared[0], self._shared[1] = epoch
+
+    _epoch = property( _get_epoch, _set_epoch )
+
+    resync_due = _shared_field( 2, bool )
+    stale = _shared_field( 3, bool )
+    n_rebases = _shared_field( 4, int )
+
+
+# -----------------------------------------------------------------------------
+
+def _portable( e ) :
+    """ the exception itself if it can be sent to the other process , an Error with its text otherwise """
+
+    try :
+        cPickle.dumps( e, 2 )
+    except Exception :
+        return Error( "%s: %s" % ( e.__class__.__name__, e ) )
+
+    return e
+
+
+def _put_result( received, n_dropped, result ) :
+    """ never wait for the room : nobody may be reading the results """
+
+    try :
+        received.put_nowait( result )
+    except Full :
+        with n_dropped.get_lock() :
+            n_dropped.value += 1
+
+
+def _postman( ring, received, n_dropped, timeline, str_address, port_no, seconds_timeout ) :
+    """ the body of the 'postman' process : connect, then execute the commands from the ring """
+
+    netstation_object = internal.Netstation( timeline )
+
+    try :
+        error = netstation_object.connect( str_address, port_no, seconds_timeout )
+    except Exception as e :
+        error = _portable( e )
+
+    received.put( error )
+
+    if error is not None :
+        return
+
+    while True :
+
+        op, payload = ring.get()
+
+        if op == _OP_END :
+
+            try :
+                netstation_object.disconnect()
+            except Exception as e :
+                _put_result( received, n_dropped, _portable( e ) )
+
+            break
+
+        # do not let the process die silently : the other side would wait forever ;
+        # the exception is the result ( as with the threaded back-ends )
+        try :
+            args = marshal.loads( payload ) if payload else ()
+            ret = getattr( netstation_object, _OPS[ op ] )( *args )
+        except Exception as e :
+            ret = _portable( e )
+
+        _put_result( received, n_dropped, ret )
+
+
+# -----------------------------------------------------------------------------
+
+class Netstation :
+
+    """ Provides Python interface for a connection with the Netstation via a TCP/IP socket. """
+
+    ## -----------------------------------------------------------
+
+    def __init__( self, n_slots = 1024, slot_size = 1024, seconds_timeout = 2, n_results = DEFAULT_RESULTS ) :
+        """
+            'n_slots' and 'slot_size' define the shared ring buffer ;
+            a command that does not fit a single slot raises an exception .
+
+            'seconds_timeout' is how long a command may wait for a free slot
+            ( None means "forever" ) .
+
+            'n_results' -- how many results ( one per command ) are kept until read ,
+            the later ones are dropped ( see results_dropped() ) .
+        """
+
+        self._ring = _SharedRing( n_slots, slot_size )
+        self._to_receive = multiprocessing.Queue( n_results )
+        self._n_dropped = multiprocessing.Value( 'L', 0 )
+
+        self._seconds_timeout = seconds_timeout
+
+        self._netstation_process = None
+
+        # the timestamps are taken here , in the very base of the 'postman' : the timeline is shared with it
+        # ( its connect() starts the epoch, its resyncs rebase it ) , no asking the other process
+        self._timeline = _SharedTimeline()
+
+    ## -----------------------------------------------------------
+
+    def ms_now( self ) :
+        """ the current time in ms, as the 'postman' would send it ( see simple.Netstation.ms_now() ) """
+
+        return self._timeline.ms()
+
+    def timeline( self ) :
+        """ the timeline.Timeline the timestamps are taken from """
+
+        return self._timeline
+
+    ## -----------------------------------------------------------
+
+    def _put( self, name, args = None ) :
+        """ a shortcut to put a command in the ring buffer """
+
+        if args is None :
+            payload = ''
+        else :
+            try :
+                payload = marshal.dumps( args )
+            except ValueError :
+                raise Error( "'%s': only the built-in types can be passed to the other process" % ( repr(args), ) )
+
+        self._ring.put( _OP_CODES[ name ], payload, self._seconds_timeout )
+
+        # return None
+
+    def _get( self, seconds_timeout = None ) :
+        """
+            a shortcut to get sth from the 'to-receive' queue ; nb. : blocks ! --
+            -- but raises an exception once the 'postman' process is gone ( or after 'seconds_timeout' )
+        """
+
+        if seconds_timeout is not None :
+            ns_end = ns_monotonic() + int( seconds_timeout * 1e9 )
+
+        while True :
+
+            # checked before waiting : whatever the process has put before it exited is in the pipe by then
+            b_alive = self._ns_process_is_running()
+
+            try :
+                return self._to_receive.get( True, _ALIVE_CHECK_INTERVAL )
+            except Empty :
+                pass
+
+            if not b_alive :
+                raise Error( "the 'postman' process has exited" )
+
+            if seconds_timeout is not None and ns_monotonic() > ns_end :
+                raise Error( "no result from the 'postman' process in %g s" % ( seconds_timeout, ) )
+
+    ## -----------------------------------------------------------
+
+    def enumerate_responses( self ) :
+        """ the results that are there already ( no qsize() : it is not implemented on macOS ) """
+
+        while True :
+
+            try :
+                data = self._to_receive.get_nowait()
+            except Empty :
+                return
+
+            yield data
+
+    def results_dropped( self ) :
+        """ the number of the results dropped since nobody was reading them ( see __init__() ) """
+
+        return self._n_dropped.value
+
+    # a simple 'dummy processor' made for convenience
+    def process_responces( self ) :
+
+        for resp in self.enumerate_responses() :
+
+            pass
+
+    ## -----------------------------------------------------------
+
+    def _ns_process_is_running( self ) :
+        """ returns True if our 'postman' process is stil busy with doing something """
+
+        return ( self._netstation_process is not None ) and self._netstation_process.is_alive()
+
+    ## -----------------------------------------------------------
+
+    def initialize( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT ) :
+        """ start the 'Mr. Postman' process /and/ wait until it opens the socket """
+
+        self._netstation_process = multiprocessing.Process( target = _postman,
+                                                            name = "Netstation Process",
+                                                            args = ( self._ring, self._to_receive, self._n_dropped, self._timeline,
+                                                                     str_address, port_no, seconds_timeout ) )
+        self._netstation_process.daemon = True
+        self._netstation_process.start()
+
+        # the socket connection timeout plus the process startup
+        try :
+            error = self._get( seconds_timeout + 10 )
+        except Error as e :
+            error = e
+
+        if error is not None :
+            self._netstation_process.join( 1 )
+            if self._netstation_process.is_alive() :
+                self._netstation_process.terminate()
+            self._netstation_process = None
+
+        return error
+
+    def finalize( self, seconds_timeout = 2 ) :
+        """ send the process the 'Done' message and wait until it finishes """
+
+        if self._netstation_process is None :
+            return
+
+        self._ring.put( _OP_END, '', seconds_timeout )
+
+        self._netstation_process.join( seconds_timeout )
+
+        if self._netstation_process.is_alive() :
+            self._netstation_process.terminate()
+
+        self.process_responces()
+
+        self._netstation_process = None
+
+    def connect( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT ) :
+        """ wrap the initialize function for simple vs. multiprocessed mode """
+
+        return self.initialize( str_address, port_no, seconds_timeout )
+
+    def start( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT, b_record = True ) :
+        """
+            start the 'postman' ( raising the connection error if it fails ) and queue the pipelined
+            start_session() ; its timings ( see simple.Netstation.start_session() ) are put in the 'received' queue
+        """
+
+        error = self.initialize( str_address, port_no, seconds_timeout )
+        if error is not None :
+            raise error
+
+        self.start_session( b_record )
+
+    def start_session( self, b_record = True ) :
+        """ queue BeginSession, sync and StartRecording as one pipelined write """
+
+        self._put( 'start_session', ( b_record, ) )
+
+    def disconnect( self, seconds_timeout = 2 ) :
+        """ wrap the finalize function for simple vs. multiprocessed mode """
+
+        self.finalize( seconds_timeout )
+
+    ## -----------------------------------------------------------
+
+    def BeginSession( self ) :
+        """ say 'hi!' to the server """
+
+        self._put( 'BeginSession' )
+
+
+    def EndSession( self ):
+        """ say 'bye' to the server """
+
+        self._put( 'EndSession' )
+
+    ## -----------------------------------------------------------
+
+    def StartRecording( self ):
+        """ start recording to the selected ( externally ) file """
+
+        self._put( 'StartRecording' )
+
+
+    def StopRecording( self ):
+        """ stop recording to the selected file;
+            the recording can be resumed with the BeginRecording() command
+            if the session is not closed yet .
+        """
+
+        self._put( 'StopRecording' )
+
+    ## -----------------------------------------------------------
+
+    def sync( self, timestamp = None ) :
+        """ a shortcut for sending the 'attention' command and the time info """
+
+        self._put( 'sync', ( timestamp, ) )
+
+    ## -----------------------------------------------------------
+
+    def set_event_budget( self, budget = internal.DEFAULT_EVENT_BUDGET, warn_at = ( 0.75, 0.9 ), on_exhausted = 'warn' ) :
+        """ configure the per-session event accounting ( see simple.Netstation.set_event_budget() ) """
+
+        self._put( 'set_event_budget', ( budget, tuple( warn_at ), on_exhausted ) )
+
+    def rollover( self, b_record = True ) :
+        """ queue a session rollover ; the time it took is put in the 'received' queue """
+
+        self._put( 'rollover', ( b_record, ) )
+
+    def rollover_if_needed( self, fraction = 0.9, b_record = True ) :
+        """ queue a conditional session rollover ( checked when the 'postman' gets to it ) """
+
+        self._put( 'rollover_if_needed', ( fraction, b_record ) )
+
+    ## -----------------------------------------------------------
+
+    # send_event, send_simple_event
+
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+        """
+            Send an event ; note that before sending any events a sync() has to be called
+            to make the sent events effective .
+
+            Arguments:
+            -- 'id' -- a four-character identifier of the event ;
+            -- 'timestamp' -- the local time when event has happened, in milliseconds ;
+                              note that the "clock" used to produce the timestamp should be the same
+                              as for the sync() method, and, ideally,
+                              should be obtained via a call to the same function ;
+                              if 'timestamp' is None, a time.time() wrapper is used
+                              ( at the moment of the call, not when the 'postman' gets to it ) .
+            -- 'label' -- a string with any additional information, up to 256 characters .
+            -- 'description' -- more additional information can go here ( same limit applies ) .
+            -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
+                          not more than 256 in total ;
+                          the values have to be of the built-in types ( strings, numbers, booleans ) ,
+                          and the size of every value entry in bytes should not exceed 2 ^ 16 .
+
+            Note A: due to peculiarity of the implementation, our particular version of NetStation
+                    was not able to record more than 2^15 events per session .
+
+            Note B: it is *strongly* recommended to send as less data as possible .
+
+        """
+
+        if timestamp is None :
+            timestamp = self._timeline.ms()
+
+        self._put( 'send_event', ( key, timestamp, label, description, table, pad ) )
+
+    def send_encoded( self, message, b_wait = True ) :
+        """ queue an event already packed by _DataFormat.pack() ( see simple.Netstation.send_encoded() ) """
+
+        self._put( 'send_encoded', ( str( message ), b_wait ) )
+
+    def send_timestamped_event( self, key, label = None, description = None, table = None, pad = False ) :
+        """ wraps send_event() with the timestamp taken at the moment of the call """
+
+        self.send_event( key, self._timeline.ms(), label, description, table, pad )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" multiprocessed.py against the local stand-in ( harness.StandIn ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import threading
+import marshal
+
+import multiprocessed
+from harness import StandIn
+
+
+class SharedRingTest( unittest.TestCase ) :
+
+    def test_slot_size_limit( self ) :
+
+        self.assertRaises( multiprocessed.Error, multiprocessed._SharedRing, 4, 0x10000 + multiprocessed._SLOT_HEADER.size )
+
+        ring = multiprocessed._SharedRing( 4, 0xFFFF + multiprocessed._SLOT_HEADER.size )
+        self.assertEqual( ring.max_payload(), 0xFFFF )
+
+    def test_put_get( self ) :
+
+        ring = multiprocessed._SharedRing( 2, 16 )
+
+        ring.put( 1, 'abc' )
+        ring.put( 2 )
+
+        self.assertEqual( ring.get(), ( 1, 'abc' ) )
+        self.assertEqual( ring.get(), ( 2, '' ) )
+        self.assertRaises( multiprocessed.Error, ring.put, 1, 'x' * 16 )
+
+    def test_threads_share_the_ring( self ) :
+
+        n_threads, n_puts = 4, 2000
+        ring = multiprocessed._SharedRing( 8, 64 )
+
+        def produce( i ) :
+            for k in xrange( n_puts ) :
+                ring.put( 1, marshal.dumps( ( i, k, 'x' * ( k % 40 ) ) ) )
+
+        threads = [  threading.Thread( target = produce, args = ( i, ) )  for i in xrange( n_threads )  ]
+        for t in threads :
+            t.start()
+
+        got = [  marshal.loads( ring.get()[1] )  for k in xrange( n_threads * n_puts )  ]
+
+        for t in threads :
+            t.join()
+
+        # every command whole , and in the order of its thread
+        for i in xrange( n_threads ) :
+            mine = [  ( k, x )  for j, k, x in got if j == i  ]
+            self.assertEqual( mine, [  ( k, 'x' * ( k % 40 ) )  for k in xrange( n_puts )  ] )
+
+
+class PostmanTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        self.stand_in = StandIn()
+
+        self.ns = multiprocessed.Netstation()
+        self.assertEqual( self.ns.initialize( '127.0.0.1', self.stand_in.port ), None )
+
+    def tearDown( self ) :
+
+        self.ns.finalize( 1 )
+
+    def test_any_exception_is_a_result( self ) :
+
+        # not a number : the 'T' message cannot be packed ( a struct.error , not an Error )
+        self.ns.sync( 'later' )
+        self.assertTrue( isinstance( self.ns._get( 5 ), Exception ) )
+
+        # and the 'postman' keeps going
+        self.ns.BeginSession()
+        self.assertEqual( self.ns._get( 5 ), True )
+
+    def test_results_bounded( self ) :
+
+        self.ns.finalize( 1 )
+        self.stand_in.arrivals()
+
+        self.stand_in = StandIn()
+        self.ns = multiprocessed.Netstation( n_results = 4 )
+        self.assertEqual( self.ns.initialize( '127.0.0.1', self.stand_in.port ), None )
+
+        for i in xrange( 10 ) :
+            self.ns.send_event( 'stim' )
+
+        self.ns.sync()
+        self.ns.finalize( 5 )
+
+        self.assertEqual( self.ns.results_dropped(), 7 )
+        self.assertEqual( len( self.stand_in.arrivals() ), 10 )
+
+    def test_responses_without_qsize( self ) :
+
+        def qsize() :
+            raise NotImplementedError() # as on macOS
+
+        self.ns._to_receive.qsize = qsize
+
+        self.ns.BeginSession()
+        self.assertEqual( self.ns._get( 5 ), True )
+
+        self.ns.EndSession()
+        self.ns.finalize( 5 )
+
+        self.assertEqual( list( self.ns.enumerate_responses() ), [] )
+
+    def test_dead_postman( self ) :
+
+        self.ns._netstation_process.terminate()
+        self.ns._netstation_process.join()
+
+        self.assertRaises( multiprocessed.Error, self.ns._get )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    PsychoPy integration : events locked to the screen flip .
+
+    myWin.callOnFlip( ns.send_event, ... ) builds the table, packs the message
+    and ( for egi.simple ) waits for the reply -- all inside the flip callback .
+    Here the event is packed before the flip, and the flip callback only stamps
+    the flip time into the ready message and hands it to the sender :
+
+        marker = FlipMarker( myWin, ns )
+
+        marker.mark( 'stim', label = 'target', table = { 'cond' : cond } )
+        myWin.flip()
+        marker.poll() # collect the replies outside of the frame ( egi.simple only )
+
+        ...
+        print marker.report()
+
+    The per-event costs ( packing, stamping, handing over ) are kept to prove
+    that event marking does not drop frames : the totals and the maxima over all
+    the events , the last COSTS_KEPT of them one by one .
+
+    The flip callback never resyncs : when the wire time is about to wrap ( see timeline.py )
+    the next mark() or poll() sends the sync , outside of the flip ; with egi.threaded the sync
+    is only queued , a flip stamped before the 'postman' gets to it is moved to the new base on sending .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the encoder, the exception and the timestamps
+import threaded_alt # its 'postman' reads the replies
+from clock import ns_monotonic
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+ms_localtime = internal.ms_localtime
+
+# -----------------------------------------------------------------------------
+
+from collections import deque
+
+# -----------------------------------------------------------------------------
+
+COSTS_KEPT = 1000
+
+_COST_NAMES = ( 'pack', 'stamp', 'send' )
+
+_TIMESTAMP = internal._DataFormat.EVENT_TIMESTAMP
+_TIMESTAMP_OFFSET = internal._DataFormat.EVENT_TIMESTAMP_OFFSET
+
+
+# -----------------------------------------------------------------------------
+
+class FlipMarker :
+
+    """ sends the events at the moment of the next win.flip() with the minimal work done inside the flip """
+
+    def __init__( self, win, netstation ) :
+        """
+            'win' is the psychopy.visual.Window ( anything with callOnFlip() would do ) ;
+            'netstation' is any of the Netstation objects with send_encoded() ;
+            with egi.simple the replies are not waited for, call poll() after the flip .
+        """
+
+        self._win = win
+        self._netstation = netstation
+
+        self._data_fmt = internal._DataFormat()
+
+        # the clock of the connection if the back-end has one ( see simple.Netstation.ms_now() )
+        self._ms_now = getattr( netstation, 'ms_now', ms_localtime )
+
+        timeline = getattr( netstation, 'timeline', None )
+        self._timeline = timeline() if timeline is not None else None
+
+        # threaded_alt has poll_acks() only to say that it is not there
+        self._poll_acks = getattr( netstation, 'poll_acks', None )
+        if isinstance( netstation, threaded_alt.Netstation ) :
+            self._poll_acks = None
+
+        # ( pack, stamp, hand over ) costs in ns : the last COSTS_KEPT events , the totals and the maxima of all
+        self._costs = deque( maxlen = COSTS_KEPT )
+        self._n_costs = 0
+        self._sum_costs = [ 0, 0, 0 ]
+        self._max_costs = [ 0, 0, 0 ]
+
+    ## -----------------------------------------------------------
+
+    def mark( self, key, label = None, description = None, table = None, pad = False, schema = None ) :
+        """
+            pack the event now and send it at the next flip , timestamped with the flip time ;
+            the arguments are the same as for send_event() ( without the timestamp ) .
+        """
+
+        self._resync_if_due()
+
+        t_start = ns_monotonic()
+
+        # the timestamp is a placeholder until the flip
+        message = bytearray( self._data_fmt.pack( key, 0, label, description, table, pad, schema ) )
+
+        pack_ns = ns_monotonic() - t_start
+
+        self._win.callOnFlip( self._on_flip, message, pack_ns )
+
+    def _on_flip( self, message, pack_ns ) :
+        """ the flip callback : stamp the time and hand the message over -- nothing else """
+
+        t_start = ns_monotonic()
+
+        _TIMESTAMP.pack_into( message, _TIMESTAMP_OFFSET, self._ms_now() )
+
+        t_stamped = ns_monotonic()
+
+        self._netstation.send_encoded( message, b_wait = False )
+
+        t_sent = ns_monotonic()
+
+        costs = ( pack_ns, t_stamped - t_start, t_sent - t_stamped )
+
+        self._costs.append( costs )
+        self._n_costs += 1
+
+        for i, ns in enumerate( costs ) :
+            self._sum_costs[i] += ns
+            self._max_costs[i] = max( self._max_costs[i], ns )
+
+    def _resync_if_due( self ) :
+        """ the sync the flip callback must not send : the wire time is about to wrap ( see timeline.py ) """
+
+        timeline = self._timeline
+        if timeline is None :
+            return
+
+        # the stamp at the flip should not be the one that reaches the limit
+        timeline.ms()
+
+        if timeline.resync_due :
+            self._netstation.sync()
+
+    def poll( self ) :
+        """
+            collect the replies that have arrived ( egi.simple only , the other back-ends
+            do it in their own thread or process ) ; call it outside the time-critical part of a frame .
+        """
+
+        self._resync_if_due()
+
+        if self._poll_acks is None :
+            return []
+
+        return self._poll_acks()
+
+    ## -----------------------------------------------------------
+
+    def costs( self ) :
+        """ the list of ( pack, stamp, hand over ) times in ns, one entry per sent event ( the last COSTS_KEPT of them ) """
+
+        return list( self._costs )
+
+    def report( self ) :
+        """ { 'pack' / 'stamp' / 'send' : ( mean, max ) in ms } over all the sent events """
+
+        report = {}
+
+        n = self._n_costs
+        if n == 0 :
+            return report
+
+        for i, name in enumerate( _COST_NAMES ) :
+            report[ name ] = ( self._sum_costs[i] * 1e-6 / n, self._max_costs[i] * 1e-6 )
+
+        return report
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" psychopy.py with the fake back-end and a window stand-in ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import psychopy
+import fake
+import threaded_alt
+from timeline import WIRE_LIMIT_MS, REBASE_AHEAD_MS
+from clock import ns_monotonic
+from harness import StandIn
+
+
+class _Window :
+
+    """ callOnFlip() and flip() , as psychopy.visual.Window has them """
+
+    def __init__( self ) :
+
+        self._calls = []
+
+    def callOnFlip( self, function, *args ) :
+
+        self._calls.append( ( function, args ) )
+
+    def flip( self ) :
+
+        calls, self._calls = self._calls, []
+
+        for function, args in calls :
+            function( *args )
+
+
+class FlipMarkerTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        self.ns = fake.Netstation( recorder = True )
+        self.win = _Window()
+        self.marker = psychopy.FlipMarker( self.win, self.ns )
+
+    def test_costs_bounded( self ) :
+
+        n = psychopy.COSTS_KEPT + 10
+
+        for i in xrange( n ) :
+            self.marker.mark( 'stim', table = { 'trl#' : i } )
+            self.win.flip()
+
+        self.assertEqual( self.ns.recorder().count( 'stim' ), n )
+        self.assertEqual( len( self.marker.costs() ), psychopy.COSTS_KEPT )
+
+        report = self.marker.report()
+        self.assertEqual( sorted( report ), [ 'pack', 'send', 'stamp' ] )
+
+        for mean, max_ms in report.values() :
+            self.assertTrue( 0 <= mean <= max_ms )
+
+    def test_resync_before_the_flip( self ) :
+
+        recorder = self.ns.recorder()
+        timeline = self.ns.timeline()
+        timeline._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - REBASE_AHEAD_MS // 2 )
+
+        self.marker.mark( 'stim' )
+
+        syncs = recorder.commands( 'T' )
+        self.assertEqual( len( syncs ), 1 )
+        self.assertTrue( syncs[0].args[0] < REBASE_AHEAD_MS, syncs )
+
+        self.win.flip()
+
+        # nothing more is sent in the flip but the event , and it is in the new base
+        self.assertEqual( len( recorder.commands( 'T' ) ), 1 )
+
+        event, = recorder.events( 'stim' )
+        self.assertTrue( 0 <= event.timestamp - syncs[0].args[0] < 1000 )
+
+    def test_poll_threaded_alt( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded_alt.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+
+        try :
+            marker = psychopy.FlipMarker( self.win, ns )
+            self.assertEqual( marker.poll(), [] )
+        finally :
+            ns.finalize( 0.2 )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,612 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    The command queue between the caller and the 'postman' thread of the threaded back-ends .
+
+    A single FIFO lets a burst of annotation events delay a stimulus marker or a resync ;
+    here every command belongs to one of the priority classes :
+
+        CRITICAL -- sync(), the scheduled and the pre-packed events ( the stimulus markers ) ;
+        NORMAL   -- the ordinary send_event() calls ;
+        BULK     -- whatever can wait ( the annotations ) .
+
+    The order within a class is preserved . The critical commands always go first ; a lower class
+    whose head has waited longer than its 'max_wait_ms' is served before the higher one , but at most
+    once in every AGING_QUOTA commands ( so nothing starves , and a backlog of the overdue commands
+    cannot take the 'postman' over ) .
+
+    The session commands ( BeginSession, StartRecording ... ) are "barriers" : everything
+    queued before them is sent before them, and nothing queued after them overtakes them .
+
+    The time every command spends in the queue is accounted per class ( see wait_stats() ) .
+
+    The queue may be bounded ; what happens to a command that does not fit is the 'policy' :
+
+        'block'       -- wait for the room ( up to 'seconds_timeout', then Queue.Full is raised ) ;
+        'drop_newest' -- the new command is dropped ;
+        'drop_oldest' -- the oldest command of the lowest class is dropped to make room ;
+        'coalesce'    -- the new command replaces the queued one with the same key ( say, the
+                         same event key ) , otherwise as 'drop_oldest' .
+
+    The critical commands and the barriers are never dropped nor blocked ( they may exceed
+    the capacity ) . Every drop and block is counted ( see counters() ) .
+
+    BoundedQueue is the same for the replies coming back ( just without the classes ) ;
+    ResultRing keeps only the last replies, but counts all of them ( see summary() ) .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the exception
+from clock import ns_monotonic
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+from threading import Condition
+from collections import deque
+from Queue import Queue, Empty, Full
+
+import time
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+CRITICAL, NORMAL, BULK = 0, 1, 2
+
+CLASS_NAMES = ( 'critical', 'normal', 'bulk' )
+
+# how long ( ms ) the head of a class may wait before it is served ahead of the higher classes
+DEFAULT_MAX_WAIT_MS = ( None, 50, 250 )
+
+# an overdue class is served out of its turn at most once in this many commands
+AGING_QUOTA = 4
+
+# the classes of the commands ( by the method name ) ; the rest are NORMAL
+_COMMAND_CLASSES = {
+                     'sync'                 : CRITICAL ,
+                     'SendAttentionCommand' : CRITICAL ,
+                     'SendLocalTime'        : CRITICAL ,
+                     'send_encoded'         : CRITICAL ,
+                   }
+
+# the commands nothing may overtake ( and that may not overtake anything )
+_BARRIERS = frozenset( (
+                         'BeginSession', 'EndSession', 'StartRecording', 'StopRecording',
+                         'start_session', 'rollover', 'rollover_if_needed', 'set_event_budget',
+                         'enable_event_log',
+                     ) )
+
+
+def command_class( name ) :
+    """ the priority class of the command with the given ( method ) name """
+
+    return _COMMAND_CLASSES.get( name, NORMAL )
+
+
+def is_barrier( name ) :
+    """ True for the session commands that keep their place in the overall order """
+
+    return name in _BARRIERS
+
+
+def command_key( command ) :
+    """ the key to coalesce the commands by : the events with the same key replace each other """
+
+    if command.name() != 'send_event' :
+        return None
+
+    return command.kwargs().get( 'key' )
+
+
+POLICIES = ( 'block', 'drop_newest', 'drop_oldest', 'coalesce' )
+
+def _check_policy( policy, policies = POLICIES ) :
+
+    if policy not in policies :
+        raise Error( "unknown queue policy '%s' ( expected one of %s )" % ( policy, ', '.join( policies ) ) )
+
+
+# -----------------------------------------------------------------------------
+
+class _WaitStats :
+    """ the number of the commands and the total / maximal time they have spent in the queue """
+
+    def __init__( self ) :
+
+        self.count = 0
+        self.ns_total = 0
+        self.ns_max = 0
+
+    def add( self, ns_wait ) :
+
+        self.count += 1
+        self.ns_total += ns_wait
+
+        if ns_wait > self.ns_max :
+            self.ns_max = ns_wait
+
+    def report( self ) :
+        """ ( count, mean ms, max ms ) """
+
+        if self.count == 0 :
+            return ( 0, 0.0, 0.0 )
+
+        return ( self.count, self.ns_total * 1e-6 / self.count, self.ns_max * 1e-6 )
+
+
+class _Counters :
+    """ what has happened to the items that did not fit """
+
+    def __init__( self ) :
+
+        self.queued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.timeouts = 0
+        self.high_water = 0 # the maximal number of the queued items
+
+    def report( self ) :
+
+        return dict( self.__dict__ )
+
+
+# -----------------------------------------------------------------------------
+
+class ClassQueue :
+
+    """
+        a Queue.Queue look-alike with the priority classes ;
+        None is the end marker -- get() returns it only after everything else .
+    """
+
+    def __init__( self, max_wait_ms = DEFAULT_MAX_WAIT_MS, capacity = 0, policy = 'block', seconds_timeout = None, key = command_key ) :
+        """
+            'capacity' -- the maximal number of the queued items ( 0 : not bounded ) ;
+            'policy' -- what to do when it is full ( see above ) ;
+            'seconds_timeout' -- how long the 'block' policy waits ( None : for ever ) ;
+            'key' -- returns the key of an item for the 'coalesce' policy ( None : not to be coalesced ) .
+        """
+
+        _check_policy( policy )
+
+        self._cond = Condition()
+
+        # [ seqno, ns_put, item, key ] , one deque per class
+        self._classes = [ deque() for name in CLASS_NAMES ]
+        self._barriers = deque()
+
+        self._ns_max_wait = [  None if ms is None else int( ms * 1000000 )  for ms in max_wait_ms  ]
+
+        self._capacity = capacity
+        self._policy = policy
+        self._seconds_timeout = seconds_timeout
+        self._key = key
+
+        # key -> the last queued entry with it ( the 'coalesce' policy only )
+        self._by_key = {}
+
+        self._seqno = 0
+        self._b_closed = False
+
+        # the commands served since an overdue class has been served out of its turn
+        self._n_since_aged = AGING_QUOTA
+
+        self._stats = dict(  ( name, _WaitStats() ) for name in CLASS_NAMES + ( 'barrier', )  )
+        self._counters = _Counters()
+
+    ## -----------------------------------------------------------
+
+    def put( self, item, priority = NORMAL, b_barrier = False ) :
+        """
+            add the item to the end of its class ( or to the barriers ) ;
+            returns False if the item has been dropped ( True if queued or coalesced ) .
+        """
+
+        with self._cond :
+
+            if item is None :
+
+                self._b_closed = True
+                self._cond.notify_all()
+
+                return True
+
+            b_protected = b_barrier or priority == CRITICAL
+
+            # the protected entries are never coalesced into ( nor dropped )
+            key = None
+            if self._policy == 'coalesce' and not b_protected :
+                key = self._key( item )
+
+            if self._capacity and not b_protected and self._qsize() >= self._capacity :
+
+                b_queued = self._overflow( item, priority, key )
+                if b_queued is not None :
+                    return b_queued
+
+            self._seqno += 1
+            entry = [ self._seqno, ns_monotonic(), item, key ]
+
+            if b_barrier :
+                self._barriers.append( entry )
+            else :
+                self._classes[ priority ].append( entry )
+
+            if key is not None :
+                self._by_key[ key ] = entry
+
+            counters = self._counters
+            counters.queued += 1
+
+            n = self._qsize()
+            if n > counters.high_water :
+                counters.high_water = n
+
+            self._cond.notify_all()
+
+            return True
+
+    def _overflow( self, item, priority, key ) :
+        """
+            apply the policy to the item that does not fit ( the lock is held ) ;
+            returns None if the item is to be queued now, True / False if coalesced / dropped .
+        """
+
+        counters = self._counters
+        policy = self._policy
+
+        if policy == 'block' :
+
+            counters.blocked += 1
+
+            if self._seconds_timeout is not None :
+                ns_end = ns_monotonic() + int( self._seconds_timeout * 1e9 )
+
+            while self._qsize() >= self._capacity :
+
+                if self._seconds_timeout is None :
+                    self._cond.wait()
+
+                else :
+
+                    left = ( ns_end - ns_monotonic() ) * 1e-9
+                    if left <= 0 :
+                        counters.timeouts += 1
+                        raise Full()
+
+                    self._cond.wait( left )
+
+            return None
+
+        if policy == 'drop_newest' :
+
+            counters.dropped += 1
+            return False
+
+        if policy == 'coalesce' and key is not None :
+
+            entry = self._by_key.get( key )
+            if entry is not None :
+
+                # the newer one takes the place of the older
+                entry[2] = item
+                counters.coalesced += 1
+
+                return True
+
+        # 'drop_oldest' : the oldest of the lowest class, but not of a class higher than the new item
+        for victim_priority in xrange( len( CLASS_NAMES ) - 1, priority - 1, -1 ) :
+
+            entries = self._classes[ victim_priority ]
+            if entries :
+
+                self._forget( entries.popleft() )
+                counters.dropped += 1
+
+                return None
+
+        # nothing less important to drop
+        counters.dropped += 1
+        return False
+
+    def _forget( self, entry ) :
+        """ the entry has left the queue """
+
+        key = entry[3]
+        if key is not None and self._by_key.get( key ) is entry :
+            del self._by_key[ key ]
+
+    def get( self, block = True, timeout = None ) :
+        """ the next item to send ; raises Queue.Empty on timeout ( or if not 'block' ) """
+
+        with self._cond :
+
+            if timeout is not None :
+                ns_end = ns_monotonic() + int( timeout * 1e9 )
+
+            while not self._qsize() :
+
+                if self._b_closed :
+                    return None
+
+                if not block :
+                    raise Empty()
+
+                if timeout is None :
+                    self._cond.wait()
+
+                else :
+
+                    left = ( ns_end - ns_monotonic() ) * 1e-9
+                    if left <= 0 :
+                        raise Empty()
+
+                    self._cond.wait( left )
+
+            return self._pop()
+
+    def _pop( self ) :
+        """ pick the next entry ( the lock is held and the queue is not empty ) """
+
+        ns_now = ns_monotonic()
+
+        # nothing queued after the first barrier may be sent before it
+        seqno_limit = self._barriers[0][0] if self._barriers else None
+
+        chosen = None
+        b_aged = False
+
+        for priority, entries in enumerate( self._classes ) :
+
+            if not entries :
+                continue
+
+            seqno, ns_put = entries[0][:2]
+
+            if seqno_limit is not None and seqno > seqno_limit :
+                continue
+
+            if chosen is None :
+                chosen = priority
+
+                # the critical ones are never overtaken
+                if priority == CRITICAL :
+                    break
+
+                continue
+
+            ns_max_wait = self._ns_max_wait[ priority ]
+            if ns_max_wait is not None and ns_now - ns_put > ns_max_wait and self._n_since_aged >= AGING_QUOTA - 1 :
+                # starving : the overdue class goes first this time ( the highest of the overdue ones )
+                chosen = priority
+                b_aged = True
+                break
+
+        if b_aged :
+            self._n_since_aged = 0
+        else :
+            self._n_since_aged += 1
+
+        if chosen is None : # only the barrier is left before the rest
+            entry = self._barriers.popleft()
+            name = 'barrier'
+
+        else :
+            entry = self._classes[ chosen ].popleft()
+            name = CLASS_NAMES[ chosen ]
+
+        self._forget( entry )
+
+        seqno, ns_put, item, key = entry
+        self._stats[ name ].add( ns_now - ns_put )
+
+        # there is room for the blocked ones now
+        if self._capacity :
+            self._cond.notify_all()
+
+        return item
+
+    ## -----------------------------------------------------------
+
+    def _qsize( self ) :
+
+        return len( self._barriers ) + sum( len( entries ) for entries in self._classes )
+
+    def qsize( self ) :
+        """ the number of the queued items ( the end marker is not counted ) """
+
+        with self._cond :
+            return self._qsize()
+
+    def wait_stats( self ) :
+        """ { class name : ( count, mean wait ms, max wait ms ) } ; the barriers are the 'barrier' class """
+
+        with self._cond :
+            return dict(  ( name, stats.report() ) for name, stats in self._stats.iteritems()  )
+
+    def reset_wait_stats( self ) :
+
+        with self._cond :
+            for stats in self._stats.itervalues() :
+                stats.__init__()
+
+    def counters( self ) :
+        """ { 'queued', 'dropped', 'coalesced', 'blocked', 'timeouts', 'high_water' : count } """
+
+        with self._cond :
+            return self._counters.report()
+
+
+# -----------------------------------------------------------------------------
+
+class BoundedQueue( Queue ) :
+
+    """
+        Queue.Queue with the 'block', 'drop_newest' and 'drop_oldest' policies
+        ( for the replies : there is nothing to coalesce them by ) and the same counters .
+    """
+
+    def __init__( self, capacity = 0, policy = 'drop_oldest', seconds_timeout = None ) :
+
+        _check_policy( policy, POLICIES[:3] )
+
+        Queue.__init__( self, capacity )
+
+        self._policy = policy
+        self._seconds_timeout = seconds_timeout
+
+        self._counters = _Counters()
+
+    def put( self, item ) :
+        """ add the item applying the policy ; returns False if it has been dropped """
+
+        counters = self._counters
+
+        with self.not_full :
+
+            if self.maxsize > 0 and self._qsize() >= self.maxsize :
+
+                if self._policy == 'drop_newest' :
+                    counters.dropped += 1
+                    return False
+
+                if self._policy == 'drop_oldest' :
+                    self._get()
+                    counters.dropped += 1
+
+                else :
+
+                    counters.blocked += 1
+
+                    if self._seconds_timeout is not None :
+                        ns_end = ns_monotonic() + int( self._seconds_timeout * 1e9 )
+
+                    while self._qsize() >= self.maxsize :
+
+                        if self._seconds_timeout is None :
+                            self.not_full.wait()
+
+                        else :
+
+                            left = ( ns_end - ns_monotonic() ) * 1e-9
+                            if left <= 0 :
+                                counters.timeouts += 1
+                                raise Full()
+
+                            self.not_full.wait( left )
+
+            self._put( item )
+            self.unfinished_tasks += 1
+
+            counters.queued += 1
+
+            n = self._qsize()
+            if n > counters.high_water :
+                counters.high_water = n
+
+            self.not_empty.notify()
+
+            return True
+
+    def counters( self ) :
+        """ { 'queued', 'dropped', 'coalesced', 'blocked', 'timeouts', 'high_water' : count } """
+
+        with self.mutex :
+            return self._counters.report()
+
+
+# -----------------------------------------------------------------------------
+
+class ResultRing( BoundedQueue ) :
+
+    """
+        the last 'capacity' results of the commands ( the older ones are evicted )
+        plus the counters over the whole session , which survive the eviction :
+
+            'results'     -- all the results put ;
+            'acks'        -- the successful replies ( including the replies collected for b_wait = False ) ;
+            'errors'      -- the 'F' replies and the exceptions raised by the commands ;
+            'unanswered'  -- the commands sent without waiting ( None results ) ;
+            'evicted'     -- the results dropped from the ring ;
+            'last_error'  -- ( time.time(), the command name, the error ) or None .
+    """
+
+    def __init__( self, capacity = 1024, policy = 'drop_oldest' ) :
+
+        BoundedQueue.__init__( self, capacity, policy )
+
+        self._n_results = 0
+        self._n_acks = 0
+        self._n_errors = 0
+        self._n_unanswered = 0
+        self._last_error = None
+
+    def put( self, item, name = None ) :
+        """ add the result of the command 'name' ( an exception it has raised is a result too ) """
+
+        with self.mutex :
+
+            self._n_results += 1
+
+            # the scheduled events come back as Dispatch records
+            reply = getattr( item, 'reply', item )
+
+            if isinstance( reply, Exception ) :
+                self._n_errors += 1
+                self._last_error = ( time.time(), name, reply )
+
+            elif reply is None :
+                self._n_unanswered += 1
+
+            elif reply is False :
+                self._n_errors += 1
+                self._last_error = ( time.time(), name, reply )
+
+            else :
+                self._n_acks += 1
+
+        return BoundedQueue.put( self, item )
+
+    def count_acks( self, acks, name = 'poll_acks' ) :
+        """ count the replies read later ( True / False , see simple.Netstation.poll_acks() ) without keeping them """
+
+        with self.mutex :
+
+            for ack in acks :
+
+                if ack :
+                    self._n_acks += 1
+                else :
+                    self._n_errors += 1
+                    self._last_error = ( time.time(), name, ack )
+
+    def summary( self ) :
+        """ the counters ( see above ) as a dictionary """
+
+        with self.mutex :
+
+            return { 'results' : self._n_results, 'acks' : self._n_acks, 'errors' : self._n_errors,
+                     'unanswered' : self._n_unanswered, 'evicted' : self._counters.dropped,
+                     'last_error' : self._last_error }
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
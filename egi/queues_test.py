@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" queues.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import time
+
+import queues
+from queues import ClassQueue, BoundedQueue, CRITICAL, NORMAL, BULK, AGING_QUOTA
+
+
+class ClassQueueTest( unittest.TestCase ) :
+
+    def overdue_queue( self ) :
+        """ the normal and the bulk commands are overdue as soon as they are queued """
+
+        return ClassQueue( max_wait_ms = ( None, 0, 0 ) )
+
+    def test_critical_first_while_the_others_are_overdue( self ) :
+
+        q = self.overdue_queue()
+
+        for i in xrange( 10 ) :
+            q.put( ( 'normal', i ), NORMAL )
+            q.put( ( 'bulk', i ), BULK )
+
+        for i in xrange( 10 ) :
+            q.put( ( 'critical', i ), CRITICAL )
+
+        time.sleep( 0.001 )
+
+        self.assertEqual( [  q.get()[0]  for i in xrange( 10 )  ], [ 'critical' ] * 10 )
+
+    def test_overdue_class_gets_a_quota( self ) :
+
+        q = self.overdue_queue()
+
+        n = AGING_QUOTA * 10
+        for i in xrange( n ) :
+            q.put( ( 'normal', i ), NORMAL )
+            q.put( ( 'bulk', i ), BULK )
+
+        time.sleep( 0.001 )
+
+        served = [  q.get()[0]  for i in xrange( n )  ]
+
+        self.assertEqual( served.count( 'bulk' ), n // AGING_QUOTA )
+
+        # the order within a class is kept
+        q2 = self.overdue_queue()
+        for i in xrange( 5 ) :
+            q2.put( ( 'bulk', i ), BULK )
+        self.assertEqual( [  q2.get()[1]  for i in xrange( 5 )  ], range( 5 ) )
+
+    def test_barrier_order( self ) :
+
+        q = ClassQueue()
+
+        q.put( 'a', BULK )
+        q.put( 'begin', NORMAL, b_barrier = True )
+        q.put( 'b', CRITICAL )
+
+        self.assertEqual( [ q.get(), q.get(), q.get() ], [ 'a', 'begin', 'b' ] )
+
+    def test_get_timeout( self ) :
+
+        q = ClassQueue()
+
+        t_start = time.time()
+        self.assertRaises( queues.Empty, q.get, True, 0.05 )
+        self.assertTrue( time.time() - t_start >= 0.04 )
+
+    def test_block_timeout( self ) :
+
+        q = ClassQueue( capacity = 1, policy = 'block', seconds_timeout = 0.05 )
+
+        q.put( 'a' )
+        self.assertRaises( queues.Full, q.put, 'b' )
+        self.assertEqual( q.counters()[ 'timeouts' ], 1 )
+
+    def test_coalesce( self ) :
+
+        class Command :
+            def __init__( self, key ) : self.key = key
+
+        q = ClassQueue( capacity = 1, policy = 'coalesce', key = lambda c : c.key )
+
+        first = Command( 'stim' )
+        q.put( first )
+        self.assertTrue( q.put( Command( 'stim' ) ) )
+        self.assertEqual( q.qsize(), 1 )
+        self.assertEqual( q.counters()[ 'coalesced' ], 1 )
+
+    def test_critical_not_coalesced_into( self ) :
+
+        class Command :
+            def __init__( self, key ) : self.key = key
+
+        q = ClassQueue( capacity = 1, policy = 'coalesce', key = lambda c : c.key )
+
+        critical = Command( 'stim' )
+        q.put( critical, CRITICAL )
+
+        # the queue is full : the normal one may not take the place of the critical one
+        normal = Command( 'stim' )
+        self.assertFalse( q.put( normal, NORMAL ) )
+
+        self.assertTrue( q.get( timeout = 0.1 ) is critical )
+        self.assertEqual( q.counters()[ 'coalesced' ], 0 )
+
+
+class BoundedQueueTest( unittest.TestCase ) :
+
+    def test_policies( self ) :
+
+        q = BoundedQueue( 2, 'drop_oldest' )
+        for i in xrange( 3 ) :
+            q.put( i )
+        self.assertEqual( [ q.get(), q.get() ], [ 1, 2 ] )
+
+        q = BoundedQueue( 1, 'block', seconds_timeout = 0.02 )
+        q.put( 0 )
+        self.assertRaises( queues.Full, q.put, 1 )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
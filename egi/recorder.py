@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    An in-memory recorder for the dry runs with egi.fake : instead of printing every call ,
+    the fake Netstation encodes it exactly as egi.simple would put it on the wire
+    ( so the encoding errors show up in the dry runs too ) and appends the bytes to
+    the preallocated buffers -- no I/O per event .
+
+        ns = egi.fake.Netstation( recorder = True )
+        ...
+        rec = ns.recorder()
+        rec.assert_sent( 'stim', n = 120 )
+        rec.assert_order( 'Q', 'B', 'stim', 'E', 'X' )
+
+    The session can be exported ( at finalize(), if 'export_path' is given ) as a capture file ,
+    see socket_wrapper.load_capture() and decoder.py .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+import simple as internal # the encoders and the exception
+import decoder
+from clock import ns_monotonic
+from socket_wrapper import save_capture
+
+#
+# "forward" these names to be used from outside
+#
+
+Error = internal.Eggog
+
+# -----------------------------------------------------------------------------
+
+from array import array
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+DEFAULT_RECORDS = 65536
+DEFAULT_BYTES = 4 * 1024 * 1024
+
+
+class Recorder :
+
+    """ the client side of a session kept as the wire messages in the preallocated arrays """
+
+    def __init__( self, n_records = DEFAULT_RECORDS, n_bytes = DEFAULT_BYTES, export_path = None ) :
+        """
+            'n_records', 'n_bytes' -- the initial room ( it is doubled when exhausted , see stats() ) ;
+            'export_path' -- where export() writes by default ( and finalize() exports to ) .
+        """
+
+        # the time ( ns , as doubles -- exact for a few months ) and the start of every message
+        self._ns = array( 'd', [ 0.0 ] ) * n_records
+        self._offsets = array( 'L', [ 0 ] ) * n_records
+
+        self._data = bytearray( n_bytes )
+
+        self._n = 0
+        self._pos = 0
+        self._n_grown = 0
+
+        self._export_path = export_path
+
+        self._fmt = internal._Format()
+        self._data_fmt = internal._DataFormat()
+        self._system_spec = internal._get_endianness_string()
+
+        # decoded lazily, on the first query
+        self._decoder = decoder.StreamDecoder()
+        self._decoded = []
+        self._n_decoded = 0
+
+    ## -----------------------------------------------------------
+
+    def record( self, message ) :
+        """ append an encoded message """
+
+        n = self._n
+        pos = self._pos
+        end = pos + len( message )
+
+        if n == len( self._ns ) or end > len( self._data ) :
+            self._grow( n + 1, end )
+
+        self._data[ pos : end ] = message
+        self._ns[ n ] = ns_monotonic()
+        self._offsets[ n ] = pos
+
+        self._n = n + 1
+        self._pos = end
+
+    def _grow( self, n_records, n_bytes ) :
+        """ double whatever is exhausted """
+
+        if n_records > len( self._ns ) :
+            self._ns.extend( array( 'd', [ 0.0 ] ) * len( self._ns ) )
+            self._offsets.extend( array( 'L', [ 0 ] ) * len( self._offsets ) )
+
+        if n_bytes > len( self._data ) :
+            self._data.extend( bytearray( max( len( self._data ), n_bytes - len( self._data ) ) ) )
+
+        self._n_grown += 1
+
+    def command( self, code, *args ) :
+        """ record a command ( 'Q', 'X', 'B', 'E', 'A', 'T' ) with its arguments """
+
+        if code == 'Q' and not args :
+            args = ( self._system_spec, )
+
+        self.record( self._fmt.pack( code, *args ) )
+
+    def event( self, key, timestamp = None, label = None, description = None, table = None, pad = False, schema = None ) :
+        """ encode the event with the real encoder ( raising its errors ) and record it """
+
+        if timestamp is None :
+            timestamp = internal.ms_localtime()
+
+        self.record( self._data_fmt.pack( key, timestamp, label, description, table, pad, schema ) )
+
+    def clear( self ) :
+        """ forget everything recorded ( the buffers are kept ) """
+
+        self._n = 0
+        self._pos = 0
+
+        self._decoder = decoder.StreamDecoder()
+        self._decoded = []
+        self._n_decoded = 0
+
+    ## -----------------------------------------------------------
+
+    def __len__( self ) :
+
+        return self._n
+
+    def messages( self ) :
+        """ the list of ( ns time, encoded message ) """
+
+        ends = list( self._offsets[ 1 : self._n ] ) + [ self._pos ]
+
+        return [  ( int( self._ns[i] ), str( self._data[ self._offsets[i] : ends[i] ] ) )  for i in xrange( self._n )  ]
+
+    def decoded( self ) :
+        """ the list of the decoded decoder.Command / decoder.Event records , in the order sent """
+
+        if self._n_decoded < self._n :
+
+            start = self._offsets[ self._n_decoded ]
+            self._decoded.extend( self._decoder.feed( self._data[ start : self._pos ] ) )
+
+            self._n_decoded = self._n
+
+        return list( self._decoded )
+
+    def events( self, key = None ) :
+        """ the decoded events ( with the given key only, if any ) """
+
+        return [  record for record in self.decoded()
+                  if isinstance( record, decoder.Event ) and ( key is None or record.key == key )  ]
+
+    def commands( self, code = None ) :
+        """ the decoded commands ( with the given code only, if any ) """
+
+        return [  record for record in self.decoded()
+                  if isinstance( record, decoder.Command ) and ( code is None or record.code == code )  ]
+
+    def count( self, key = None ) :
+        """ the number of the events ( with the given key ) """
+
+        return len( self.events( key ) )
+
+    ## -----------------------------------------------------------
+
+    def assert_sent( self, key, n = None, label = None, **table ) :
+        """
+            check that the event with the 'key' was sent ( exactly 'n' times, if given ) ;
+            'label' and the keyword arguments ( table entries ) narrow the events to count .
+        """
+
+        matched = []
+        for event in self.events( key ) :
+
+            # the label is a buffer() into the decoded stream ( see decoder.py )
+            if label is not None and ( event.label is None or str( event.label ) != label ) :
+                continue
+
+            values = decoder.table_dict( event )
+            if any(  values.get( k ) != v  for k, v in table.iteritems()  ) :
+                continue
+
+            matched.append( event )
+
+        if n is None :
+            if not matched :
+                raise AssertionError( "no '%s' events matching %s were sent ( %d with the key )" % ( key, table, self.count( key ) ) )
+
+        elif len( matched ) != n :
+            raise AssertionError( "%d '%s' events matching %s were sent, %d expected" % ( len( matched ), key, table, n ) )
+
+        return matched
+
+    def assert_not_sent( self, key ) :
+        """ check that no event with the 'key' was sent """
+
+        n = self.count( key )
+        if n :
+            raise AssertionError( "%d '%s' events were sent, none expected" % ( n, key ) )
+
+    def assert_order( self, *names ) :
+        """
+            check that the events ( by key ) and the commands ( by code ) with the given names
+            were sent in this order ( there may be other messages in between )
+        """
+
+        sent = [  record.key if isinstance( record, decoder.Event ) else record.code  for record in self.decoded()  ]
+
+        pos = 0
+        for name in names :
+
+            try :
+                pos = sent.index( name, pos ) + 1
+            except ValueError :
+                raise AssertionError( "'%s' was not sent after %s" % ( name, list( names[ : names.index( name ) ] ) ) )
+
+    ## -----------------------------------------------------------
+
+    def stats( self ) :
+        """ { 'records', 'bytes', 'grown' : ... } """
+
+        return { 'records' : self._n, 'bytes' : self._pos, 'grown' : self._n_grown }
+
+    def export( self, path = None ) :
+        """ write the recorded messages as a capture file ; returns the number of records written """
+
+        if path is None :
+            path = self._export_path
+
+        if path is None :
+            raise Error( "no path to export the recorded session to" )
+
+        return save_capture(  path, (  ( t_ns, 'o', message ) for t_ns, message in self.messages()  )  )
+
+    def export_if_needed( self ) :
+        """ export() to the 'export_path' if it was given """
+
+        if self._export_path is None :
+            return None
+
+        return self.export()
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
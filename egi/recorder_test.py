@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" recorder.py ( through the fake back-end ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import tempfile
+import os
+
+import recorder
+from recorder import Recorder
+from socket_wrapper import load_capture
+import decoder
+import fake
+
+
+class RecorderTest( unittest.TestCase ) :
+
+    def test_session( self ) :
+
+        ns = fake.Netstation( recorder = True )
+        ns.connect( '127.0.0.1', 55513 )
+        ns.BeginSession()
+        ns.sync()
+
+        for i in xrange( 3 ) :
+            ns.send_event( 'stim', label = 'target', table = { 'trl#' : i } )
+
+        ns.EndSession()
+
+        rec = ns.recorder()
+
+        rec.assert_sent( 'stim', n = 3 )
+        rec.assert_sent( 'stim', n = 1, label = 'target', **{ 'trl#' : 2 } )
+        rec.assert_not_sent( 'resp' )
+        rec.assert_order( 'Q', 'A', 'T', 'stim', 'X' )
+
+        self.assertRaises( AssertionError, rec.assert_sent, 'stim', n = 2 )
+        self.assertRaises( AssertionError, rec.assert_order, 'X', 'stim' )
+
+    def test_encoding_errors_raised( self ) :
+
+        rec = Recorder()
+
+        self.assertRaises( recorder.Error, rec.event, 'too long', 0 )
+        self.assertEqual( len( rec ), 0 )
+
+    def test_grows( self ) :
+
+        rec = Recorder( n_records = 2, n_bytes = 16 )
+
+        for i in xrange( 10 ) :
+            rec.event( 'stim', i, table = { 'trl#' : i } )
+
+        self.assertEqual( rec.stats()[ 'records' ], 10 )
+        self.assertTrue( rec.stats()[ 'grown' ] > 0 )
+        self.assertEqual(  [ e.timestamp for e in rec.events( 'stim' ) ], range( 10 )  )
+
+        # the decoding goes on from where it stopped
+        rec.command( 'E' )
+        self.assertEqual( len( rec.decoded() ), 11 )
+
+    def test_export( self ) :
+
+        fd, path = tempfile.mkstemp( '.capture' )
+        os.close( fd )
+
+        try :
+
+            rec = Recorder( export_path = path )
+            rec.command( 'Q' )
+            rec.event( 'stim', 100 )
+
+            self.assertEqual( rec.export_if_needed(), 2 )
+
+            records = load_capture( path )
+            self.assertEqual(  [ data for t_ns, direction, data in records ], [ m for t_ns, m in rec.messages() ]  )
+
+            event, = decoder.decode( records[1][2] )
+            self.assertEqual( ( event.key, event.timestamp ), ( 'stim', 100 ) )
+
+        finally :
+            os.remove( path )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
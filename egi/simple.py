@@ -22,13 +22,29 @@ from __future__ import with_statement # for debug dumps
 """
 
 # import socket
-from socket_wrapper import Socket
+from socket_wrapper import Socket, DEFAULT_TIMEOUT
+from clock import ns_monotonic
+from timeline import Timeline
 import struct
 
+# the tracepoints ( see trace.py )
+from trace import PACK_START as _TP_PACK_START, PACK_END as _TP_PACK_END
+from trace import RESPONSE_READ as _TP_RESPONSE_READ, SYNC_DONE as _TP_SYNC_DONE
+import trace # the command sequence numbers
+
+import functools
+
+from collections import deque # the acknowledgements read ahead
+
 import math, time # for time in milliseconds
 
 import sys, exceptions # sys.
 
+import warnings # session event budget
+
+import log # the diagnostic output
+_log = log.get_logger( 'simple' )
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
@@ -53,7 +69,7 @@ class Eggog( exceptions.Exception ) :
         if type( string_key ) != type( '' ) :
 
             # raise self.__class__(  "'%s': EGI wants the key to be four _characters_ (not %s) !" % (type(string_key), )  )
-            raise Eggog(  "'%s': EGI wants the key to be four _characters_ (not %s) !" % (type(string_key), )  )
+            raise Eggog(  "'%s': EGI wants the key to be four _characters_ (not %s) !" % (string_key, type(string_key) )  )
 
         else :
 
@@ -131,7 +147,9 @@ def ms_localtime(warnme = True) :
     # modulo = 10 # tests
     ms_remainder = int(   math.floor(  ( time.time() % modulo ) * 1000  )   )
 
-    if warnme and ( ms_remainder < _ts_last ) :
+    # only a real wrap ( a drop by more than half the period ) : two threads may read
+    # the clock and store _ts_last in the opposite order, going back by a millisecond or so
+    if warnme and ( ms_remainder < _ts_last - modulo * 500 ) :
 
         raise Eggog( "internal 32-bit counter passed through zero, please resynchronize ( call .synch() once again )" )
 
@@ -293,6 +311,175 @@ def make_fit( k ):
         return ( k + ' ' * abs(d))
 
 
+class KeyCollisionWarning( UserWarning ) :
+    """ two different keys became the same four-character key after padding or truncation """
+
+    pass
+
+
+class _KeyRegistry :
+    """
+        an interning cache of the validated ( and, if asked to, padded / truncated ) keys ;
+
+        the experiments use a small fixed vocabulary of keys, so every key is checked
+        only the first time it is seen ; as padding and truncation may silently make
+        two keys identical ( say, 'stim1' and 'stim2' both become 'stim' ) ,
+        such collisions are reported ( once ) when the second key is registered .
+    """
+
+    def __init__( self, max_size = 4096 ) :
+
+        self._max_size = max_size
+
+        # the cache keys are ( type, key ) : 1, 1.0 and True are equal as dictionary keys
+        self._strict = {} # ( type, key ) -> key ( checked as is )
+        self._padded = {} # ( type, raw key ) -> four-character key
+
+        self._owners = {} # four-character key -> the first raw key that became it
+        self._collisions = [] # ( four-character key, the first raw key, the colliding raw key )
+
+    def _register( self, fitted, raw ) :
+
+        owner = self._owners.setdefault( fitted, raw )
+
+        if owner != raw :
+
+            self._collisions.append( ( fitted, owner, raw ) )
+            warnings.warn( "'%s' and '%s' are both sent as the key '%s'" % ( owner, raw, fitted ),
+                           KeyCollisionWarning, stacklevel = 4 )
+
+    def _full( self ) :
+
+        return len( self._strict ) + len( self._padded ) >= self._max_size
+
+    def strict( self, k ) :
+        """ returns the key if it is a four-character string , raises an exception otherwise """
+
+        cache_key = ( type( k ), k )
+
+        try :
+            return self._strict[ cache_key ]
+        except KeyError :
+            pass
+        except TypeError :
+            raise Eggog( "'%s': EGI wants the key to be a string, not %s" % ( k, type( k ) ) )
+
+        Eggog.check_type( k )
+        Eggog.check_len( k )
+
+        if not self._full() :
+            self._register( k, k )
+            self._strict[ cache_key ] = k
+
+        return k
+
+    def padded( self, k ) :
+        """ returns the key converted by str() and then truncated or padded with spaces to four characters """
+
+        cache_key = ( type( k ), k )
+
+        try :
+            return self._padded[ cache_key ]
+        except KeyError :
+            pass
+        except TypeError :
+            raise Eggog( "'%s': the key should be hashable ( a string, a number ) , not %s" % ( k, type( k ) ) )
+
+        if type( k ) != type( '' ) :
+            fitted = make_fit( str( k ) )
+        else :
+            fitted = make_fit( k )
+
+        if not self._full() :
+            self._register( fitted, k )
+            self._padded[ cache_key ] = fitted
+
+        return fitted
+
+    def collisions( self ) :
+        """ the list of ( four-character key, the first raw key, the colliding raw key ) seen so far """
+
+        return list( self._collisions )
+
+
+# -----------------------------------------------------------------------------
+
+DEFAULT_VALUE_CACHE_SIZE = 1024
+
+# the cache key of a float
+_DOUBLE = struct.Struct( '!d' )
+
+class _ValueCache :
+    """
+        a bounded LRU cache of the encoded values ( the labels, the condition names, the block numbers ...
+        repeat across thousands of events, so each is encoded once and then only looked up ) ;
+
+        the entries are kept in a circular doubly linked list of [ prev, next, key, encoded ] ,
+        the most recently used just before the root ; not thread safe -- every _DataFormat has its own .
+    """
+
+    def __init__( self, max_size = DEFAULT_VALUE_CACHE_SIZE ) :
+
+        self._max_size = max_size
+
+        self._map = {}
+        self._root = root = []
+        root[:] = [ root, root, None, None ]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get( self, key ) :
+        """ the encoded value or None """
+
+        link = self._map.get( key )
+
+        if link is None :
+            self.misses += 1
+            return None
+
+        # unlink and put back as the most recent one
+        link_prev, link_next, _, encoded = link
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+        self.hits += 1
+
+        return encoded
+
+    def put( self, key, encoded ) :
+
+        if self._max_size <= 0 :
+            return
+
+        root = self._root
+
+        if len( self._map ) >= self._max_size :
+
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+
+            del self._map[ oldest[2] ]
+            self.evictions += 1
+
+        last = root[0]
+        last[1] = root[0] = self._map[ key ] = [ last, root, key, encoded ]
+
+    def stats( self ) :
+        """ { 'hits', 'misses', 'evictions', 'size', 'max_size' } """
+
+        return { 'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+                 'size' : len( self._map ), 'max_size' : self._max_size }
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
@@ -457,8 +644,13 @@ def cstring( s ) :
 class _DataFormat :
     """ a helper for creating the "Extended" events (many key fields, variable data) """
 
-    def __init__( self ) :
-        """ create the main reference table """
+    # what the value cache takes : the strings up to this length, the integers in this range ,
+    # all the bools and floats ( the rest is encoded every time )
+    CACHED_TEXT_MAX = 256
+    CACHED_INT_RANGE = ( -1024, 1024 )
+
+    def __init__( self, cache_size = DEFAULT_VALUE_CACHE_SIZE ) :
+        """ create the main reference table ; 'cache_size' -- of the encoded values cache ( 0 turns it off ) """
 
         # ref. : p.196 of App.G: "Experimental Control Protocol"
         self._translation_table = \
@@ -488,6 +680,36 @@ class _DataFormat :
             type(1L) : is_32_bit_int_compatible,
         }
 
+        # the validated keys ( the event keys and the table keys )
+        self._keys = _KeyRegistry()
+
+        # ( type, value ) -> the encoded value , ( None, string ) -> the Pascal string
+        # ( the type is a part of the key : True == 1 == 1.0 for a dictionary )
+        self._values = _ValueCache( cache_size )
+
+    def set_cache_size( self, cache_size ) :
+        """ start a new value cache of the given size ( 0 turns it off ) """
+
+        self._values = _ValueCache( cache_size )
+
+    def cache_stats( self ) :
+        """ the hit / miss counters of the value cache ( see _ValueCache.stats() ) """
+
+        return self._values.stats()
+
+    def _cacheable( self, data ) :
+
+        cls = data.__class__
+
+        if cls is str :
+            return len( data ) <= self.CACHED_TEXT_MAX
+
+        if cls is int :
+            low, high = self.CACHED_INT_RANGE
+            return low <= data < high
+
+        return cls is bool or cls is float
+
     def _get_hints( self, data ) :
         """ try to preprocess the data before getting the packing hints """
 
@@ -501,6 +723,39 @@ class _DataFormat :
 
 
     def _pack_data( self, data ) :
+        """ _encode_data() through the value cache """
+
+        if not self._cacheable( data ) :
+            return self._encode_data( data )
+
+        cls = data.__class__
+
+        # the floats by their bytes : 0.0 == -0.0 for a dictionary , and NaN != NaN
+        key = ( cls, _DOUBLE.pack( data ) if cls is float else data )
+
+        encoded = self._values.get( key )
+        if encoded is None :
+            encoded = self._encode_data( data )
+            self._values.put( key, encoded )
+
+        return encoded
+
+    def _pstring( self, s ) :
+        """ pstring() through the value cache """
+
+        if len( s ) > self.CACHED_TEXT_MAX :
+            return pstring( s )
+
+        key = ( None, s )
+
+        encoded = self._values.get( key )
+        if encoded is None :
+            encoded = pstring( s )
+            self._values.put( key, encoded )
+
+        return encoded
+
+    def _encode_data( self, data ) :
         """ try to pack the argument according to its type; by default, a str() conversion is sent """
 
         # hints = self._translation_table.get( type(data), None )
@@ -513,7 +768,7 @@ class _DataFormat :
 
             # "one-level recursion" :
             # return self._pack_data( repr(data) )
-            return self._pack_data( str(data) )
+            return self._encode_data( str(data) )
 
         ## # our special case ( grep 'bugfix' to see why we want a zero block )
         ## if data is None: data = 0
@@ -541,7 +796,8 @@ class _DataFormat :
             if the 'pad' argument is False, the keys must be four-character strings ,
             otherwise they will be converted to strings by str() and then truncated
             or padded with spaces .
-            Note that for the latter case the uniqueness of the generated key ids is not quaranteed .
+            Note that for the latter case the uniqueness of the generated key ids is not quaranteed
+            ( a KeyCollisionWarning is issued the first time two keys become the same ) .
         """
 
         keys, values = zip( *table.items() )
@@ -557,25 +813,14 @@ class _DataFormat :
         # preprocess the keys ...
         #
 
-        # 4-byte condition check
+        # 4-byte condition check ( or the conversion to string and truncation or padding ) ,
+        # done only once per key ; the registry also checks the uniqueness of the converted keys
         if not pad :
-            # "try" ...
-            map( Eggog.check_type, keys )
-            map( Eggog.check_len, keys )
-
-        else : # else convert to string and truncate or pad
-
-            for i in xrange(len(keys)) :
-
-                k = keys[i]
-                if type(k) != type( '' ) :
-
-                    k = make_fit( str(k) )
-                    keys[i] = k
-
-
+            intern = self._keys.strict
+        else :
+            intern = self._keys.padded
 
-        # check uniqueness of the keys
+        keys = [ intern( k ) for k in keys ]
 
 
         #
@@ -624,6 +869,10 @@ class _DataFormat :
 
     '''
 
+    # where the timestamp lives in a packed event ( after 'D' and the length ) -- to stamp pre-packed events
+    EVENT_TIMESTAMP = struct.Struct( '=L' )
+    EVENT_TIMESTAMP_OFFSET = struct.calcsize( '=sH' )
+
     def _make_event_header( self, size_of_the_rest, timestamp, duration, keycode ) :
         """
             make an event message header from the given data according to the protocol
@@ -646,7 +895,7 @@ class _DataFormat :
         return result_str
 
 
-    def pack( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
+    def pack( self, key, timestamp = None, label = None, description = None, table = None, pad = False, schema = None ) :
         """
             pack the arguments according to the Netstation Event structure ;
 
@@ -655,14 +904,24 @@ class _DataFormat :
             four-character string ; otherwise, if the 'pad' value is True,
             the routine tries to convert truncate or pad the key to form a 4-byte string .
 
+            if an EventSchema is given as 'schema' , the 'table' is packed by it
+            ( and can be a sequence of the values in the order of the schema ) .
+
             nb. if the 'timestamp' argument is None -- the according field is set
                 by a local routine at the moment of the call .
         """
 
+        if _TP_PACK_START.hooks : _TP_PACK_START.fire( key )
+
         duration = 1
         if timestamp is None :
             timestamp = ms_localtime()
 
+        if not pad :
+            key = self._keys.strict( key )
+        else :
+            key = self._keys.padded( key )
+
         #
         # bugfix : as it seems that NetStation
         #
@@ -686,10 +945,12 @@ class _DataFormat :
         if label is None : label = ''
         if description is None : description = ''
 
-        label_str = pstring( label )
-        description_str = pstring( description )
+        label_str = self._pstring( label )
+        description_str = self._pstring( description )
 
-        if table is None or len( table.keys() ) <= 0 :
+        if schema is not None :
+            table_str = schema.pack( table )
+        elif table is None or len( table.keys() ) <= 0 :
             # explicitly state that the number of keys is zero ( see above comment )
             table_str = struct.pack( 'B', 0 )
         else :
@@ -707,26 +968,316 @@ class _DataFormat :
 
         result_str = _cat( header_str, label_str, description_str, table_str )
 
+        if _TP_PACK_END.hooks : _TP_PACK_END.fire( key )
+
         return result_str
 
 
+# -----------------------------------------------------------------------------
+
+#
+# schema-declared event tables : for the events with the same table layout
+# the keys and the types are checked once, and not for every value of every event
+#
+
+class EventSchema :
+    """
+        a declaration of an event table -- its keys, their order and the Netstation types ;
+
+        the declaration is checked when the schema is created , so packing a table
+        only costs the range checks and a ready-made packer per field :
+
+            schema = EventSchema( [ ( 'trl#', 'long' ), ( 'cond', 'TEXT' ), ( 'rt__', 'doub' ) ] )
+            ns.send_event( 'resp', table = ( 12, 'congruent', 0.456 ), schema = schema )
+
+        the types are either the Netstation ones ( 'bool', 'shor', 'long', 'sing', 'doub', 'TEXT' )
+        or the Python types bool, int, long, float, str ( the same translation as for the plain tables ) .
+    """
+
+    # Netstation type -> ( 'struct' format, the value range or None )
+    # ( the floating-point values are big-endian, grep 'bugfix' in _DataFormat for the reason )
+    _formats = \
+    { 'bool' : ( '=?', None ) ,
+      'shor' : ( '=h', ( -0x8000, 0x7FFF ) ) ,
+      'long' : ( '=l', ( -0x80000000, 0x7FFFFFFF ) ) ,
+      'sing' : ( '!f', None ) ,
+      'doub' : ( '!d', None ) ,
+      'TEXT' : ( None, ( 0, 0xFFFF ) ) , # the range is for the length
+    }
+
+    _python_types = \
+    { type(True) : 'bool' ,
+      type(1) : 'long' ,
+      type(1L) : 'long' ,
+      type(1.0) : 'doub' ,
+      type('') : 'TEXT' ,
+    }
+
+    def __init__( self, fields ) :
+        """ 'fields' is a sequence of ( key, type ) pairs, in the order the values go on the wire """
+
+        fields = list( fields )
+
+        if len( fields ) > 255 :
+            raise Eggog( "too many keys in the schema (%d > 255)" % ( len( fields ), ) )
+
+        keys = []
+        packers = []
+
+        for key, desctype in fields :
+
+            Eggog.check_type( key )
+            Eggog.check_len( key )
+
+            if key in keys :
+                raise Eggog( "'%s': the key is declared twice in the schema" % ( key, ) )
+
+            desctype = self._python_types.get( desctype, desctype )
+            if desctype not in self._formats :
+                raise Eggog( "'%s': unknown Netstation type '%s'" % ( key, desctype ) )
+
+            keys.append( key )
+            packers.append( self._make_packer( key, desctype ) )
+
+        self._keys = tuple( keys )
+        self._types = tuple( self._python_types.get( t, t ) for k, t in fields )
+        self._packers = tuple( packers )
+
+        self._nkeys_str = struct.pack( '=B', len( keys ) )
+
+    def _make_packer( self, key, desctype ) :
+        """ returns a function packing one value of the field ( 'key' + 'DescType' + 'length' + 'data' ) """
+
+        fmt, limits = self._formats[ desctype ]
+
+        if fmt is None : # TEXT
+
+            prefix = key + desctype
+            max_length = limits[1]
+
+            def pack_text( value ) :
+
+                if type( value ) is not str :
+                    value = str( value )
+
+                if len( value ) > max_length :
+                    raise Eggog( "'%s': the text is too long (%d > %d bytes)" % ( key, len( value ), max_length ) )
+
+                return prefix + struct.pack( '=H', len( value ) ) + value
+
+            return pack_text
+
+        # else ...
+
+        packer = struct.Struct( fmt ).pack
+        prefix = key + desctype + struct.pack( '=H', struct.calcsize( fmt ) )
+
+        if limits is None :
+
+            def pack_value( value ) :
+
+                return prefix + packer( value )
+
+        else :
+
+            lo, hi = limits
+
+            def pack_value( value ) :
+
+                if not ( lo <= value <= hi ) :
+                    raise Eggog( "'%s': %s does not fit the '%s' type" % ( key, repr( value ), desctype ) )
+
+                return prefix + packer( value )
+
+        return pack_value
+
+    ## -----------------------------------------------------------
+
+    def keys( self ) :
+        """ the table keys, in the wire order """
+
+        return self._keys
+
+    def types( self ) :
+        """ the Netstation types of the fields, in the wire order """
+
+        return self._types
+
+    def pack( self, values ) :
+        """
+            pack a table for sending ; 'values' is either a sequence of the values in the declared
+            order, or a dictionary with all the declared keys ( and only them )
+        """
+
+        if isinstance( values, dict ) :
+
+            if len( values ) != len( self._keys ) :
+                raise Eggog( "the table keys %s do not match the schema %s" % ( sorted( values.keys() ), list( self._keys ) ) )
+
+            try :
+                values = [ values[k] for k in self._keys ]
+            except KeyError as e :
+                raise Eggog( "'%s': the key is missing from the table" % ( e.args[0], ) )
+
+        elif len( values ) != len( self._packers ) :
+
+            raise Eggog( "%d values for the schema of %d fields" % ( len( values ), len( self._packers ) ) )
+
+        try :
+            parts = [ pack( value ) for pack, value in zip( self._packers, values ) ]
+        except struct.error as e :
+            raise Eggog( "a value does not match the schema: %s" % ( e, ) )
+
+        return self._nkeys_str + ''.join( parts )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+#
+# per-session event accounting ( see "Note A" in the send_event() docstring )
+#
+
+# the number of events our version of Netstation was able to record in one session
+DEFAULT_EVENT_BUDGET = 2 ** 15
+
+
+class EventBudgetWarning( UserWarning ) :
+    """ the session is running out of ( or has already exceeded ) its event budget """
+
+    pass
+
+
+class _EventBudget :
+    """
+        counts the events sent during the current session ;
+
+        a warning is issued once per session when each of the 'warn_at' fractions
+        of the budget is reached ; when the budget is exhausted the 'on_exhausted'
+        policy applies : 'warn' -- send the event anyway ( it will probably be lost ) ,
+        'raise' -- raise an exception instead of sending it .
+    """
+
+    def __init__( self, budget = DEFAULT_EVENT_BUDGET, warn_at = ( 0.75, 0.9 ), on_exhausted = 'warn' ) :
+
+        if budget <= 0 :
+            raise Eggog( "the event budget should be positive, not %s" % ( budget, ) )
+
+        if on_exhausted not in ( 'warn', 'raise' ) :
+            raise Eggog( "unknown event budget policy '%s' ( should be 'warn' or 'raise' )" % ( on_exhausted, ) )
+
+        self._budget = budget
+        self._on_exhausted = on_exhausted
+
+        # the event counts to warn at, in the ascending order ; the budget itself is the last one
+        thresholds = [ int( math.ceil( f * budget ) ) for f in warn_at if 0 < f < 1 ]
+        self._thresholds = sorted( set( thresholds ) ) + [ budget, ]
+
+        self.reset()
+
+    def reset( self ) :
+        """ a new session has started """
+
+        self._used = 0
+        self._next_threshold = 0 # index in self._thresholds
+
+    def budget( self ) :
+        return self._budget
+
+    def used( self ) :
+        return self._used
+
+    def left( self ) :
+        return max( self._budget - self._used, 0 )
+
+    def fraction( self ) :
+        """ the used part of the budget , 0.0 .. 1.0 ( and more if overspent ) """
+
+        return float( self._used ) / self._budget
+
+    def spend( self, n = 1 ) :
+        """ account for 'n' events about to be sent ; warns or raises according to the policy """
+
+        used = self._used + n
+
+        if used > self._budget and self._on_exhausted == 'raise' :
+            raise Eggog( "the session event budget is exhausted (%d events) ; please start a new session" % ( self._budget, ) )
+
+        self._used = used
+
+        # the common case costs a single comparison
+        if self._next_threshold < len( self._thresholds ) and used >= self._thresholds[ self._next_threshold ] :
+
+            while self._next_threshold < len( self._thresholds ) and used >= self._thresholds[ self._next_threshold ] :
+                self._next_threshold += 1
+
+            warnings.warn( "%d of %d events of the session budget are used" % ( used, self._budget ),
+                           EventBudgetWarning, stacklevel = 3 )
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
+def _command( method ) :
+    """ a public command of Netstation : its tracepoints go under one sequence number ( see trace.py ) """
+
+    @functools.wraps( method )
+    def traced( self, *args, **kwargs ) :
+
+        # the 'postman' threads enter the command with the number it was given when queued
+        if not trace.enabled or trace.current() is not None :
+            return method( self, *args, **kwargs )
+
+        with trace.command() :
+            return method( self, *args, **kwargs )
+
+    traced.__wrapped__ = method # the signature for fwhelper
+
+    return traced
+
+
 class Netstation :
     """ Provides Python interface for a connection with the Netstation via a TCP/IP socket. """
 
-    def __init__( self ) :
+    def __init__( self, timeline = None ) :
+        """ 'timeline' -- the timeline.Timeline to stamp with ( a new one by default , see multiprocessed.py ) """
 
         self._socket = Socket()
         self._system_spec = _get_endianness_string()
         self._fmt = _Format()
         self._data_fmt = _DataFormat()
 
-    def connect( self, str_address, port_no ):
-        """ connect to the Netstaton machine """
+        self._event_budget = _EventBudget()
+        self._last_rollover_duration = None
+
+        self._timeline = timeline if timeline is not None else Timeline()
+
+        self._event_log = None
+
+        # the monotonic time the last send_encoded() message has been written ( see threaded.Netstation.schedule_event() )
+        self._ns_last_encoded_write = None
+
+        # the monotonic time of the last event timestamp ( see _stamp() )
+        self._ns_stamped = None
+
+        self._reset_acks()
 
-        return self._socket.connect( str_address, port_no )
+    def _reset_acks( self ) :
+        """ forget the replies for the messages sent without waiting ( see poll_acks() ) """
+
+        self._pending_acks = 0 # the number of the replies not read yet
+        self._ack_buf = '' # the bytes read from the socket but not parsed yet
+        self._acks = deque() # the replies read but not returned by poll_acks() yet
+        self._ack_owners = deque() # the event log indexes of the pending replies ( with the log on )
+        self._ack_seqs = deque() # the command sequence numbers of the pending replies ( None with no tracepoints on )
+
+    def connect( self, str_address, port_no, seconds_timeout = DEFAULT_TIMEOUT ):
+        """ connect to the Netstaton machine ; 'seconds_timeout' also applies to every following read or write """
+
+        self._reset_acks()
+        self._timeline.reset()
+
+        return self._socket.connect( str_address, port_no, seconds_timeout )
 
         # return None
 
@@ -735,15 +1286,188 @@ class Netstation :
 
         self._socket.disconnect()
 
+        if self._event_log is not None :
+            self._event_log.export_if_needed()
+
         # return None
 
     ## -----------------------------------------------------------
 
+    def ms_now( self ) :
+        """ the current time in ms, as sent on the wire ( the timeline of this connection , see timeline.py ) """
+
+        return self._timeline.ms()
+
+    def timeline( self ) :
+        """ the timeline.Timeline object of this connection """
+
+        return self._timeline
+
+    def _resync( self ) :
+        """ the wire time is about to wrap ( see timeline.py ) : sync ( and rebase with it ) before the next event """
+
+        _log.info( "egi: the wire time is about to wrap, resyncing" )
+        self.sync()
+
+    def _stamp( self, timestamp = None ) :
+        """ resync first if it is due , then the event timestamp ( now , if None ) -- so it is in the base Netstation has """
+
+        timeline = self._timeline
+
+        if timeline.resync_due :
+            self._resync()
+
+        # the moment of the stamp ( for the event log , see align.py )
+        ns = ns_monotonic()
+
+        if timestamp is None :
+
+            timestamp = timeline.ms( ns )
+
+            # this very stamp has crossed the point : resync and take it again , in the new base
+            if timeline.resync_due :
+                self._resync()
+                ns = ns_monotonic()
+                timestamp = timeline.ms( ns )
+
+        else :
+
+            # taken earlier ( say, in the caller's thread or process ) : maybe in the base before the resync
+            timestamp = timeline.current_ms( timestamp, ns )
+
+            if timeline.resync_due :
+                self._resync()
+                ns = ns_monotonic()
+                timestamp = timeline.current_ms( timestamp, ns )
+
+        self._ns_stamped = ns
+
+        return timestamp
+
+    ## -----------------------------------------------------------
+
+    def enable_capture( self, n_records = 4096, dump_path = None ) :
+        """ keep the last 'n_records' chunks sent and received ( see socket_wrapper.Socket.enable_capture() ) """
+
+        self._socket.enable_capture( n_records, dump_path )
+
+    def dump_capture( self, path = None ) :
+        """ write the captured chunks to a file ; socket_wrapper.load_capture() reads them back """
+
+        return self._socket.dump_capture( path )
+
+    ## -----------------------------------------------------------
+
+    def corked( self ) :
+        """
+            a 'with' block whose messages leave in a single write ( see socket_wrapper.Socket.cork() ) ;
+            together with b_wait = False it sends a burst of events at once :
+
+                with ns.corked() :
+                    for key in keys :
+                        ns.send_event( key, b_wait = False )
+                ...
+                ns.poll_acks()
+
+            nb. a command waiting for its reply inside the block would wait forever -- the message
+                is not sent until the block ends ; so only b_wait = False events belong there .
+        """
+
+        return self._socket.corked()
+
+    def fileno( self ) :
+        """ the socket descriptor -- to wake the experiment loop up when the replies arrive """
+
+        return self._socket.fileno()
+
+    def pending_acks( self ) :
+        """ the number of the messages sent with b_wait = False whose replies are not read yet """
+
+        return self._pending_acks
+
+    def poll_acks( self, seconds_timeout = 0 ) :
+        """
+            read the replies for the messages sent with b_wait = False -- as many as have arrived ,
+            waiting for the first of them at most 'seconds_timeout' ( never blocking by default ) ;
+
+            returns the list of the results in the order of sending : True for the success ,
+            False if Netstation has returned an error .
+        """
+
+        results = list( self._acks )
+        self._acks.clear()
+
+        if self._pending_acks <= 0 :
+            return results
+
+        self._ack_buf += self._socket.read_available( seconds_timeout )
+
+        while self._pending_acks > 0 and self._response_is_complete() :
+            results.append( self._read_ack() )
+
+        return results
+
+    def _response_is_complete( self ) :
+        """ is there a whole reply in the read-ahead buffer ? """
+
+        buf = self._ack_buf
+        if not buf :
+            return False
+
+        fmt = self._fmt[ buf[0] ]
+        if fmt is None : # an unexpected code : let _read_response() complain
+            return True
+
+        return len( buf ) >= 1 + struct.calcsize( fmt )
+
+    def _read( self, size ) :
+        """ read from the read-ahead buffer first , then from the socket """
+
+        buf = self._ack_buf
+
+        if len( buf ) >= size :
+            self._ack_buf = buf[ size : ]
+            return buf[ : size ]
+
+        self._ack_buf = ''
+        return buf + self._socket.read( size - len( buf ) )
+
+    ## -----------------------------------------------------------
+
     def GetServerResponse( self, b_raise = True ):
         """ read the response from the socket and convert it to a True / False resulting value """
 
-        code = self._socket.read(1)
+        # the replies come in the order of the messages : first take those sent without waiting
+        while self._pending_acks > 0 :
+            self._acks.append( self._read_ack() )
+
+        return self._read_response( b_raise )
+
+    def _expect_ack( self ) :
+        """ a message has been sent without waiting for its reply ( see poll_acks() ) """
 
+        self._pending_acks += 1
+        self._ack_seqs.append( trace.current() if trace.enabled else None )
+
+    def _read_ack( self ) :
+        """ read the reply for a message sent without waiting ( and note its time in the event log ) """
+
+        self._pending_acks -= 1
+        result = self._read_response( False, self._ack_seqs.popleft() )
+
+        if self._ack_owners :
+            index = self._ack_owners.popleft()
+            if index is not None :
+                self._event_log.acked( index, ns_monotonic(), result )
+
+        return result
+
+    def _read_response( self, b_raise, seq = None ) :
+        """ read a single reply ( to the command 'seq' , the current one by default ) """
+
+        code = self._read(1)
+
+        if _TP_RESPONSE_READ.hooks : _TP_RESPONSE_READ.fire( code, seq )
 
         if code == 'Z':
 
@@ -752,10 +1476,13 @@ class Netstation :
         elif code == 'F' : # an 'F' <error code> sequence
 
             error_info_length = self._fmt.format_length( code )
-            error_info = self._socket.read( error_info_length )
+            error_info = self._read( error_info_length )
 
             if b_raise :
 
+                # keep the evidence of what Netstation has rejected
+                self._socket._dump_on_error()
+
                 err_msg = "server returned an error : " + repr( self._fmt.unpack(code, error_info) )
                 raise Eggog( err_msg )
 
@@ -765,7 +1492,7 @@ class Netstation :
         elif code == 'I' : # a version byte should follow
 
             version_length = self._fmt.format_length( code )
-            version_info = self._socket.read( version_length )
+            version_info = self._read( version_length )
             version = self._fmt.unpack( code, version_info )
 
             ## # debug
@@ -789,6 +1516,7 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
+    @_command
     def BeginSession( self ) :
         """ say 'hi!' to the server """
 
@@ -798,23 +1526,31 @@ class Netstation :
         message = self._fmt.pack( 'Q', self._system_spec )
         self._socket.write( message )
 
-        # debug
-        print "BS: ", message
+        _log.debug( "BS: %r", message )
+
+        self._event_budget.reset()
 
         return self.GetServerResponse()
 
 
+    @_command
     def EndSession( self ):
         """ say 'bye' to the server """
 
         self._socket.write( 'X' )
         # self._connection.write( 'X' ).flush()
 
-        return self.GetServerResponse()
+        result = self.GetServerResponse()
+
+        if self._event_log is not None :
+            self._event_log.export_if_needed()
+
+        return result
 
 
     ## -----------------------------------------------------------
 
+    @_command
     def StartRecording( self ):
         """ start recording to the selected ( externally ) file """
 
@@ -823,6 +1559,7 @@ class Netstation :
         return self.GetServerResponse()
 
 
+    @_command
     def StopRecording( self ):
         """ stop recording to the selected file;
             the recording can be resumed with the BeginRecording() command
@@ -835,6 +1572,7 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
+    @_command
     def SendAttentionCommand( self ):
         """ Sends and 'Attention' command """ # also pauses the recording ?
 
@@ -843,27 +1581,62 @@ class Netstation :
         return self.GetServerResponse()
 
 
+    @_command
     def SendLocalTime( self, ms_time = None ):
         """ Send the local time (in ms) to Netstation; usually this happens after an 'Attention' command """
 
         if ms_time is None :
-            ms_time = ms_localtime()
+            ms_time = self._timeline.sync_ms()
 
         message = self._fmt.pack( 'T', ms_time )
 
         ## # debug
         ## print message, struct.unpack('=L', message[1:])
 
+        t_send = ns_monotonic()
+
         self._socket.write( message )
+        self._timeline.synced()
 
-        return self.GetServerResponse()
+        result = self.GetServerResponse()
+
+        if self._event_log is not None :
+            self._event_log.add_sync( t_send, ns_monotonic() - t_send, ms_time )
+
+        return result
 
     ## -----------------------------------------------------------
 
+    @_command
     def sync( self, timestamp = None ) :
         """ a shortcut for sending the 'attention' command and the time info """
 
-        if ( self.SendAttentionCommand() ) and ( self.SendLocalTime( timestamp ) ) :
+        if timestamp is None :
+            timestamp = self._timeline.sync_ms()
+
+        # packed first : a bad timestamp raises before anything is written
+        message = self._fmt.pack( 'T', timestamp )
+
+        t_send = ns_monotonic()
+
+        # 'A' and 'T' leave together ( our Netstation does not like any delay between them ) ,
+        # then both replies are read
+        with self._socket.corked() :
+            self._socket.write( 'A' )
+            self._socket.write( message )
+
+        self._timeline.synced()
+
+        # both read before raising : an 'F' to the 'A' leaves no reply behind
+        b_attention = self.GetServerResponse( False )
+        b_time = self.GetServerResponse( False )
+
+        if _TP_SYNC_DONE.hooks : _TP_SYNC_DONE.fire( 'T' )
+
+        if self._event_log is not None :
+            self._event_log.add_sync( t_send, ns_monotonic() - t_send, timestamp )
+
+        if b_attention and b_time :
 
             return True
 
@@ -871,13 +1644,211 @@ class Netstation :
 
             raise Eggog( "sync command failed!" )
 
+    ## -----------------------------------------------------------
+
+    def start( self, str_address, port_no, seconds_timeout = DEFAULT_TIMEOUT, b_record = True ) :
+        """
+            connect() and start_session() at once -- the fast way to get an experiment going ;
+
+            raises the connection error if the connection fails ( within 'seconds_timeout' ) ,
+            otherwise returns the timings of start_session() plus the 'connect' phase .
+        """
+
+        t_start = ns_monotonic()
+
+        error = self.connect( str_address, port_no, seconds_timeout )
+        if error is not None :
+            raise error
+
+        t_connect = ( ns_monotonic() - t_start ) * 1e-9
+
+        timings = self.start_session( b_record )
+
+        timings[ 'connect' ] = t_connect
+        timings[ 'total' ] += t_connect
+
+        return timings
+
+    @_command
+    def start_session( self, b_record = True ) :
+        """
+            BeginSession(), sync() and ( if 'b_record' is True ) StartRecording() --
+            -- but pipelined : all the commands leave in one write, then the replies are read
+            as they arrive ; one round trip instead of four .
+
+            returns a dictionary with the phase durations in seconds : 'send' -- writing the commands ,
+            'Q', 'A', 'T', 'B' -- the arrival of each reply , 'total' -- all of it ( all counted from the start ) .
+        """
+
+        return self._pipeline_session( False, b_record )
+
+    def _pipeline_session( self, b_end, b_record ) :
+        """ send [ 'X' ,] 'Q', 'A', 'T' [, 'B' ] in one write and read the replies """
+
+        t_start = ns_monotonic()
+
+        messages = []
+        if b_end :
+            messages.append( ( 'X', 'X' ) )
+
+        messages.append( ( 'Q', self._fmt.pack( 'Q', self._system_spec ) ) )
+        messages.append( ( 'A', 'A' ) )
+        t_wire = self._timeline.sync_ms()
+        messages.append( ( 'T', self._fmt.pack( 'T', t_wire ) ) )
+
+        if b_record :
+            messages.append( ( 'B', 'B' ) )
+
+        t_send = ns_monotonic()
+
+        with self._socket.corked() :
+            for code, message in messages :
+                self._socket.write( message )
+
+        self._timeline.synced()
+
+        timings = { 'send' : ( ns_monotonic() - t_start ) * 1e-9 }
+
+        # every reply is read before an error one raises : the replies to come stay in step
+        errors = []
+
+        for code, message in messages :
+
+            try :
+                self.GetServerResponse()
+            except Eggog as e :
+                errors.append( ( code, e ) )
+
+            timings[ code ] = ( ns_monotonic() - t_start ) * 1e-9
+
+            if code == 'T' and self._event_log is not None :
+                self._event_log.add_sync( t_send, ns_monotonic() - t_send, t_wire )
+
+        if errors :
+            code, e = errors[0]
+            raise Eggog( "'%s' of the pipelined session start ( %d of %d replies were errors ) : %s" % ( code, len( errors ), len( messages ), e ) )
+
+        self._event_budget.reset()
+
+        timings[ 'total' ] = ( ns_monotonic() - t_start ) * 1e-9
+
+        return timings
+
+    ## -----------------------------------------------------------
+
+    def set_event_budget( self, budget = DEFAULT_EVENT_BUDGET, warn_at = ( 0.75, 0.9 ), on_exhausted = 'warn' ) :
+        """
+            configure the per-session event accounting ( the counter restarts from zero ) :
+
+            -- 'budget' -- the number of events Netstation can record in one session ;
+            -- 'warn_at' -- the fractions of the budget at which an EventBudgetWarning is issued ;
+            -- 'on_exhausted' -- 'warn' to keep sending , 'raise' to raise an exception instead .
+        """
+
+        self._event_budget = _EventBudget( budget, warn_at, on_exhausted )
+
+    def events_sent( self ) :
+        """ the number of events sent since the session has started """
+
+        return self._event_budget.used()
+
+    def events_left( self ) :
+        """ the number of events left in the session budget """
+
+        return self._event_budget.left()
+
+    def enable_event_log( self, export_path = None ) :
+        """
+            keep a compact record of every event sent from now on ( see eventlog.EventLog ) ;
+            it is exported to 'export_path' ( .csv, .tsv or .npz ) , if given , at EndSession() and disconnect() .
+        """
+
+        from eventlog import EventLog
+
+        self._event_log = EventLog( export_path )
+
+        # the replies already on the way belong to no logged event
+        self._ack_owners = deque( [ None ] * self._pending_acks )
+
+        return self._event_log
+
+    def event_log( self ) :
+        """ the eventlog.EventLog ( None unless enable_event_log() was called ) """
+
+        return self._event_log
+
+    def _log_sent( self, key, timestamp, label, table, schema, b_wait ) :
+        """ the rest of sending an event with the event log on : keep the event and the time of its reply """
+
+        log = self._event_log
+        index = log.append( key, ns_monotonic(), timestamp, label, table, schema, self._ns_stamped )
+
+        if not b_wait :
+            self._expect_ack()
+            self._ack_owners.append( index )
+            return None
+
+        try :
+            result = self.GetServerResponse()
+        except Eggog :
+            log.acked( index, ns_monotonic(), False )
+            raise
+
+        log.acked( index, ns_monotonic(), result )
+
+        return result
+
+    def set_value_cache_size( self, cache_size = DEFAULT_VALUE_CACHE_SIZE ) :
+        """ the number of the encoded labels and table values kept for reuse ( 0 turns the cache off ) """
+
+        self._data_fmt.set_cache_size( cache_size )
+
+    def value_cache_stats( self ) :
+        """ { 'hits', 'misses', 'evictions', 'size', 'max_size' } of the encoded values cache """
+
+        return self._data_fmt.cache_stats()
+
+    @_command
+    def rollover( self, b_record = True ) :
+        """
+            close the current session and open a new one ( EndSession, BeginSession, sync
+            and, if 'b_record' is True, StartRecording ) -- so the event counter restarts ;
+
+            the commands go out in one write ( see start_session() ) , but Netstation still
+            has to process them all, so call it at a safe point ( between blocks, say ) ;
+            returns the time it took, in seconds ( also see last_rollover_duration() ) .
+        """
+
+        timings = self._pipeline_session( True, b_record )
+
+        self._last_rollover_duration = timings[ 'total' ]
+
+        return self._last_rollover_duration
+
+    @_command
+    def rollover_if_needed( self, fraction = 0.9, b_record = True ) :
+        """
+            rollover() if at least the given fraction of the session budget is used ;
+            returns the time it took, or None if the session was left as it is .
+        """
+
+        if self._event_budget.fraction() < fraction :
+            return None
+
+        return self.rollover( b_record )
+
+    def last_rollover_duration( self ) :
+        """ how long the last rollover() took, in seconds ( None if there was no rollover yet ) """
+
+        return self._last_rollover_duration
 
     ## -----------------------------------------------------------
 
     # send_event, send_simple_event
 
     ## def pack( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :
-    def send_event(self, key, timestamp=None, label=None, description=None, table=None, pad=False):
+    @_command
+    def send_event(self, key, timestamp=None, label=None, description=None, table=None, pad=False, schema=None, b_wait=True):
         """
             Send an event ; note that before sending any events a sync() has to be called
             to make the sent events effective .
@@ -895,6 +1866,10 @@ class Netstation :
                           not more than 256 in total ;
                           there are no special conditions on the values,
                           but the size of every value entry in bytes should not exceed 2 ^ 16 .
+            -- 'schema' -- an optional EventSchema the 'table' follows ( then the table can also be
+                           a sequence of the values in the order of the schema ) .
+            -- 'b_wait' -- if False, do not wait for the reply ( and return None ) ;
+                           the replies are then collected by poll_acks() .
 
             Note A: due to peculiarity of the implementation, our particular version of NetStation
                     was not able to record more than 2^15 events per session .
@@ -929,9 +1904,19 @@ class Netstation :
 
         '''
 
-        message = self._data_fmt.pack(key, timestamp, label, description, table, pad)
+        timestamp = self._stamp( timestamp )
+
+        message = self._data_fmt.pack(key, timestamp, label, description, table, pad, schema)
+        self._event_budget.spend()
         self._socket.write(message)
 
+        if self._event_log is not None :
+            return self._log_sent( key, timestamp, label, table, schema, b_wait )
+
+        if not b_wait :
+            self._expect_ack()
+            return None
+
         '''
         # # debug
         # print message
@@ -945,7 +1930,8 @@ class Netstation :
 
         return self.GetServerResponse()
 
-    def send_timestamped_event(self, key, label=None, description=None, table=None, pad=False):
+    @_command
+    def send_timestamped_event(self, key, label=None, description=None, table=None, pad=False, schema=None, b_wait=True):
         """
             Send an event timestamped to the time it is sent;
             note that before sending any events a sync() has to be called
@@ -964,6 +1950,10 @@ class Netstation :
                           not more than 256 in total ;
                           there are no special conditions on the values,
                           but the size of every value entry in bytes should not exceed 2 ^ 16 .
+            -- 'schema' -- an optional EventSchema the 'table' follows ( then the table can also be
+                           a sequence of the values in the order of the schema ) .
+            -- 'b_wait' -- if False, do not wait for the reply ( and return None ) ;
+                           the replies are then collected by poll_acks() .
 
             Note A: due to peculiarity of the implementation, our particular version of NetStation
                     was not able to record more than 2^15 events per session .
@@ -997,10 +1987,19 @@ class Netstation :
             zero_entry = { '\x00' * 4 : 0 }
 
         '''
-        timestamp = ms_localtime()
-        message = self._data_fmt.pack(key, timestamp, label, description, table, pad)
+        timestamp = self._stamp()
+
+        message = self._data_fmt.pack(key, timestamp, label, description, table, pad, schema)
+        self._event_budget.spend()
         self._socket.write(message)
 
+        if self._event_log is not None :
+            return self._log_sent( key, timestamp, label, table, schema, b_wait )
+
+        if not b_wait :
+            self._expect_ack()
+            return None
+
         '''
         # # debug
         # print message
@@ -1016,10 +2015,53 @@ class Netstation :
 
 
 
+    @_command
+    def send_encoded( self, message, b_wait = True ) :
+        """
+            send an event already packed by _DataFormat.pack() ( say, packed in advance and
+            only timestamped at the right moment -- see _DataFormat.EVENT_TIMESTAMP_OFFSET ) ;
+            'message' may be a string or a bytearray , 'b_wait' is the same as for send_event() .
+        """
+
+        # the stamp is in the message already : this is the closest we know of its moment
+        self._ns_stamped = ns = ns_monotonic()
+
+        offset = _DataFormat.EVENT_TIMESTAMP_OFFSET
+        timestamp, = _DataFormat.EVENT_TIMESTAMP.unpack_from( message, offset )
+
+        # stamped ( or scheduled ) before the rebase : re-stamped in the new base , on a copy
+        current = self._timeline.current_ms( timestamp, ns )
+        if current != timestamp :
+            message = bytearray( message )
+            _DataFormat.EVENT_TIMESTAMP.pack_into( message, offset, current )
+            timestamp = current
+
+        # only if the base has already moved : a pre-packed event is usually sent from a time-critical
+        # place ( a flip callback ) , the resync is due there only if nobody has sent it for a minute
+        if self._timeline.stale :
+            self._resync()
+
+        self._event_budget.spend()
+        self._socket.write( str( message ) )
+
+        self._ns_last_encoded_write = ns_monotonic()
+
+        if self._event_log is not None :
+
+            key = str( message[ offset + 8 : offset + 12 ] ) # after the timestamp and the duration
+
+            return self._log_sent( key, timestamp, None, None, None, b_wait )
+
+        if not b_wait :
+            self._expect_ack()
+            return None
+
+        return self.GetServerResponse()
 
         ## -----------------------------------------------------------
 
     # legacy code
+    @_command
     def SendSimpleEvent(self, markercode, timestamp = None ):
         """ send a 'simple' marker event -- i.e. an event marker without any additional information;
 
@@ -1055,10 +2097,12 @@ class Netstation :
                                       struct.pack('4s', markercode),
                                       )
 
+        self._event_budget.spend()
         self._socket.write( data_string )
 
         return self.GetServerResponse()
 
+    @_command
     def SendSimpleTimestampedEvent(self, markercode):
         """ send a 'simple' marker event -- i.e. an event marker without any additional information;
 
@@ -1071,7 +2115,7 @@ class Netstation :
         # read the time
         #
 
-        current_time = ms_localtime()
+        current_time = self._stamp()
 
 
         default_duration = 1 # also in milliseconds
@@ -1086,6 +2130,7 @@ class Netstation :
                                       struct.pack('4s', markercode),
                                       )
 
+        self._event_budget.spend()
         self._socket.write( data_string )
 
         return self.GetServerResponse()
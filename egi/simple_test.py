@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" simple.py without a connection ( the encoding parts ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import struct
+
+import simple
+from harness import StandIn
+from faults import LinkModel
+
+
+class ValueCacheTest( unittest.TestCase ) :
+
+    def test_signed_zero( self ) :
+
+        fmt = simple._DataFormat()
+
+        positive = fmt._pack_data( 0.0 )
+        negative = fmt._pack_data( -0.0 )
+
+        self.assertNotEqual( positive, negative )
+        self.assertEqual( negative[ -8 : ], struct.pack( '!d', -0.0 ) )
+
+    def test_nan_takes_one_slot( self ) :
+
+        fmt = simple._DataFormat()
+
+        for i in xrange( 10 ) :
+            fmt._pack_data( float( 'nan' ) )
+
+        stats = fmt.cache_stats()
+        self.assertEqual( stats[ 'size' ], 1 )
+        self.assertEqual( stats[ 'hits' ], 9 )
+
+    def test_types_apart( self ) :
+
+        fmt = simple._DataFormat()
+
+        encoded = [  fmt._pack_data( value )  for value in ( 1, True, 1.0 )  ]
+        self.assertEqual( len( set( encoded ) ), 3 )
+
+    def test_lru_eviction( self ) :
+
+        cache = simple._ValueCache( 2 )
+
+        cache.put( 'a', 1 )
+        cache.put( 'b', 2 )
+        cache.get( 'a' )
+        cache.put( 'c', 3 )
+
+        self.assertEqual( cache.get( 'b' ), None )
+        self.assertEqual( cache.get( 'a' ), 1 )
+        self.assertEqual( cache.stats()[ 'evictions' ], 1 )
+
+
+class KeyRegistryTest( unittest.TestCase ) :
+
+    def test_equal_keys_of_other_types( self ) :
+
+        registry = simple._KeyRegistry()
+
+        self.assertEqual( registry.padded( 1 ), '1   ' )
+        self.assertEqual( registry.padded( True ), 'True' )
+        self.assertEqual( registry.padded( 1.0 ), '1.0 ' )
+
+    def test_unicode_is_not_a_string_key( self ) :
+
+        registry = simple._KeyRegistry()
+
+        self.assertEqual( registry.strict( 'stim' ), 'stim' )
+        self.assertRaises( simple.Eggog, registry.strict, u'stim' )
+
+    def test_unhashable_key( self ) :
+
+        registry = simple._KeyRegistry()
+
+        self.assertRaises( simple.Eggog, registry.padded, [ 'stim' ] )
+        self.assertRaises( simple.Eggog, registry.strict, [ 'stim' ] )
+
+
+class SyncTest( unittest.TestCase ) :
+
+    def test_bad_timestamp_sends_nothing( self ) :
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+
+        self.assertRaises( struct.error, ns.sync, -5 )
+
+        # a lone 'A' would have left a 'Z' behind
+        self.assertFalse( ns._socket.read_available( 0.2 ) )
+
+        ns.sync()
+        self.assertEqual( ns.send_event( 'stim', b_wait = False ), None )
+        self.assertEqual( ns.poll_acks( seconds_timeout = 1.0 ), [ True ] )
+
+        ns.EndSession()
+        ns.disconnect()
+
+        self.assertEqual( len( stand_in.arrivals() ), 1 )
+
+    def test_error_to_the_attention( self ) :
+
+        # 'Q', then the 'A' of the sync is answered with an 'F'
+        stand_in = StandIn( LinkModel( seed = 1, rtt_ms = ( 'fixed', 0 ), error_at = ( 2, ) ) )
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+
+        self.assertRaises( simple.Eggog, ns.sync )
+        self.assertFalse( ns._socket.read_available( 0.2 ) )
+
+        ns.disconnect()
+        stand_in.arrivals()
+
+    def test_corked_block_raising( self ) :
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+
+        try :
+            with ns._socket.corked() :
+                ns._socket.write( 'A' )
+                raise ValueError( "the rest of the group" )
+        except ValueError :
+            pass
+
+        ns.BeginSession()
+        ns.send_event( 'stim' )
+        self.assertFalse( ns._socket.read_available( 0.2 ) )
+        ns.disconnect()
+
+        self.assertEqual( len( stand_in.arrivals() ), 1 )
+
+
+class PipelinedSessionTest( unittest.TestCase ) :
+
+    def test_error_in_the_middle( self ) :
+
+        # 'Q', 'A', 'T', 'B' : the 'A' is answered with an 'F'
+        stand_in = StandIn( LinkModel( seed = 1, rtt_ms = ( 'fixed', 0 ), error_at = ( 2, ) ) )
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+
+        self.assertRaises( simple.Eggog, ns.start_session )
+
+        # all the replies have been read : the next command gets its own
+        self.assertFalse( ns._socket.read_available( 0.2 ) )
+        self.assertEqual( ns.send_event( 'stim' ), True )
+
+        ns.disconnect()
+
+        self.assertEqual( len( stand_in.arrivals() ), 1 )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
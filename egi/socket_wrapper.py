@@ -2,6 +2,16 @@
 # -*- coding: cp1251 -*- 
 
 import socket     
+import select # poll() ( or select() where there is no poll(), i.e. on Windows )
+import errno
+
+import struct
+from collections import deque # the capture ring buffer
+from contextlib import contextmanager
+
+from clock import ns_monotonic
+from trace import WRITE_START as _TP_WRITE_START, WRITE_END as _TP_WRITE_END
+import trace # the sequence number of the command that writes
 
 '''     
 import struct     
@@ -17,11 +27,164 @@ class SocketException( exceptions.Exception ) :
     
 '''
 
+#
+# the wire capture file is a sequence of records : a header ( the monotonic time in ns ,
+# the direction -- 'o' for outgoing, 'i' for incoming data -- and the length ) plus the data
+#
+
+CAPTURE_MAGIC = 'EGICAP01'
+_CAPTURE_RECORD = struct.Struct( '=qcL' )
+
+
+def load_capture( path ) :
+    """ read a capture file written by Socket.dump_capture() ; returns a list of ( ns time, direction, data ) """
+
+    records = []
+
+    with open( path, 'rb' ) as f :
+
+        if f.read( len( CAPTURE_MAGIC ) ) != CAPTURE_MAGIC :
+            raise ValueError( "'%s' is not a capture file" % ( path, ) )
+
+        while True :
+
+            header = f.read( _CAPTURE_RECORD.size )
+            if len( header ) < _CAPTURE_RECORD.size :
+                break
+
+            t_ns, direction, length = _CAPTURE_RECORD.unpack( header )
+            records.append( ( t_ns, direction, f.read( length ) ) )
+
+    return records
+
+
+def save_capture( path, records ) :
+    """ write ( ns time, direction, data ) records to a capture file ( see load_capture() ) ; returns their number """
+
+    n = 0
+
+    with open( path, 'wb' ) as f :
+
+        f.write( CAPTURE_MAGIC )
+        for t_ns, direction, data in records :
+            f.write( _CAPTURE_RECORD.pack( t_ns, direction, len( data ) ) )
+            f.write( data )
+            n += 1
+
+    return n
+
+
+# the default deadline for connecting and for every read or write, in seconds
+DEFAULT_TIMEOUT = 2
+
+# the errors meaning "try again later" for a non-blocking socket
+_WOULD_BLOCK = ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR )
+
+
+class _Poller :
+    """ wait until the socket is readable / writable -- but not longer than the given time """
+
+    def __init__( self, fd ) :
+
+        self._fd = fd
+
+        if hasattr( select, 'poll' ) :
+
+            self._poll_in = select.poll()
+            self._poll_in.register( fd, select.POLLIN | select.POLLERR | select.POLLHUP )
+
+            self._poll_out = select.poll()
+            self._poll_out.register( fd, select.POLLOUT | select.POLLERR | select.POLLHUP )
+
+        else :
+
+            self._poll_in = self._poll_out = None
+
+    def wait( self, b_write, seconds ) :
+        """ returns True if the socket is ready ( or in an error state ) , False on timeout """
+
+        if seconds < 0 :
+            seconds = 0
+
+        if self._poll_in is not None :
+
+            poll = self._poll_out if b_write else self._poll_in
+
+            # poll() takes milliseconds ; round up so that we never spin on a zero timeout
+            return len( poll.poll( int( seconds * 1000 + 0.999 ) ) ) > 0
+
+        if b_write :
+            r, w, x = select.select( [], [ self._fd ], [ self._fd ], seconds )
+        else :
+            r, w, x = select.select( [ self._fd ], [], [ self._fd ], seconds )
+
+        return bool( r or w or x )
+
+
+def _seconds_monotonic() :
+
+    return ns_monotonic() * 1e-9
+
+
 class Socket :
-    """ wrap the socket() class """
+    """ wrap the socket() class ( a non-blocking socket with a deadline for every operation ) """
+
+    # the capture ring buffer is off by default ( see enable_capture() )
+    _capture = None
+    _capture_path = None
+
+    # the writes are not held back by default ( see cork() )
+    _corked = 0
+
+    ## -----------------------------------------------------------
+
+    def enable_capture( self, n_records = 4096, dump_path = None ) :
+        """
+            start recording every chunk written to and read from the socket
+            ( tagged with the direction and a monotonic time in ns )
+            in a ring buffer of the last 'n_records' chunks ;
+
+            if 'dump_path' is given, the buffer is dumped there when a read or a write fails .
+        """
+
+        self._capture = deque( maxlen = n_records )
+        self._capture_path = dump_path
+
+    def disable_capture( self ) :
+        """ stop recording and drop the ring buffer """
+
+        self._capture = None
+        self._capture_path = None
+
+    def captured( self ) :
+        """ a copy of the ring buffer contents : a list of ( ns time, direction, data ) , the oldest first """
+
+        if self._capture is None :
+            return []
+
+        return list( self._capture )
+
+    def dump_capture( self, path = None ) :
+        """ write the ring buffer to a file ( see load_capture() ) ; returns the number of records written """
+
+        if path is None :
+            path = self._capture_path
+
+        return save_capture( path, self.captured() )
+
+    def _dump_on_error( self ) :
+        """ keep the last moments before a failure , but do not hide the original exception """
+
+        if self._capture is not None and self._capture_path is not None :
+            try :
+                self.dump_capture()
+            except EnvironmentError :
+                pass
+
+    ## -----------------------------------------------------------
 
-    def connect( self, str_address, port_no ):
-        """ connect to the given host at the specified port ) """
+    def connect( self, str_address, port_no, seconds_timeout = DEFAULT_TIMEOUT ):
+        """ connect to the given host at the specified port ) ; returns the exception in the case of failure """
 
         #
         # todo: create our own exception to handle stuff properly     
@@ -29,45 +192,239 @@ class Socket :
 
         self._socket = socket.socket( socket.AF_INET, # IP_V4
                                       socket.SOCK_STREAM )
-        self._socket.settimeout(2)
+        self._socket.settimeout( seconds_timeout )
         try:
             self._socket.connect(  ( str_address, port_no )  )
-        except socket.error as e:
-            return e
         except socket.timeout as e:
             return e
+        except socket.error as e:
+            return e
         else:
-            ## self._connection = self._socket.makefile('rw', 0) # read and write, no internal buffer
-            self._connection = self._socket.makefile('rwb', 0) # read and write, no internal buffer
+            # from now on every operation is non-blocking and waits with poll() ( or select() )
+            self._socket.setblocking( 0 )
+
+            # the messages are small and we wait for the replies -- do not let Nagle's algorithm hold them
+            self._socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+            self._poller = _Poller( self._socket.fileno() )
+            self._seconds_timeout = seconds_timeout
+
+            self._corked = 0
+            self._cork_buf = []
             return None
 
     def disconnect( self ):
         """ close the connection """
 
-        self._connection.close()     
-
-        # is this also nessesary?     
         self._socket.close()
 
-        del self._connection     
+        del self._poller
         del self._socket     
 
-    def write( self, data ) :
-        """ write to the socket -- the socket must be opened """
+    def fileno( self ) :
+        """ the socket descriptor, to watch it from an external event loop """
 
-        self._connection.write( data )     
-        ## self._connection.flush( data )     
+        return self._socket.fileno()
 
+    ## -----------------------------------------------------------
 
-    def read( self, size = -1 ) :
-        """ read from the socket; warning -- it blocks on reading! """
+    def _deadline( self, seconds_timeout ) :
 
-        if size < 0 :
+        if seconds_timeout is None :
+            seconds_timeout = self._seconds_timeout
 
-            return self._connection.read()
+        return _seconds_monotonic() + seconds_timeout
 
-        else :
+    def _send_all( self, data, deadline ) :
+        """ send the data completely, resuming after the partial writes , until the deadline """
 
-            return self._connection.read( size )     
+        view = memoryview( data )
+        sent = 0
+        total = len( data )
 
-    
+        while sent < total :
+
+            try :
+                sent += self._socket.send( view[ sent : ] )
+                continue
+            except socket.error as e :
+                if e.args[0] not in _WOULD_BLOCK :
+                    raise
+
+            if not self._poller.wait( True, deadline - _seconds_monotonic() ) :
+                raise socket.timeout( "write timed out (%d of %d bytes sent)" % ( sent, total ) )
+
+    def _recv( self, size, deadline ) :
+        """ receive up to 'size' bytes, waiting for them until the deadline ; None on timeout """
+
+        while True :
+
+            try :
+                data = self._socket.recv( size )
+            except socket.error as e :
+                if e.args[0] not in _WOULD_BLOCK :
+                    raise
+            else :
+                if not data :
+                    raise socket.error( errno.ECONNRESET, "the connection was closed by the other side" )
+                return data
+
+            if not self._poller.wait( False, deadline - _seconds_monotonic() ) :
+                return None
+
+    ## -----------------------------------------------------------
+
+    def cork( self ) :
+        """
+            hold the following writes back in a buffer until the matching uncork() ,
+            so that related messages leave in one send() call ( and in one TCP segment ,
+            if they fit ) ; the calls can be nested .
+        """
+
+        self._corked += 1
+
+    def uncork( self, seconds_timeout = None ) :
+        """ the pair of cork() : sends everything held back when the outermost pair is closed """
+
+        if self._corked <= 0 :
+            return
+
+        self._corked -= 1
+
+        if self._corked == 0 :
+            self.flush( seconds_timeout )
+
+    @contextmanager
+    def corked( self, seconds_timeout = None ) :
+        """
+            cork() / uncork() as a 'with' block ; if the block raises , what it has written
+            is dropped ( the messages before it would get the replies for a half of the group )
+        """
+
+        n_held = len( self._cork_buf )
+
+        self.cork()
+        try :
+            yield self
+        except :
+            del self._cork_buf[ n_held : ]
+            self.uncork( seconds_timeout )
+            raise
+
+        self.uncork( seconds_timeout )
+
+    def flush( self, seconds_timeout = None ) :
+        """ send everything held back by cork() right now """
+
+        if not self._cork_buf :
+            return
+
+        held = self._cork_buf
+        self._cork_buf = []
+
+        self._write( ''.join(  data for data, seq in held  ), seconds_timeout, held )
+
+    def write( self, data, seconds_timeout = None ) :
+        """
+            write to the socket -- the socket must be opened ;
+            the data are sent completely or socket.timeout is raised after 'seconds_timeout'
+            ( the connect() timeout by default ) ; between cork() and uncork() the data are only buffered .
+        """
+
+        if self._corked :
+            # the command is known now , not at the flush
+            self._cork_buf.append(  ( data, trace.current() if trace.enabled else None )  )
+            return
+
+        self._write( data, seconds_timeout )
+
+    def _write( self, data, seconds_timeout, held = None ) :
+        """ 'held' -- the ( message, seq ) pairs 'data' is made of , when flushed : a tracepoint for every one """
+
+        if _TP_WRITE_START.hooks :
+            for message, seq in held or ( ( data, None ), ) :
+                _TP_WRITE_START.fire( message[:1], seq )
+
+        if self._capture is not None :
+            self._capture.append( ( ns_monotonic(), 'o', data ) )
+
+        try :
+            self._send_all( data, self._deadline( seconds_timeout ) )
+        except :
+            self._dump_on_error()
+            raise
+
+        if _TP_WRITE_END.hooks :
+            for message, seq in held or ( ( data, None ), ) :
+                _TP_WRITE_END.fire( message[:1], seq )
+
+
+    def read( self, size = -1, seconds_timeout = None ) :
+        """
+            read exactly 'size' bytes from the socket ( or everything until the connection is closed
+            if 'size' is negative ) ; raises socket.timeout if they do not arrive within 'seconds_timeout'
+            ( the connect() timeout by default )
+        """
+
+        deadline = self._deadline( seconds_timeout )
+
+        chunks = []
+        n = 0
+
+        try :
+
+            while size < 0 or n < size :
+
+                try :
+                    chunk = self._recv( 4096 if size < 0 else size - n, deadline )
+                except socket.error as e :
+                    if size < 0 and e.args[0] == errno.ECONNRESET :
+                        break
+                    raise
+
+                if chunk is None :
+                    raise socket.timeout( "read timed out (%d of %d bytes received)" % ( n, size ) )
+
+                chunks.append( chunk )
+                n += len( chunk )
+
+        except :
+            self._dump_on_error()
+            raise
+
+        data = ''.join( chunks )
+
+        if self._capture is not None :
+            self._capture.append( ( ns_monotonic(), 'i', data ) )
+
+        return data
+
+    def read_available( self, seconds_timeout = 0 ) :
+        """
+            read whatever has already arrived, waiting for the first bytes at most 'seconds_timeout' ;
+            returns an empty string if there is nothing to read
+        """
+
+        deadline = _seconds_monotonic() + seconds_timeout
+
+        chunks = []
+
+        try :
+
+            chunk = self._recv( 4096, deadline )
+            while chunk is not None :
+                chunks.append( chunk )
+                if len( chunk ) < 4096 :
+                    break
+                chunk = self._recv( 4096, 0 ) # the deadline has passed : do not wait
+
+        except :
+            self._dump_on_error()
+            raise
+
+        data = ''.join( chunks )
+
+        if data and self._capture is not None :
+            self._capture.append( ( ns_monotonic(), 'i', data ) )
+
+        return data
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" the wire capture of socket_wrapper.py ( through simple.Netstation , against the local stand-in ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import tempfile
+import os
+
+from socket_wrapper import load_capture
+from harness import StandIn
+import decoder
+import simple
+
+
+class CaptureTest( unittest.TestCase ) :
+
+    def setUp( self ) :
+
+        self.stand_in = StandIn()
+
+        self.ns = simple.Netstation()
+        self.ns.connect( '127.0.0.1', self.stand_in.port )
+        self.ns.BeginSession()
+
+    def tearDown( self ) :
+
+        self.ns.disconnect()
+        self.stand_in.arrivals()
+
+    def test_ring_buffer( self ) :
+
+        self.ns.enable_capture( n_records = 4 )
+
+        for i in xrange( 5 ) :
+            self.ns.send_event( 'stim', 1000 + i )
+
+        records = self.ns._socket.captured()
+
+        # the last two events and their replies
+        self.assertEqual(  [ direction for t_ns, direction, data in records ], [ 'o', 'i', 'o', 'i' ]  )
+        self.assertEqual(  [ e.timestamp for e in decoder.decode( records[0][2] + records[2][2] ) ], [ 1003, 1004 ]  )
+
+        times = [  t_ns  for t_ns, direction, data in records  ]
+        self.assertEqual( times, sorted( times ) )
+
+    def test_dump( self ) :
+
+        fd, path = tempfile.mkstemp( '.capture' )
+        os.close( fd )
+
+        try :
+
+            self.ns.enable_capture( dump_path = path )
+            self.ns.send_event( 'stim', 1000 )
+
+            self.assertEqual( self.ns.dump_capture(), 2 )
+            self.assertEqual( load_capture( path ), self.ns._socket.captured() )
+
+        finally :
+            os.remove( path )
+
+    def test_not_a_capture( self ) :
+
+        fd, path = tempfile.mkstemp( '.capture' )
+        os.write( fd, 'something else' )
+        os.close( fd )
+
+        try :
+            self.assertRaises( ValueError, load_capture, path )
+        finally :
+            os.remove( path )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
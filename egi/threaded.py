@@ -12,6 +12,11 @@
 
 import simple as internal # Netstation object, mostly     
 from socket_wrapper import Socket     
+from clock import ns_monotonic
+import queues
+import log # the diagnostic output
+from trace import QUEUE_PUT as _TP_QUEUE_PUT, QUEUE_GET as _TP_QUEUE_GET
+import trace # the command sequence numbers
 
 #
 # "forward" these names to be used from outside     
@@ -20,6 +25,17 @@ from socket_wrapper import Socket
 Error = internal.Eggog     
 ms_localtime = internal.ms_localtime     
 
+_log = log.get_logger( 'threaded' )
+
+# the priority classes of the commands ( see queues.py )
+CRITICAL, NORMAL, BULK = queues.CRITICAL, queues.NORMAL, queues.BULK
+
+# the default bound of the commands and the replies queues
+DEFAULT_CAPACITY = 4096
+
+# how often ( s ) the idle 'postman' reads the replies to the events sent without waiting
+ACK_POLL_INTERVAL = 0.05
+
 #
 # the name(s) to be used internally     
 #
@@ -32,10 +48,30 @@ ms_localtime = internal.ms_localtime
 
 # -----------------------------------------------------------------------------
 
-from threading import Thread     
-from Queue import Queue
+from threading import Thread, Condition
+from collections import namedtuple, deque
 
 import time # time() for 'soft timeouts'     
+import sys
+import heapq
+
+# -----------------------------------------------------------------------------
+
+# the scheduler sleeps until this many ms before the dispatch moment and spins the rest ;
+# sleep() on Windows may be late by the whole system timer tick ( ~15.6 ms )
+DEFAULT_SPIN_MS = 16 if sys.platform == 'win32' else 2
+
+# how many ms before its onset a scheduled event is sent by default : the 'postman' may be busy
+# with the message before it ( the classes only reorder the queue ) ; the event is placed by its timestamp
+DEFAULT_LEAD_MS = 20
+
+# what is put in the 'received' queue for every scheduled event :
+# 'error_ms' is ( the moment the message was written to the socket ) - ( the moment it was due ) ,
+# 'reply' is what send_encoded() has returned -- None, the ack is counted later ( see count_acks() )
+Dispatch = namedtuple( 'Dispatch', 'key at error_ms reply' )
+
+# how many of the last ( key, at, error_ms ) the scheduler keeps ( see dispatch_errors() )
+DISPATCH_HISTORY = 4096
 
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -63,6 +99,9 @@ class _Command :
         self._func_name = method_name     
         self._kwargs = kwargs
 
+        # the sequence number ( see trace.py ) , given when the command is queued
+        self.seq = None
+
     # (2) " unpacking " :     
 
     def name( self ) :
@@ -103,6 +142,32 @@ class _Command :
         return self.call( obj, self.name(), self.kwargs() )
         
     
+class _Scheduled( _Command ) :
+    """ a pre-encoded event put in the 'to_send' queue by the scheduler when it is due """
+
+    def __init__( self, key, at, message, ns_due, errors, seq = None ) :
+
+        # not waiting for the ack : the next due event must not queue behind the round trip
+        _Command.__init__( self, 'send_encoded', { 'message' : message, 'b_wait' : False } )
+
+        self.seq = seq # given by schedule_event()
+
+        self._key = key
+        self._at = at
+        self._ns_due = ns_due
+        self._errors = errors # the scheduler's deque of ( key, at, error_ms )
+
+    def invoke( self, obj ) :
+        """ send the message ( noting how late it was written ) and return the Dispatch record """
+
+        reply = _Command.invoke( self, obj )
+
+        # the moment of the write , not of the reply
+        error_ms = ( obj._ns_last_encoded_write - self._ns_due ) * 1e-6
+
+        self._errors.append( ( self._key, self._at, error_ms ) )
+
+        return Dispatch( self._key, self._at, error_ms, reply )
         
 
 # -----------------------------------------------------------------------------
@@ -139,11 +204,41 @@ class _NetstationThread( Thread ) :
     def _process( self, packet ) :     
         """ pass the received information to internal 'netstation' object to make a method call """
 
+        if trace.enabled :
+            # the tracepoints of the call are of the command as it was queued
+            with trace.command( packet.seq ) :
+                return packet.invoke( self._netstation_object )
+
         return packet.invoke( self._netstation_object )
         
 
     ## -----------------------------------------------------------
 
+    def _get_packet( self ) :
+        """ the next command ; while the replies to the events sent without waiting are due, collect them meanwhile """
+
+        while self._netstation_object.pending_acks() :
+
+            try :
+                return self._to_send.get( timeout = ACK_POLL_INTERVAL )
+            except queues.Empty :
+                self._collect_acks()
+
+        return self._to_send.get()
+
+    def _collect_acks( self ) :
+        """
+            count the replies to the events sent without waiting ( see simple.Netstation.poll_acks() ) --
+            -- otherwise they pile up in the netstation object
+        """
+
+        obj = self._netstation_object
+
+        if obj._acks or obj.pending_acks() :
+            self._received.count_acks( obj.poll_acks() )
+
+    ## -----------------------------------------------------------
+
     def run( self ) :     
 
         # # debug
@@ -151,7 +246,13 @@ class _NetstationThread( Thread ) :
 
         while True :     
 
-            packet = self._to_send.get()     
+            packet = self._get_packet()
+
+            if _TP_QUEUE_GET.hooks :
+                if packet is None :
+                    _TP_QUEUE_GET.fire( None )
+                else :
+                    _TP_QUEUE_GET.fire( packet.name(), packet.seq )
 
             if self.is_end_marker( packet ) :
 
@@ -168,9 +269,16 @@ class _NetstationThread( Thread ) :
             # we could change the packet format and add some timestamps and/or packet numbers ...     
             # 
 
-            ret = self._process( packet )
+            try :
+                ret = self._process( packet )
+            except Exception as e :
+                # keep going : the error is counted and kept as the result ( see ResultRing )
+                _log.error( "%s() failed : %s", packet.name(), e )
+                ret = e
+
+            self._received.put( ret, packet.name() ) # also could have added the input timestamp, output timestamp and the packet number     
 
-            self._received.put( ret ) # also could have added the input timestamp, output timestamp and the packet number     
+            self._collect_acks()
 
 
         # # debug
@@ -182,10 +290,10 @@ class _NetstationThread( Thread ) :
     # let's call the 'self._netstation_object.connect()' method directly     
     #
 
-    def connect( self, str_address, port_no ) :
+    def connect( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT ) :
         """ "forward" this method to the inner 'netstation' object """
 
-        return self._netstation_object.connect( str_address, port_no )     
+        return self._netstation_object.connect( str_address, port_no, seconds_timeout )
         
     
     def _disconnect( self ) :
@@ -195,6 +303,114 @@ class _NetstationThread( Thread ) :
         
     
 
+# -----------------------------------------------------------------------------
+
+class _SchedulerThread( Thread ) :
+
+    """
+        keeps the scheduled events in a heap and hands each of them to the 'postman' thread
+        at its dispatch moment : sleeps until 'spin_ms' before it, then spins on the clock .
+    """
+
+    def __init__( self, to_send, spin_ms = DEFAULT_SPIN_MS ) :
+
+        Thread.__init__( self )
+
+        self.setName( "Netstation Scheduler" )
+        self.setDaemon( True ) # the pending events are cancelled anyway
+
+        self._to_send = to_send
+        self._ns_spin = int( spin_ms * 1000000 )
+
+        self._cond = Condition()
+        self._heap = [] # ( ns_due, seqno, key, at, message, seq )
+        self._seqno = 0
+        self._b_stop = False
+
+        self._errors = deque( maxlen = DISPATCH_HISTORY )
+
+    ## -----------------------------------------------------------
+
+    def schedule( self, ns_due, key, at, message, seq = None ) :
+        """ add the event ; it is sent at the monotonic time 'ns_due' ( 'seq' -- its command sequence number ) """
+
+        with self._cond :
+
+            self._seqno += 1
+            heapq.heappush( self._heap, ( ns_due, self._seqno, key, at, message, seq ) )
+
+            # the new one may be due earlier than the one we are sleeping for
+            self._cond.notify()
+
+    def cancel( self ) :
+        """ drop all the events not dispatched yet ; returns their number """
+
+        with self._cond :
+
+            n = len( self._heap )
+            del self._heap[:]
+
+            self._cond.notify()
+
+        return n
+
+    def stop( self ) :
+        """ cancel the pending events and let the thread finish ; returns the number of the cancelled ones """
+
+        with self._cond :
+
+            self._b_stop = True
+            n = len( self._heap )
+            del self._heap[:]
+
+            self._cond.notify()
+
+        return n
+
+    def pending( self ) :
+        """ the number of events waiting for their time """
+
+        return len( self._heap )
+
+    def errors( self ) :
+        """ the list of ( key, at, error_ms ) of the last DISPATCH_HISTORY sent events """
+
+        return list( self._errors )
+
+    ## -----------------------------------------------------------
+
+    def run( self ) :
+
+        while True :
+
+            with self._cond :
+
+                if self._b_stop :
+                    break
+
+                if not self._heap :
+                    self._cond.wait()
+                    continue
+
+                ns_due = self._heap[0][0]
+                ns_left = ns_due - ns_monotonic()
+
+                if ns_left > self._ns_spin :
+                    # sleep, but wake up early to spin the rest
+                    self._cond.wait( ( ns_left - self._ns_spin ) * 1e-9 )
+                    continue
+
+                ns_due, seqno, key, at, message, seq = heapq.heappop( self._heap )
+
+            # spin ( without holding the lock ) -- this is where the precision comes from
+            while ns_monotonic() < ns_due :
+                pass
+
+            if _TP_QUEUE_PUT.hooks : _TP_QUEUE_PUT.fire( 'send_encoded', seq )
+
+            self._to_send.put( _Scheduled( key, at, message, ns_due, self._errors, seq ), CRITICAL )
+
+
 # -----------------------------------------------------------------------------
 
 #
@@ -213,19 +429,52 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
-    def __init__( self ) :
+    def __init__( self, spin_ms = DEFAULT_SPIN_MS, max_wait_ms = queues.DEFAULT_MAX_WAIT_MS,
+                        capacity = DEFAULT_CAPACITY, policy = 'block', seconds_timeout = internal.DEFAULT_TIMEOUT,
+                        results_capacity = DEFAULT_CAPACITY, results_policy = 'drop_oldest' ) :
+        """
+            'max_wait_ms' : per class, how long a command may wait before it may go ahead of the higher ( not critical ) classes ;
+            'capacity', 'policy', 'seconds_timeout' : the bound of the commands queue and what to do
+                                                      when it is full ( see queues.py ) ;
+            'results_capacity', 'results_policy' : the same for the results nobody may be reading
+                                                   ( the ring of the last ones, see results_summary() ) .
+        """
 
-        self._to_send = Queue()
-        self._to_receive = Queue()     
+        self._to_send = queues.ClassQueue( max_wait_ms, capacity, policy, seconds_timeout )
+        self._to_receive = queues.ResultRing( results_capacity, results_policy )
 
         self._netstation_thread = _NetstationThread( self._to_send, self._to_receive )     
 
+        # started with the first schedule_event()
+        self._spin_ms = spin_ms
+        self._scheduler = None
+
+        # the scheduled events are packed in the calling thread , so they need their own encoder
+        self._data_fmt = internal._DataFormat()
+
     ## -----------------------------------------------------------
 
-    def _put( self, data ) :
-        """ a shortcut to put sth in the 'to-send' queue """
+    def _put( self, data, priority = None ) :
+        """
+            a shortcut to put sth in the 'to-send' queue ( by default, in the class of the command ) ;
+            returns False if the queue is full and the command has been dropped .
+        """
 
-        self._to_send.put( data )
+        if data is None : # the end marker
+            return self._to_send.put( None )
+
+        name = data.name()
+
+        # the command enters here : its number goes along with it to the 'postman'
+        if data.seq is None :
+            data.seq = trace.next_seq()
+
+        if _TP_QUEUE_PUT.hooks : _TP_QUEUE_PUT.fire( name, data.seq )
+
+        if priority is None :
+            priority = queues.command_class( name )
+
+        return self._to_send.put( data, priority, queues.is_barrier( name ) )
 
         # return None     
     
@@ -272,6 +521,42 @@ class Netstation :
     ## -----------------------------------------------------------
 
 
+    def wait_stats( self ) :
+        """ { class name : ( count, mean ms, max ms ) } -- how long the commands have waited for the 'postman' """
+
+        return self._to_send.wait_stats()
+
+    def ms_now( self ) :
+        """ the current time in ms as the 'postman' would send it ( see simple.Netstation.ms_now() ) """
+
+        return self._netstation_thread._netstation_object.ms_now()
+
+    def timeline( self ) :
+        """ the timeline.Timeline object of the connection """
+
+        return self._netstation_thread._netstation_object.timeline()
+
+    def results_summary( self ) :
+        """
+            the counters of the results over the whole session ( the results themselves are kept
+            only for the last 'results_capacity' commands ) -- see queues.ResultRing.summary()
+        """
+
+        return self._to_receive.summary()
+
+    def last_error( self ) :
+        """ ( time.time(), the command name, the error ) of the last failed command , or None """
+
+        return self._to_receive.summary()[ 'last_error' ]
+
+    def queue_counters( self ) :
+        """ { 'to_send' / 'received' : the drops, blocks etc. of the queue ( see queues.ClassQueue.counters() ) } """
+
+        return { 'to_send' : self._to_send.counters(), 'received' : self._to_receive.counters() }
+
+    ## -----------------------------------------------------------
+
+
     def _ns_thread_is_running( self ) :
         """ returns True if our 'postman' thread is stil busy with doing something """
 
@@ -311,8 +596,33 @@ class Netstation :
 
         # return None     
 
+    def start( self, str_address, port_no, seconds_timeout = internal.DEFAULT_TIMEOUT, b_record = True ) :
+        """
+            open the socket ( raising the error if it fails within 'seconds_timeout' ) ,
+            start the 'Mr. Postman' thread and queue the pipelined start_session() ;
+            its timings ( see simple.Netstation.start_session() ) are put in the 'received' queue .
+        """
+
+        error = self._netstation_thread.connect( str_address, port_no, seconds_timeout )
+        if error is not None :
+            raise error
+
+        self._netstation_thread.start()
+
+        self.start_session( b_record )
+
+    def start_session( self, b_record = True ) :
+        """ queue BeginSession, sync and StartRecording as one pipelined write """
+
+        packet = _Command( 'start_session', { 'b_record' : b_record } )
+        self._put( packet )
+
     def finalize( self, seconds_timeout = 2 ) :
-        """ send the thread the 'Done' message and wait until it finishes """
+        """ send the thread the 'Done' message and wait until it finishes ( the events still scheduled are cancelled ) """
+
+        if self._scheduler is not None :
+            self._scheduler.stop()
+            self._scheduler.join()
 
         self._put( None )
 
@@ -324,8 +634,7 @@ class Netstation :
             
             self.process_responces()
 
-        # debug
-        print " egi: stopping ... "
+        _log.info( "egi: stopping ..." )
 
         ## self._disconnect()     
 
@@ -401,14 +710,66 @@ class Netstation :
 
         # TODO/todo : change the code so that we'll wait for the result in the calling thread     
 
-        packet = _Command( 'sync', { 'timestamp' : timestamp } )     
-        self._put( packet )     
-    
+        packet = _Command( 'sync', { 'timestamp' : timestamp } )
+        self._put( packet )
+
+    ## -----------------------------------------------------------
+
+    def set_event_budget( self, budget = internal.DEFAULT_EVENT_BUDGET, warn_at = ( 0.75, 0.9 ), on_exhausted = 'warn' ) :
+        """ configure the per-session event accounting ( see simple.Netstation.set_event_budget() ) """
+
+        packet = _Command( 'set_event_budget', { 'budget' : budget, 'warn_at' : warn_at, 'on_exhausted' : on_exhausted } )
+        self._put( packet )
+
+    def events_sent( self ) :
+        """ the number of events the 'postman' has sent since the session has started """
+
+        return self._netstation_thread._netstation_object.events_sent()
+
+    def events_left( self ) :
+        """ the number of events left in the session budget ( the queued ones are not counted yet ) """
+
+        return self._netstation_thread._netstation_object.events_left()
+
+    def set_value_cache_size( self, cache_size = internal.DEFAULT_VALUE_CACHE_SIZE ) :
+        """ queue the resizing of the encoded values cache ( see simple.Netstation.set_value_cache_size() ) """
+
+        packet = _Command( 'set_value_cache_size', { 'cache_size' : cache_size } )
+        self._put( packet )
+
+    def enable_event_log( self, export_path = None ) :
+        """ queue turning the event log of the 'postman' on ( see simple.Netstation.enable_event_log() ) """
+
+        packet = _Command( 'enable_event_log', { 'export_path' : export_path } )
+        self._put( packet )
+
+    def event_log( self ) :
+        """ the eventlog.EventLog of the 'postman' ( None until the command above is processed ) """
+
+        return self._netstation_thread._netstation_object.event_log()
+
+    def value_cache_stats( self ) :
+        """ the counters of the encoded values cache of the 'postman' """
+
+        return self._netstation_thread._netstation_object.value_cache_stats()
+
+    def rollover( self, b_record = True ) :
+        """ queue a session rollover ; the time it took is put in the 'received' queue """
+
+        packet = _Command( 'rollover', { 'b_record' : b_record } )
+        self._put( packet )
+
+    def rollover_if_needed( self, fraction = 0.9, b_record = True ) :
+        """ queue a conditional session rollover ( checked when the 'postman' gets to it ) """
+
+        packet = _Command( 'rollover_if_needed', { 'fraction' : fraction, 'b_record' : b_record } )
+        self._put( packet )
+
     ## -----------------------------------------------------------
 
     # send_event, send_simple_event
 
-    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False ) :     
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False, schema = None, priority = NORMAL ) :     
         """
             Send an event ; note that before sending any events a sync() has to be called
             to make the sent events effective .     
@@ -425,8 +786,13 @@ class Netstation :
             -- 'table' -- a standart Python dictionary, where keys are 4-byte identifiers,
                           not more than 256 in total ;
                           there are no special conditions on the values,
-                          but the size of every value entry in bytes should not exceed 2 ^ 16 .     
-                          
+                          but the size of every value entry in bytes should not exceed 2 ^ 16 .
+            -- 'schema' -- an optional EventSchema the 'table' follows ( then the table can also be
+                           a sequence of the values in the order of the schema ) .
+            -- 'priority' -- CRITICAL for the stimulus markers, BULK for the annotations that can wait .
+
+            Returns False if the queue is full and the event has been dropped ( see __init__() ) .
+
             Note A: due to peculiarity of the implementation, our particular version of NetStation
                     was not able to record more than 2^15 events per session .
                     
@@ -434,6 +800,9 @@ class Netstation :
             
         """     
         
+        # stamped in the calling thread ( the timeline needs no lock ) , not when the 'postman' gets to it
+        if timestamp is None :
+            timestamp = self.ms_now()
         
         kwargs = {                             \
                    'key'         : key         ,
@@ -441,11 +810,84 @@ class Netstation :
                    'label'       : label       ,
                    'description' : description ,
                    'table'       : table       ,
-                   'pad'         : pad         \
+                   'pad'         : pad         ,
+                   'schema'      : schema      \
                 }     
 
         packet = _Command( 'send_event', kwargs )     
-        self._put( packet )     
+        return self._put( packet, priority )     
+
+    def send_encoded( self, message, b_wait = True, priority = CRITICAL ) :
+        """
+            queue an event already packed by _DataFormat.pack() ( see simple.Netstation.send_encoded() ) ;
+            these are usually the time-critical ones ( say, the flip markers ) , hence the default class .
+        """
+
+        packet = _Command( 'send_encoded', { 'message' : message, 'b_wait' : b_wait } )
+        return self._put( packet, priority )
+
+    ## -----------------------------------------------------------
+
+    def schedule_event( self, key, at, label = None, description = None, table = None, pad = False, schema = None, lead_ms = DEFAULT_LEAD_MS ) :
+        """
+            Send an event with a known onset : 'at' is the onset time in ms_now() units
+            and goes into the event timestamp , the event is packed now and sent 'lead_ms' before it
+            ( the lead takes the 'postman' and the network off the critical path -- Netstation places
+            the event by its timestamp, not by its arrival ; 0 sends it exactly at 'at' ) .
+
+            The rest of the arguments are the same as for send_event() .
+
+            For every sent event a Dispatch( key, at, error_ms, reply ) record is put in the 'received'
+            queue, 'error_ms' being how late the message was written to the socket ( see also dispatch_errors() ) ;
+            the acks are not waited for, but counted as those of send_event( b_wait = False ) .
+        """
+
+        timeline = self.timeline()
+
+        # 'at' may have been taken before a rebase ( the message is re-stamped anyway if one comes before the dispatch )
+        wire_at = timeline.current_ms( at )
+
+        # the command enters here , the packing is its first tracepoint
+        seq = trace.next_seq()
+
+        if trace.enabled :
+            with trace.command( seq ) :
+                message = self._data_fmt.pack( key, wire_at, label, description, table, pad, schema )
+        else :
+            message = self._data_fmt.pack( key, wire_at, label, description, table, pad, schema )
+
+        # to the monotonic clock , so the wall clock adjustments ( and the rebases ) do not move the dispatch
+        ns_due = timeline.ns_at( wire_at - lead_ms )
+
+        if self._scheduler is None :
+            self._scheduler = _SchedulerThread( self._to_send, self._spin_ms )
+            self._scheduler.start()
+
+        self._scheduler.schedule( ns_due, key, at, message, seq )
+
+    def cancel_scheduled( self ) :
+        """ drop the scheduled events not sent yet ; returns their number """
+
+        if self._scheduler is None :
+            return 0
+
+        return self._scheduler.cancel()
+
+    def scheduled_pending( self ) :
+        """ the number of scheduled events waiting for their time """
+
+        if self._scheduler is None :
+            return 0
+
+        return self._scheduler.pending()
+
+    def dispatch_errors( self ) :
+        """ the list of ( key, at, error_ms ) for the last DISPATCH_HISTORY scheduled events sent """
+
+        if self._scheduler is None :
+            return []
+
+        return self._scheduler.errors()
         
     
     ## -----------------------------------------------------------
@@ -18,6 +18,9 @@
 
 import simple as internal # Netstation object, mostly     
 from socket_wrapper import Socket     
+import queues
+import log # the diagnostic output
+import trace # the command sequence numbers
 
 #
 # "forward" these names to be used from outside     
@@ -26,6 +29,17 @@ from socket_wrapper import Socket
 Error = internal.Eggog     
 ms_localtime = internal.ms_localtime     
 
+_log = log.get_logger( 'threaded_alt' )
+
+# the priority classes of the commands ( see queues.py )
+CRITICAL, NORMAL, BULK = queues.CRITICAL, queues.NORMAL, queues.BULK
+
+# the default bound of the commands and the replies queues
+DEFAULT_CAPACITY = 4096
+
+# how often ( s ) the idle 'postman' reads the replies to the events sent without waiting
+ACK_POLL_INTERVAL = 0.05
+
 #
 # the name(s) to be used internally     
 #
@@ -39,7 +53,6 @@ from StringIO import StringIO
 # -----------------------------------------------------------------------------
 
 from threading import Thread     
-from Queue import Queue
 
 import time # time() for 'soft timeouts'     
 
@@ -69,6 +82,9 @@ class _Command :
         self._func_name = method_name     
         self._kwargs = kwargs
 
+        # the sequence number ( see trace.py ) , given when the command is queued
+        self.seq = None
+
     # (2) " unpacking " :     
 
     def name( self ) :
@@ -145,11 +161,41 @@ class _NetstationThread( Thread ) :
     def _process( self, packet ) :     
         """ pass the received information to internal 'netstation' object to make a method call """
 
+        if trace.enabled :
+            # the tracepoints of the call are of the command as it was queued
+            with trace.command( packet.seq ) :
+                return packet.invoke( self._netstation_object )
+
         return packet.invoke( self._netstation_object )
         
 
     ## -----------------------------------------------------------
 
+    def _get_packet( self ) :
+        """ the next command ; while the replies to the events sent without waiting are due, collect them meanwhile """
+
+        while self._netstation_object.pending_acks() :
+
+            try :
+                return self._to_send.get( timeout = ACK_POLL_INTERVAL )
+            except queues.Empty :
+                self._collect_acks()
+
+        return self._to_send.get()
+
+    def _collect_acks( self ) :
+        """
+            count the replies to the events sent without waiting ( see simple.Netstation.poll_acks() ) --
+            -- otherwise they pile up in the netstation object
+        """
+
+        obj = self._netstation_object
+
+        if obj._acks or obj.pending_acks() :
+            self._received.count_acks( obj.poll_acks() )
+
+    ## -----------------------------------------------------------
+
     def run( self ) :     
 
         # # debug
@@ -157,7 +203,7 @@ class _NetstationThread( Thread ) :
 
         while True :     
 
-            packet = self._to_send.get()     
+            packet = self._get_packet()
 
             if self.is_end_marker( packet ) :
 
@@ -174,9 +220,16 @@ class _NetstationThread( Thread ) :
             # we could change the packet format and add some timestamps and/or packet numbers ...     
             # 
 
-            ret = self._process( packet )
+            try :
+                ret = self._process( packet )
+            except Exception as e :
+                # keep going : the error is counted and kept as the result ( see ResultRing )
+                _log.error( "%s() failed : %s", packet.name(), e )
+                ret = e
 
-            self._received.put( ret ) # also could have added the input timestamp, output timestamp and the packet number     
+            self._received.put( ret, packet.name() ) # also could have added the input timestamp, output timestamp and the packet number     
+
+            self._collect_acks()
 
 
         # # debug
@@ -219,19 +272,29 @@ class Netstation :
 
     ## -----------------------------------------------------------
 
-    def __init__( self ) :
+    def __init__( self, max_wait_ms = queues.DEFAULT_MAX_WAIT_MS,
+                        capacity = DEFAULT_CAPACITY, policy = 'block', seconds_timeout = internal.DEFAULT_TIMEOUT,
+                        results_capacity = DEFAULT_CAPACITY, results_policy = 'drop_oldest' ) :
+        """ see threaded.Netstation.__init__() """
 
-        self._to_send = Queue()
-        self._to_receive = Queue()     
+        self._to_send = queues.ClassQueue( max_wait_ms, capacity, policy, seconds_timeout )
+        self._to_receive = queues.ResultRing( results_capacity, results_policy )
 
         self._netstation_thread = _NetstationThread( self._to_send, self._to_receive )     
 
     ## -----------------------------------------------------------
 
     def _put( self, data ) :
-        """ a shortcut to put sth in the 'to-send' queue """
+        """ a shortcut to put sth in the 'to-send' queue ( in the priority class of the command ) """
+
+        if data is None : # the end marker
+            return self._to_send.put( None )
 
-        self._to_send.put( data )
+        # the command enters here : its number goes along with it to the 'postman'
+        data.seq = trace.next_seq()
+
+        name = data.name()
+        return self._to_send.put( data, queues.command_class( name ), queues.is_barrier( name ) )
 
         # return None     
     
@@ -278,6 +341,126 @@ class Netstation :
     ## -----------------------------------------------------------
 
 
+    def wait_stats( self ) :
+        """ { class name : ( count, mean ms, max ms ) } -- how long the commands have waited for the 'postman' """
+
+        return self._to_send.wait_stats()
+
+    def results_summary( self ) :
+        """
+            the counters of the results over the whole session ( the results themselves are kept
+            only for the last 'results_capacity' commands ) -- see queues.ResultRing.summary()
+        """
+
+        return self._to_receive.summary()
+
+    def last_error( self ) :
+        """ ( time.time(), the command name, the error ) of the last failed command , or None """
+
+        return self._to_receive.summary()[ 'last_error' ]
+
+    def queue_counters( self ) :
+        """ { 'to_send' / 'received' : the drops, blocks etc. of the queue ( see queues.ClassQueue.counters() ) } """
+
+        return { 'to_send' : self._to_send.counters(), 'received' : self._to_receive.counters() }
+
+    def ms_now( self ) :
+        """ the current time in ms as the 'postman' would send it ( see simple.Netstation.ms_now() ) """
+
+        return self._netstation_thread._netstation_object.ms_now()
+
+    def timeline( self ) :
+        """ the timeline.Timeline object of the connection """
+
+        return self._netstation_thread._netstation_object.timeline()
+
+    def event_log( self ) :
+        """ the eventlog.EventLog of the 'postman' ( None until enable_event_log() is processed ) """
+
+        return self._netstation_thread._netstation_object.event_log()
+
+    def value_cache_stats( self ) :
+        """ the counters of the encoded values cache of the 'postman' """
+
+        return self._netstation_thread._netstation_object.value_cache_stats()
+
+    # the queries below are answered here ( a queued command would only return None ) ,
+    # so they are written out and not generated
+
+    def events_sent( self ) :
+        """ the number of events the 'postman' has sent since the session has started """
+
+        return self._netstation_thread._netstation_object.events_sent()
+
+    def events_left( self ) :
+        """ the number of events left in the session budget ( the queued ones are not counted yet ) """
+
+        return self._netstation_thread._netstation_object.events_left()
+
+    def last_rollover_duration( self ) :
+        """ how long the last rollover() took in the 'postman', in seconds ( None if there was no rollover yet ) """
+
+        return self._netstation_thread._netstation_object.last_rollover_duration()
+
+    def pending_acks( self ) :
+        """ the number of the replies the 'postman' has not read yet ( it collects them by itself ) """
+
+        return self._netstation_thread._netstation_object.pending_acks()
+
+    def enable_capture( self, n_records = 4096, dump_path = None ) :
+        """ queue turning the wire capture of the 'postman' on ( see simple.Netstation.enable_capture() ) """
+
+        packet = _Command( 'enable_capture', { 'n_records' : n_records, 'dump_path' : dump_path } )
+        self._put( packet )
+
+    def dump_capture( self, path = None ) :
+        """ write the chunks captured so far to a file ( the ring is copied at once , the 'postman' may keep going ) """
+
+        return self._netstation_thread._netstation_object.dump_capture( path )
+
+    def corked( self ) :
+        """ not here : the socket belongs to the 'postman' thread """
+
+        raise Error( "corked() is not available with threaded_alt : the 'postman' thread owns the socket" )
+
+    def fileno( self ) :
+        """ not here : the socket belongs to the 'postman' thread """
+
+        raise Error( "fileno() is not available with threaded_alt : the 'postman' thread owns the socket" )
+
+    def poll_acks( self, seconds_timeout = 0 ) :
+        """ not here : the 'postman' collects the replies by itself ( see results_summary() ) """
+
+        raise Error( "poll_acks() is not available with threaded_alt : the 'postman' collects the replies ( see results_summary() )" )
+
+    ## -----------------------------------------------------------
+
+    # written out ( not generated below ) : the event is stamped in the calling thread ,
+    # not when the 'postman' gets to it
+
+    def send_event( self, key, timestamp = None, label = None, description = None, table = None, pad = False, schema = None, b_wait = True ) :
+        """ see simple.Netstation.send_event() ; with no 'timestamp' the event is stamped here , by ms_now() """
+
+        if timestamp is None :
+            timestamp = self.ms_now()
+
+        kwargs = {                             \
+                   'key'         : key         ,
+                   'timestamp'   : timestamp   ,
+                   'label'       : label       ,
+                   'description' : description ,
+                   'table'       : table       ,
+                   'pad'         : pad         ,
+                   'schema'      : schema      ,
+                   'b_wait'      : b_wait      \
+                }
+
+        packet = _Command( 'send_event', kwargs )
+        self._put( packet )
+
+    ## -----------------------------------------------------------
+
+
     def _ns_thread_is_running( self ) :
         """ returns True if our 'postman' thread is stil busy with doing something """
 
@@ -330,8 +513,7 @@ class Netstation :
             
             self.process_responses()
 
-        # debug
-        print " egi: stopping ... "
+        _log.info( "egi: stopping ..." )
 
         ## self._disconnect()     
 
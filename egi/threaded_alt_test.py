@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" threaded_alt.py against the local stand-in ( harness.StandIn ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import threaded_alt
+from harness import StandIn
+from faults import LinkModel
+
+
+class SendEventTest( unittest.TestCase ) :
+
+    def test_stamped_in_the_calling_thread( self ) :
+
+        # every reply takes 300 ms : the 'postman' is busy with BeginSession() when the event is queued
+        stand_in = StandIn( LinkModel( seed = 1, rtt_ms = ( 'fixed', 300 ) ) )
+
+        ns = threaded_alt.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+
+        ns.BeginSession()
+        ms_called = ns.ms_now()
+        ns.send_event( 'test' )
+
+        ns.finalize( 1.0 )
+
+        arrivals = stand_in.arrivals()
+
+        self.assertEqual( len( arrivals ), 1 )
+        ns_arrival, key, timestamp, index = arrivals[0]
+
+        self.assertEqual( key, 'test' )
+        self.assertTrue( abs( timestamp - ms_called ) < 50, ( timestamp, ms_called ) )
+
+
+class QueriesTest( unittest.TestCase ) :
+
+    def test_answered_in_the_calling_thread( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded_alt.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+
+        try :
+
+            self.assertEqual( ns.events_sent(), 0 )
+            self.assertEqual( ns.pending_acks(), 0 )
+            self.assertEqual( ns.last_rollover_duration(), None )
+
+            self.assertRaises( threaded_alt.Error, ns.corked )
+            self.assertRaises( threaded_alt.Error, ns.fileno )
+            self.assertRaises( threaded_alt.Error, ns.poll_acks )
+
+        finally :
+            ns.finalize( 0.2 )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" threaded.py against the local stand-in ( harness.StandIn ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import time
+
+import threaded
+from clock import ns_monotonic
+from harness import StandIn
+
+
+class _SlowWriter :
+    """ a netstation object whose send_encoded() takes 20 ms before the write """
+
+    def send_encoded( self, message, b_wait = True ) :
+
+        time.sleep( 0.02 )
+        self._ns_last_encoded_write = ns_monotonic()
+
+        return True
+
+
+class ScheduledTest( unittest.TestCase ) :
+
+    def test_error_is_measured_at_the_write( self ) :
+
+        errors = threaded.deque( maxlen = 2 )
+        scheduled = threaded._Scheduled( 'stim', 0, 'message', ns_monotonic(), errors )
+
+        dispatch = scheduled.invoke( _SlowWriter() )
+
+        self.assertTrue( dispatch.error_ms >= 20, dispatch )
+        self.assertEqual( list( errors ), [ ( 'stim', 0, dispatch.error_ms ) ] )
+
+    def test_history_is_bounded( self ) :
+
+        scheduler = threaded._SchedulerThread( None )
+        self.assertEqual( scheduler._errors.maxlen, threaded.DISPATCH_HISTORY )
+
+    def test_scheduled_event_is_sent( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+
+        ns.sync()
+        at = ns.ms_now() + 50
+        ns.schedule_event( 'stim', at )
+
+        time.sleep( 0.2 )
+        errors = ns.dispatch_errors()
+
+        ns.finalize( 0.2 )
+        arrivals = stand_in.arrivals()
+
+        self.assertEqual( [ ( key, timestamp ) for ns_arrival, key, timestamp, index in arrivals ], [ ( 'stim', at ) ] )
+        self.assertEqual( len( errors ), 1 )
+        self.assertTrue( 0 <= errors[0][2] < 20, errors )
+
+    def test_scheduled_events_are_not_late( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+
+        ns.sync()
+        start = ns.ms_now() + 50
+        onsets = [ start + 10 * i for i in range( 10 ) ] # closer than the default lead
+        for at in onsets :
+            ns.schedule_event( 'stim', at )
+
+        time.sleep( 0.3 )
+        timeline = ns.timeline()
+
+        ns.finalize( 0.2 )
+        arrivals = stand_in.arrivals()
+
+        self.assertEqual( [ timestamp for ns_arrival, key, timestamp, index in arrivals ], onsets )
+
+        # with the default lead every event is on the server before its onset
+        lateness_ms = [ ( ns_arrival - timeline.ns_at( timestamp ) ) * 1e-6 for ns_arrival, key, timestamp, index in arrivals ]
+        self.assertTrue( max( lateness_ms ) < 0, lateness_ms )
+
+        # and sending one does not wait for the ack of the one before
+        summary = ns.results_summary()
+        self.assertEqual( summary['unanswered'], len( onsets ) )
+        self.assertEqual( summary['acks'], len( onsets ) + 1 ) # and the sync
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
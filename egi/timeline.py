@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    The time line of a connection : the 64-bit monotonic clock ( clock.ns_monotonic() )
+    mapped to the 32-bit millisecond field of the wire ( the sync 'T' value and the event timestamps ) .
+
+    The wire value is counted from an epoch : ( the monotonic time , the wire value at that moment ) .
+    It starts from what ms_localtime() would give , so the timestamps made by ms_localtime()
+    ( by the older code ) agree with it until the first rebase -- instead of raising an exception where
+    ms_localtime() wraps, the time line moves the epoch back by REBASE_PERIOD_MS ( "rebases" )
+    together with a sync :
+
+        -- REBASE_AHEAD_MS before the limit it asks for a resync ( 'resync_due' ) , which simple.Netstation
+           sends before the next event ( or psychopy.FlipMarker at its next call outside of the flip ) ;
+        -- the 'T' value of that sync is taken by sync_ms() , which moves the epoch first :
+           the new base reaches Netstation with the very message that declares it ;
+        -- if no sync comes before the limit, ms() rebases by itself and the base is 'stale'
+           until the next sync ( then even the pre-packed events resync first ) .
+
+    A stamp taken before a rebase ( in another thread, in another process , or given as 'at' ahead
+    of time ) is sent after it : current_ms() moves such a stamp to the new base -- a stamp that far
+    ahead of now can only be from the epoch before .
+
+    ms() reads the epoch ( a single tuple ) without a lock ; the rebases and the flags
+    are changed under one , ms() can be called from any thread .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+from clock import ns_monotonic
+
+from threading import Lock
+import time
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+# ms_localtime() is ( time.time() % 1000000 ) in ms : the wire values stay below this
+WIRE_LIMIT_MS = 1000000 * 1000
+
+# how long before the limit the resync ( and the rebase with it ) is asked for
+REBASE_AHEAD_MS = 60 * 1000
+
+# how far a rebase moves the wire values back ( they stay positive : the rebase comes this late at least )
+REBASE_PERIOD_MS = WIRE_LIMIT_MS - REBASE_AHEAD_MS
+
+
+class Timeline( object ) :
+
+    """ the monotonic time line of a connection and its 32-bit wire projection """
+
+    def __init__( self ) :
+
+        self._lock = Lock()
+
+        self.n_rebases = 0
+        self.reset()
+
+    def reset( self ) :
+        """ start a new epoch ( at connect() ) : the wire value continues ms_localtime() from now on """
+
+        ns = ns_monotonic()
+        wire_ms = int( ( time.time() % 1000000 ) * 1000 )
+
+        with self._lock :
+
+            self._epoch = ( ns, wire_ms )
+
+            # 'resync_due' : a sync is wanted , 'stale' : the epoch has moved and Netstation does not know it yet
+            self.resync_due = False
+            self.stale = False
+
+    ## -----------------------------------------------------------
+
+    def ns( self ) :
+        """ the 64-bit time line itself ( ns , never wraps ) """
+
+        return ns_monotonic()
+
+    def ms( self, ns = None ) :
+        """ the wire value ( ms ) for the moment 'ns' of the time line ( now by default ) """
+
+        if ns is None :
+            ns = ns_monotonic()
+
+        ns_epoch, wire_epoch = self._epoch
+
+        wire_ms = wire_epoch + ( ns - ns_epoch ) // 1000000
+
+        if wire_ms >= REBASE_PERIOD_MS :
+
+            if wire_ms >= WIRE_LIMIT_MS : # no sync in time
+                return self._rebase( ns, True )
+
+            if not self.resync_due :
+                with self._lock :
+                    self.resync_due = True
+
+        return wire_ms
+
+    def current_ms( self, wire_ms, ns = None ) :
+        """ the stamp 'wire_ms' ( taken by ms() earlier , maybe before a rebase ) in the current base at 'ns' ( now by default ) """
+
+        # also the ms() of the moment : the stamp may be the first to tell that a resync is due
+        now_ms = self.ms( ns )
+
+        if wire_ms - now_ms > REBASE_PERIOD_MS // 2 :
+            return wire_ms - REBASE_PERIOD_MS
+
+        return wire_ms
+
+    def sync_ms( self, ns = None ) :
+        """ the 'T' value of a sync at the moment 'ns' ( now by default ) : rebases first if the limit is near """
+
+        if ns is None :
+            ns = ns_monotonic()
+
+        ns_epoch, wire_epoch = self._epoch
+
+        wire_ms = wire_epoch + ( ns - ns_epoch ) // 1000000
+
+        if wire_ms >= REBASE_PERIOD_MS :
+            return self._rebase( ns, False )
+
+        return wire_ms
+
+    def _rebase( self, ns, b_stale ) :
+        """ move the epoch back by the rebase period ( if still needed ) ; returns the wire value for 'ns' """
+
+        with self._lock :
+
+            ns_epoch, wire_epoch = self._epoch
+
+            # another thread may have done it already
+            if wire_epoch + ( ns - ns_epoch ) // 1000000 >= REBASE_PERIOD_MS :
+
+                while wire_epoch + ( ns - ns_epoch ) // 1000000 >= REBASE_PERIOD_MS :
+                    wire_epoch -= REBASE_PERIOD_MS
+
+                self._epoch = ( ns_epoch, wire_epoch )
+
+                self.n_rebases += 1
+
+                if b_stale :
+                    self.resync_due = True
+                    self.stale = True
+
+            return wire_epoch + ( ns - ns_epoch ) // 1000000
+
+    def ns_at( self, wire_ms ) :
+        """ the moment of the time line the wire value 'wire_ms' stands for ( in the current epoch ) """
+
+        ns_epoch, wire_epoch = self._epoch
+
+        return ns_epoch + int( ( wire_ms - wire_epoch ) * 1000000 )
+
+    def synced( self ) :
+        """ the resync has been sent ( its 'T' value taken by sync_ms() ) """
+
+        with self._lock :
+            self.resync_due = False
+            self.stale = False
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
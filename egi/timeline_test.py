@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" timeline.py ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+import threading
+
+import timeline
+from timeline import Timeline, WIRE_LIMIT_MS, REBASE_AHEAD_MS, REBASE_PERIOD_MS
+from clock import ns_monotonic
+from harness import StandIn
+import simple
+import threaded
+import multiprocessed
+
+import time
+
+
+def _near_the_limit( ms_left ) :
+    """ a time line whose wire value is 'ms_left' below the limit now """
+
+    tl = Timeline()
+    tl._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - ms_left )
+
+    return tl
+
+
+class TimelineTest( unittest.TestCase ) :
+
+    def test_far_from_the_limit( self ) :
+
+        tl = Timeline()
+        tl._epoch = ( 0, 1000 )
+
+        self.assertEqual( tl.ms( 5000000 ), 1005 )
+        self.assertEqual( tl.ns_at( 1005 ), 5000000 )
+        self.assertFalse( tl.resync_due )
+
+    def test_resync_asked_ahead_of_the_limit( self ) :
+
+        tl = _near_the_limit( REBASE_AHEAD_MS // 2 )
+
+        # the old base is still good : no rebase yet
+        self.assertTrue( tl.ms() >= REBASE_PERIOD_MS )
+        self.assertTrue( tl.resync_due )
+        self.assertFalse( tl.stale )
+        self.assertEqual( tl.n_rebases, 0 )
+
+        # the sync takes the new base with it
+        wire_ms = tl.sync_ms()
+        tl.synced()
+
+        self.assertTrue( 0 <= wire_ms < REBASE_AHEAD_MS )
+        self.assertEqual( tl.n_rebases, 1 )
+        self.assertFalse( tl.resync_due )
+        self.assertTrue( abs( tl.ms() - wire_ms ) <= 1 )
+
+    def test_no_sync_in_time( self ) :
+
+        tl = _near_the_limit( 10 )
+
+        wire_ms = tl.ms( ns_monotonic() + 20 * 1000000 )
+
+        self.assertTrue( 0 <= wire_ms < WIRE_LIMIT_MS )
+        self.assertTrue( tl.stale and tl.resync_due )
+
+        tl.sync_ms()
+        tl.synced()
+
+        self.assertFalse( tl.stale or tl.resync_due )
+        self.assertEqual( tl.n_rebases, 1 )
+
+    def test_one_rebase_for_many_threads( self ) :
+
+        tl = _near_the_limit( REBASE_AHEAD_MS // 2 )
+        values = []
+
+        def stamp() :
+            values.append( tl.sync_ms() )
+
+        threads = [  threading.Thread( target = stamp )  for i in xrange( 8 )  ]
+        for t in threads :
+            t.start()
+        for t in threads :
+            t.join()
+
+        self.assertEqual( tl.n_rebases, 1 )
+        self.assertTrue( max( values ) < REBASE_AHEAD_MS )
+
+    def test_stamp_before_the_rebase( self ) :
+
+        tl = _near_the_limit( REBASE_AHEAD_MS // 2 )
+
+        stamp = tl.ms()
+        self.assertEqual( tl.current_ms( stamp ), stamp )
+
+        tl.sync_ms()
+        tl.synced()
+
+        self.assertEqual( tl.current_ms( stamp ), stamp - REBASE_PERIOD_MS )
+
+        # the new ones and those ahead of now ( scheduled ) stay
+        now = tl.ms()
+        self.assertEqual( tl.current_ms( now ), now )
+        self.assertEqual( tl.current_ms( now + 5000 ), now + 5000 )
+
+    def test_stamp_tells_the_resync_is_due( self ) :
+
+        tl = _near_the_limit( REBASE_AHEAD_MS // 2 )
+
+        tl.current_ms( REBASE_PERIOD_MS )
+        self.assertTrue( tl.resync_due )
+
+
+class NetstationTest( unittest.TestCase ) :
+
+    def test_event_stamped_after_the_resync( self ) :
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+        ns.sync()
+
+        tl = ns.timeline()
+        tl._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - REBASE_AHEAD_MS // 2 )
+
+        ns.send_event( 'test' )
+
+        ns.EndSession()
+        ns.disconnect()
+
+        arrivals = stand_in.arrivals()
+
+        self.assertEqual( len( arrivals ), 1 )
+        self.assertTrue( arrivals[0][2] < REBASE_AHEAD_MS, arrivals )
+        self.assertEqual( tl.n_rebases, 1 )
+        self.assertFalse( tl.resync_due )
+
+    def _assert_new_base( self, arrivals, n = 1 ) :
+        """ the events have come in the base of the resync before them """
+
+        self.assertEqual( len( arrivals ), n )
+
+        for ns_arrival, key, timestamp, index in arrivals :
+            self.assertTrue( timestamp < REBASE_AHEAD_MS, arrivals )
+
+    def test_explicit_stamp_before_the_resync( self ) :
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+        ns.sync()
+
+        tl = ns.timeline()
+        tl._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - REBASE_AHEAD_MS // 2 )
+
+        stamp = ns.ms_now()
+        ns.send_event( 'test', stamp )
+
+        # packed ahead , sent after the rebase
+        message = simple._DataFormat().pack( 'pack', stamp )
+        ns.send_encoded( message )
+
+        ns.EndSession()
+        ns.disconnect()
+
+        self._assert_new_base( stand_in.arrivals(), 2 )
+        self.assertEqual( tl.n_rebases, 1 )
+
+    def test_threaded_stamp_before_the_resync( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+        ns.sync()
+
+        tl = ns.timeline()
+        tl._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - REBASE_AHEAD_MS // 2 )
+
+        # stamped here , resynced by the 'postman'
+        ns.send_event( 'test' )
+
+        ns.finalize( 0.2 )
+
+        self._assert_new_base( stand_in.arrivals() )
+        self.assertEqual( tl.n_rebases, 1 )
+
+    def test_scheduled_across_the_rebase( self ) :
+
+        stand_in = StandIn()
+
+        ns = threaded.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+        ns.sync()
+
+        tl = ns.timeline()
+        tl._epoch = ( ns_monotonic(), REBASE_PERIOD_MS - 20 )
+
+        at = ns.ms_now() + 50
+        ns.schedule_event( 'stim', at, lead_ms = 0 )
+
+        # the base moves before the event is due
+        time.sleep( 0.03 )
+        ns.sync()
+
+        time.sleep( 0.2 )
+        ns.finalize( 0.2 )
+
+        self._assert_new_base( stand_in.arrivals() )
+        self.assertEqual( tl.n_rebases, 1 )
+
+    def test_multiprocessed_shares_the_base( self ) :
+
+        stand_in = StandIn()
+
+        ns = multiprocessed.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+        ns.sync()
+
+        tl = ns.timeline()
+        tl._epoch = ( ns_monotonic(), WIRE_LIMIT_MS - REBASE_AHEAD_MS // 2 )
+
+        # stamped in this process , the resync is sent by the 'postman'
+        ns.send_event( 'test' )
+
+        ns.finalize( 2 )
+
+        self._assert_new_base( stand_in.arrivals() )
+        self.assertEqual( tl.n_rebases, 1 )
+        self.assertFalse( tl.resync_due )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+"""
+
+    Tracepoints along the send pipeline -- for the profilers and the timing logs
+    that live outside of the package :
+
+        def hook( name, ns, command_id, seq ) :
+            my_log.append( ( name, ns, command_id, seq ) )
+
+        egi.trace.attach( 'write.start', hook )
+
+    The hook gets the name of the tracepoint, the monotonic time in ns ( clock.ns_monotonic() ) ,
+    the id of the command : the protocol code ( 'Q', 'A', 'T', 'D' ... ) , the event key
+    for 'pack.*' and the method name for 'queue.*' -- and the sequence number of the command .
+
+    The sequence number is given once , where the command enters the package ( the public method
+    of simple.Netstation , threaded.Netstation._put() or schedule_event() ) and goes along with it :
+    through the command queue to the 'postman' thread , into the corked writes , to its reply
+    read later by poll_acks() -- so all the tracepoints of one command have the same one .
+    A command sent by another one ( the resync before an event ) goes under the number of that one .
+
+    The tracepoints :
+
+        pack.start, pack.end     -- _DataFormat.pack()
+        write.start, write.end   -- Socket.write() ( of the corked ones -- at the flush , one per message )
+        response.read            -- a reply read by GetServerResponse() ( or poll_acks() ) , by its code
+        queue.put, queue.get     -- the command queue of threaded.Netstation
+        sync.done                -- sync() has got both replies
+
+    With no hooks attached a tracepoint costs a single attribute check :
+
+        if _TP_WRITE_START.hooks : _TP_WRITE_START.fire( code )
+
+    ( and a public command -- the check of 'enabled' ) .
+
+"""
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+from clock import ns_monotonic
+
+from itertools import count
+import threading
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+class Tracepoint( object ) :
+
+    """ a named point with the hooks to call ; 'hooks' is None ( false ) while there are none """
+
+    __slots__ = ( 'name', 'hooks' )
+
+    def __init__( self, name ) :
+
+        self.name = name
+        self.hooks = None
+
+    def attach( self, hook ) :
+
+        self.hooks = ( self.hooks or () ) + ( hook, )
+        _update_enabled()
+
+    def detach( self, hook ) :
+
+        hooks = tuple( h for h in ( self.hooks or () ) if h is not hook )
+        self.hooks = hooks or None
+        _update_enabled()
+
+    def fire( self, command_id, seq = None ) :
+        """ call the hooks ( the caller has checked there are some ) ; 'seq' is that of the current command by default """
+
+        ns = ns_monotonic()
+
+        if seq is None :
+            seq = current()
+
+        # a tuple : attaching / detaching from another thread does not break the loop
+        for hook in self.hooks :
+            hook( self.name, ns, command_id, seq )
+
+
+# -----------------------------------------------------------------------------
+
+# the sequence numbers of the commands ( next() of a count is atomic under the GIL )
+_seqs = count( 1 )
+
+# the command the thread is executing
+_local = threading.local()
+
+# are there any hooks at all ? ( the commands skip the numbering otherwise )
+enabled = False
+
+
+def next_seq() :
+    """ a new command sequence number """
+
+    return next( _seqs )
+
+
+def current() :
+    """ the sequence number of the command this thread is executing ( None outside of one ) """
+
+    return getattr( _local, 'seq', None )
+
+
+class command( object ) :
+
+    """ with command( seq ) : ... -- the tracepoints fired inside are of the command 'seq' ( a new one by default ) """
+
+    __slots__ = ( 'seq', '_outer' )
+
+    def __init__( self, seq = None ) :
+
+        self.seq = next_seq() if seq is None else seq
+
+    def __enter__( self ) :
+
+        self._outer = current()
+        _local.seq = self.seq
+
+        return self.seq
+
+    def __exit__( self, *exc_info ) :
+
+        _local.seq = self._outer
+
+
+# -----------------------------------------------------------------------------
+
+_points = {}
+
+def point( name ) :
+    """ the tracepoint with the given name ( created on the first request ) """
+
+    tp = _points.get( name )
+    if tp is None :
+        tp = _points[ name ] = Tracepoint( name )
+
+    return tp
+
+
+def names() :
+    """ the names of the known tracepoints """
+
+    return sorted( _points.keys() )
+
+
+def attach( name, hook ) :
+    """ call hook( name, ns, command_id, seq ) at the tracepoint ( '*' : at all of them ) """
+
+    for tp in _select( name ) :
+        tp.attach( hook )
+
+
+def detach( name, hook ) :
+    """ the reverse of attach() """
+
+    for tp in _select( name ) :
+        tp.detach( hook )
+
+
+def detach_all() :
+    """ remove all the hooks from all the tracepoints """
+
+    for tp in _points.itervalues() :
+        tp.hooks = None
+
+    _update_enabled()
+
+
+def _update_enabled() :
+
+    global enabled
+    enabled = any(  tp.hooks  for tp in _points.itervalues()  )
+
+
+def _select( name ) :
+
+    if name == '*' :
+        return _points.values()
+
+    if name not in _points :
+        raise KeyError( "no tracepoint '%s' ( known are : %s )" % ( name, ', '.join( names() ) ) )
+
+    return [ _points[ name ] ]
+
+
+# -----------------------------------------------------------------------------
+
+# the tracepoints of the package ( the modules keep their own references )
+
+PACK_START = point( 'pack.start' )
+PACK_END = point( 'pack.end' )
+
+WRITE_START = point( 'write.start' )
+WRITE_END = point( 'write.end' )
+
+RESPONSE_READ = point( 'response.read' )
+
+QUEUE_PUT = point( 'queue.put' )
+QUEUE_GET = point( 'queue.get' )
+
+SYNC_DONE = point( 'sync.done' )
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__" :
+
+    print __doc__
+    print "\n === \n"
+    # print "module dir() listing: ", __dict__.keys()
+    print "module dir() listing: ", dir()
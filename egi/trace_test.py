@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: cp1251 -*-
+
+""" trace.py ( and the tracepoints of simple.Netstation , against the local stand-in ) ; python -m unittest discover -s egi -p "*_test.py" """
+
+import unittest
+
+import trace
+from harness import StandIn
+import simple
+import threaded
+
+
+class TracepointTest( unittest.TestCase ) :
+
+    def tearDown( self ) :
+
+        trace.detach_all()
+
+    def test_attach_detach( self ) :
+
+        calls = []
+        hook = lambda name, ns, command_id, seq : calls.append( ( name, command_id, seq ) )
+
+        tp = trace.point( 'test.point' )
+        self.assertFalse( tp.hooks )
+
+        trace.attach( 'test.point', hook )
+        self.assertTrue( trace.enabled )
+        tp.fire( 'x' )
+
+        with trace.command( 7 ) :
+            tp.fire( 'y' )
+
+        trace.detach( 'test.point', hook )
+        self.assertFalse( tp.hooks )
+        self.assertFalse( trace.enabled )
+
+        self.assertEqual( calls, [ ( 'test.point', 'x', None ), ( 'test.point', 'y', 7 ) ] )
+
+    def test_unknown_point( self ) :
+
+        self.assertRaises( KeyError, trace.attach, 'no.such.point', lambda *args : None )
+
+    def _attach( self ) :
+
+        calls = []
+        trace.attach( '*', lambda name, ns, command_id, seq : calls.append( ( name, ns, command_id, seq ) ) )
+
+        return calls
+
+    def test_send_pipeline( self ) :
+
+        calls = self._attach()
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+        ns.sync()
+
+        del calls[:]
+        ns.send_event( 'stim' )
+
+        trace.detach_all()
+
+        ns.EndSession()
+        ns.disconnect()
+        stand_in.arrivals()
+
+        names = [  ( name, command_id )  for name, t_ns, command_id, seq in calls  ]
+
+        self.assertEqual( names[:2], [ ( 'pack.start', 'stim' ), ( 'pack.end', 'stim' ) ] )
+        self.assertTrue( ( 'write.start', 'D' ) in names and ( 'write.end', 'D' ) in names, names )
+        self.assertEqual( names[-1][0], 'response.read' )
+
+        times = [  t_ns  for name, t_ns, command_id, seq in calls  ]
+        self.assertEqual( times, sorted( times ) )
+
+        # one command
+        seqs = set(  seq  for name, t_ns, command_id, seq in calls  )
+        self.assertEqual( len( seqs ), 1 )
+        self.assertFalse( None in seqs )
+
+    def test_corked_writes( self ) :
+
+        calls = self._attach()
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+
+        del calls[:]
+        ns.sync()
+
+        trace.detach_all()
+
+        ns.EndSession()
+        ns.disconnect()
+        stand_in.arrivals()
+
+        # a tracepoint for every message of the flush , both of the sync
+        writes = [  ( command_id, seq )  for name, t_ns, command_id, seq in calls if name == 'write.start'  ]
+
+        self.assertEqual( [ code for code, seq in writes ], [ 'A', 'T' ] )
+        self.assertEqual( writes[0][1], writes[1][1] )
+        self.assertEqual( set(  seq for name, t_ns, command_id, seq in calls  ), set( [ writes[0][1] ] ) )
+
+    def test_acks_read_later( self ) :
+
+        calls = self._attach()
+
+        stand_in = StandIn()
+
+        ns = simple.Netstation()
+        ns.connect( '127.0.0.1', stand_in.port )
+        ns.BeginSession()
+        ns.sync()
+
+        del calls[:]
+        for i in xrange( 3 ) :
+            ns.send_event( 'stim', b_wait = False )
+
+        ns.poll_acks( seconds_timeout = 1.0 )
+        while ns.pending_acks() :
+            ns.poll_acks( seconds_timeout = 1.0 )
+
+        trace.detach_all()
+
+        ns.EndSession()
+        ns.disconnect()
+        stand_in.arrivals()
+
+        writes = [  seq  for name, t_ns, command_id, seq in calls if name == 'write.start'  ]
+        replies = [  seq  for name, t_ns, command_id, seq in calls if name == 'response.read'  ]
+
+        self.assertEqual( len( set( writes ) ), 3 )
+        self.assertEqual( replies, writes )
+
+    def test_threaded( self ) :
+
+        calls = self._attach()
+
+        stand_in = StandIn()
+
+        ns = threaded.Netstation()
+        ns.initialize( '127.0.0.1', stand_in.port )
+        ns.sync()
+        ns.send_event( 'stim' )
+
+        ns.finalize( 0.2 )
+        stand_in.arrivals()
+
+        trace.detach_all()
+
+        by_seq = {}
+        for name, t_ns, command_id, seq in calls :
+            by_seq.setdefault( seq, [] ).append( ( name, command_id ) )
+
+        # numbered as queued , the same number in the 'postman' thread
+        event = [  names  for names in by_seq.values() if ( 'queue.put', 'send_event' ) in names  ]
+        self.assertEqual( len( event ), 1 )
+
+        for point in [ ( 'queue.get', 'send_event' ), ( 'pack.start', 'stim' ), ( 'write.start', 'D' ), ( 'response.read', 'Z' ) ] :
+            self.assertTrue( point in event[0], event )
+
+
+if __name__ == "__main__" :
+
+    unittest.main()